@@ -0,0 +1,235 @@
+"""
+annual_update.py
+
+Incremental annual LOTTR, TTTR and PHED: ingests one newly delivered month
+of NPMRDS data into a persistent per-TMC state store and refreshes the
+annual measures from the state, without rereading earlier months.
+
+The state is an HDF5 file holding, per (year, month):
+    /lottr/yYYYY/mMM   LOTTR travel time histogram (tmc_code, period, bin,
+                       count), see tt_hist.py
+    /tttr/yYYYY/mMM    TTTR (truck) travel time histogram
+    /phed/yYYYY/mMM    per-TMC TED_seg partial sums and AADT splits
+and running totals /lottr/total and /tttr/total of the monthly histograms.
+Histogram counts are integers, so a month is added to or evicted from the
+totals exactly, in time proportional to that month's histogram; LOTTR/TTTR
+percentiles are then read from the totals, as from a full-year run.
+TED_seg partial sums are summed over the kept months at refresh (one row
+per TMC per month).
+
+Re-ingesting a month replaces it. With a rolling window of N months, the
+oldest months beyond N are evicted after each update.
+
+Usage:
+>>>python annual_update.py
+"""
+
+import os
+import pandas as pd
+import datetime as dt
+import lottr_calc
+import lottr_truck
+import phed_calc
+from npmrds_io import read_npmrds
+from npmrds_schema import table_columns
+from npmrds_store import key_month, partition_key
+from periods import LOTTR_PERIODS, period_codes
+from profiling import profiled
+from reference_cache import load_reference
+from tmc_dim import network_dim
+from tt_hist import file_histogram, hist_period_ttr, merge_histograms
+
+
+# Measures kept as monthly histograms with running totals
+HISTOGRAMS = ['lottr', 'tttr']
+
+
+def state_key(measure, year, month):
+    """Returns the state key of a measure's monthly partial."""
+    return '/' + measure + partition_key(year, month)
+
+
+def total_key(measure):
+    """Returns the state key of a measure's running histogram total."""
+    return '/' + measure + '/total'
+
+
+def state_months(store):
+    """Returns the sorted (year, month) partitions held in an open state."""
+    prefix = '/phed/y'
+    return sorted(key_month(key[len('/phed'):]) for key in store.keys()
+                  if key.startswith(prefix))
+
+
+def add_to_total(store, measure, df_hist, sign=1):
+    """Adds (sign=1) or subtracts (sign=-1) a monthly histogram from the
+    measure's running total, dropping emptied bins."""
+    df_hist = df_hist.assign(count=sign * df_hist['count'])
+    if total_key(measure) in store.keys():
+        df_hist = merge_histograms([store[total_key(measure)], df_hist])
+    df_hist = df_hist[df_hist['count'] != 0].reset_index(drop=True)
+    store.put(total_key(measure), df_hist)
+
+
+def remove_month(store, year, month):
+    """Evicts a month's partials from an open state."""
+    print("Evicting {0}-{1:02d}...".format(year, month))
+    for measure in HISTOGRAMS:
+        key = state_key(measure, year, month)
+        if key in store.keys():
+            add_to_total(store, measure, store[key], -1)
+            store.remove(key)
+    if state_key('phed', year, month) in store.keys():
+        store.remove(state_key('phed', year, month))
+
+
+def put_month(store, year, month, partials):
+    """Adds a month's partials to an open state, replacing the month if it
+    is already there.
+    Args: store, an open pandas HDFStore.
+          year, month, the month ingested.
+          partials, a dict of monthly partial dataframes keyed by 'lottr',
+                    'tttr' and 'phed'.
+    """
+    if (year, month) in state_months(store):
+        remove_month(store, year, month)
+    for measure in HISTOGRAMS:
+        store.put(state_key(measure, year, month), partials[measure])
+        add_to_total(store, measure, partials[measure])
+    store.put(state_key('phed', year, month), partials['phed'])
+
+
+def evict(store, window):
+    """Evicts the oldest months beyond a rolling window of months."""
+    months = state_months(store)
+    for year, month in months[:max(len(months) - window, 0)]:
+        remove_month(store, year, month)
+
+
+@profiled
+def month_partials(all_path, truck_path, refs):
+    """Builds the monthly partials from one month of NPMRDS data.
+    Args: all_path, the month's all vehicle csv file.
+          truck_path, the month's Truck csv file.
+          refs, a dict of reference tables, see annual_measures().
+    Returns: a dict of partial dataframes keyed by 'lottr', 'tttr' and
+             'phed'.
+    """
+    df_lottr = file_histogram(all_path, LOTTR_PERIODS, hours=range(6, 20))
+    df_tttr = lottr_truck.quarter_histogram(truck_path, all_path)
+
+    df = read_npmrds(all_path, usecols=table_columns('npmrds', 'phed'),
+                     hours=phed_calc.PEAK_HOURS, dates=phed_calc.PEAK_DAYS,
+                     tmcs=refs['phed_urban']['Tmc'])
+    dim = phed_calc.phed_dim(refs['phed_urban'], refs['phed_meta'],
+                             refs['here'])
+    df_phed = phed_calc.calc_ted_seg(df, dim, refs['peak'])
+    df_phed['tmc_code'] = df_phed['tmc_code'].astype(str)
+
+    return {'lottr': df_lottr, 'tttr': df_tttr, 'phed': df_phed}
+
+
+@profiled
+def annual_measures(store, refs):
+    """Calculates the annual measures from an open state.
+    Args: store, an open pandas HDFStore.
+          refs, a dict of reference tables: 'urban' and 'meta' (LOTTR),
+                'truck_meta' (TTTR), 'phed_urban', 'peak', 'phed_meta' and
+                'here' (PHED).
+    Returns: a dict with the LOTTR interstate and non-interstate percent
+             reliability ('lottr'), the TTTR index ('tttr') and PHED per
+             capita ('phed').
+    """
+    tmcs = [str(tmc) for tmc in refs['urban']['Tmc']]
+
+    df_hist = store[total_key('lottr')]
+    df = hist_period_ttr(df_hist[df_hist['tmc_code'].isin(tmcs)], 80,
+                         period_codes(LOTTR_PERIODS))
+    df = lottr_calc.reliability_results(
+        df, network_dim(refs['urban'], refs['meta']))
+    lottr = lottr_calc.calc_pct_reliability(df)
+
+    df = lottr_truck.hist_travel_times([store[total_key('tttr')]], tmcs)
+    df, tttr = lottr_truck.freight_results(
+        df, network_dim(refs['urban'], refs['truck_meta']))
+
+    # TED_seg partial sums add up; AADT splits are per TMC constants
+    df = pd.concat([store[state_key('phed', year, month)]
+                    for year, month in state_months(store)],
+                   ignore_index=True, sort=False)
+    df = df.groupby('tmc_code', as_index=False).agg(
+        {'TED_seg': 'sum', 'pct_auto': 'max', 'pct_bus': 'max',
+         'pct_truck': 'max'})
+    df = phed_calc.TED_summation(df)
+    phed = phed_calc.per_capita_TED(df['TED'].sum())
+
+    return {'lottr': lottr, 'tttr': tttr, 'phed': phed}
+
+
+@profiled
+def update(state_path, year, month, all_path, truck_path, refs, window=12):
+    """Ingests one month of NPMRDS data and refreshes the annual measures.
+    Args: state_path, the HDF5 state file (created if missing).
+          year, month, the month delivered.
+          all_path, truck_path, the month's all vehicle and Truck csv files.
+          refs, a dict of reference tables, see annual_measures().
+          window, the number of most recent months kept (None keeps all).
+    Returns: a dict of annual measures, see annual_measures().
+    """
+    partials = month_partials(all_path, truck_path, refs)
+    with pd.HDFStore(state_path, mode='a') as store:
+        put_month(store, year, month, partials)
+        if window is not None:
+            evict(store, window)
+        print("State holds months {0}".format(state_months(store)))
+        return annual_measures(store, refs)
+
+
+@profiled
+def main():
+    """Main script to ingest a new month and refresh the annual measures."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+
+    # Month delivered
+    year, month = 2020, 1
+    drive_path = 'H:/map21/2020/data/'
+    month_end = '{0}-{1:02d}'.format(year, month)
+    all_path = os.path.join(
+        os.path.dirname(__file__),
+        drive_path + 'pdx-3co-all-15min/' + month_end + '.csv')
+    truck_path = os.path.join(
+        os.path.dirname(__file__),
+        drive_path + 'pdx-3co-trucks-15min/' + month_end + '.csv')
+    state_path = os.path.join(os.path.dirname(__file__),
+                              drive_path + 'annual_state.h5')
+
+    refs = {
+        'urban': load_reference('metro_network', 'lottr'),
+        'meta': load_reference(
+            'tmc_identification', 'lottr',
+            path=os.path.join(os.path.dirname(__file__),
+                              drive_path + 'pdx-3co-all-15min/'
+                              + 'TMC_Identification.csv')),
+        'phed_urban': load_reference('urban_network', 'phed'),
+        'peak': load_reference('peak_factors', 'phed'),
+        'here': load_reference('here', 'phed'),
+    }
+    refs['truck_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'tttr')]
+    refs['phed_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'phed')]
+
+    results = update(state_path, year, month, all_path, truck_path, refs)
+    print("LOTTR percent reliable (interstate, non-interstate): {0}"
+          .format(results['lottr']))
+    print("TTTR index: {0}".format(results['tttr']))
+    print("PHED per capita: {0}".format(round(results['phed'], 2)))
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+benchmark.py
+
+Benchmarks the measure pipelines on synthetic NPMRDS data.
+
+For each scale (TMCs x days), generates a synthetic data set once (see
+synth_npmrds.py) and runs every benchmark in a fresh worker process: the
+inputs are loaded first (untimed, except for the loader and run_measures
+benchmarks, which time the loading), then the function is timed. Each
+result records the input rows, seconds, throughput (rows/s), the peak RSS
+after loading the inputs and the peak RSS of the whole benchmark, and is
+written to benchmark_results.csv so runs can be compared.
+
+Peak RSS comes from /proc on Linux and the resource module elsewhere (on
+Windows, where neither exists, it is reported as NaN).
+
+Usage:
+>>>python benchmark.py                  # 1k, 10k and 50k TMCs x 1 year
+>>>python benchmark.py 1000x30 5000x30  # other TMCs x days scales
+"""
+
+import os
+import sys
+import time
+import pandas as pd
+import datetime as dt
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import lottr_calc
+import lottr_truck
+import phed_calc
+from calendar_keys import add_calendar_keys
+from hourly_profile import MIN_PROFILE, PCTILE_PROFILE, hourly_profile
+from npmrds_io import read_npmrds
+from npmrds_schema import measure_columns, table_columns
+from npmrds_store import read_store
+from periods import LOTTR_PERIODS, assign_period
+from phed_plus_plus import Phed
+from profiling import peak_rss_mb
+from reference_cache import load_reference
+from run_measures import run_measures
+from synth_npmrds import generate
+
+
+SCALES = [(1000, 365), (10000, 365), (50000, 365)]
+
+DATA_DIR = 'synth'
+
+RESULTS_PATH = 'benchmark_results.csv'
+
+
+def load_refs(paths):
+    """Reads the synthetic reference tables, keyed as in
+    annual_update.annual_measures()."""
+    refs = {
+        'urban': load_reference('metro_network', 'lottr',
+                                path=paths['urban']),
+        'meta': load_reference('tmc_identification', 'lottr',
+                               path=paths['meta']),
+        'phed_urban': load_reference('urban_network', 'phed',
+                                     path=paths['phed_urban']),
+        'peak': load_reference('peak_factors', 'phed', path=paths['peak']),
+        'here': load_reference('here', 'phed', path=paths['here']),
+    }
+    refs['truck_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'tttr')]
+    refs['phed_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'phed')]
+    return refs
+
+
+def lottr_rows(paths, refs):
+    """Loads the LOTTR readings (6am - 8pm, network TMCs)."""
+    df = read_store(paths['all_store'], columns=measure_columns('lottr'),
+                    hours=range(6, 20), tmcs=refs['urban']['Tmc'])
+    return df.dropna(subset=['travel_time_seconds'])
+
+
+def phed_rows(paths, refs):
+    """Loads the PHED readings (weekday peak hours, PHED network TMCs)."""
+    return read_store(paths['all_store'], columns=measure_columns('phed'),
+                      hours=phed_calc.PEAK_HOURS, dates=phed_calc.PEAK_DAYS,
+                      tmcs=refs['phed_urban']['Tmc'])
+
+
+# Each benchmark loads its inputs and returns (input rows, the function to
+# time); input rows of None are taken from the length of the function's
+# result.
+
+def bench_read_npmrds(paths, refs):
+    return None, lambda: read_npmrds(paths['all'],
+                                     usecols=table_columns('npmrds', 'lottr'))
+
+
+def bench_read_store(paths, refs):
+    return None, lambda: read_store(paths['all_store'],
+                                    columns=measure_columns('lottr'))
+
+
+def bench_calc_lottr(paths, refs):
+    df = assign_period(lottr_rows(paths, refs), LOTTR_PERIODS)
+    return len(df), lambda: lottr_calc.calc_lottr(df)
+
+
+def bench_lottr_agg(paths, refs):
+    df = lottr_rows(paths, refs)
+    return len(df), lambda: lottr_calc.agg_travel_times(df)
+
+
+def bench_tttr_agg(paths, refs):
+    df = read_store(paths['truck_store'], columns=measure_columns('tttr'),
+                    tmcs=refs['urban']['Tmc'])
+    df2 = read_store(paths['all_store'], columns=measure_columns('tttr'),
+                     tmcs=refs['urban']['Tmc'])
+    return len(df2), lambda: lottr_truck.agg_travel_times(
+        lottr_truck.fill_truck_times(df, df2))
+
+
+def bench_phed_calc(paths, refs):
+    df = phed_rows(paths, refs)
+
+    def run():
+        dim = phed_calc.phed_dim(refs['phed_urban'], refs['phed_meta'],
+                                 refs['here'])
+        df_ted = phed_calc.TED_summation(
+            phed_calc.calc_ted_seg(df, dim, refs['peak']))
+        return phed_calc.per_capita_TED(df_ted['TED'].sum())
+    return len(df), run
+
+
+def bench_phed_class(paths, refs):
+    calcs = Phed()
+    calcs.df = phed_rows(paths, refs)
+    calcs.df_urban = refs['phed_urban']
+    calcs.df_peak = refs['peak']
+    calcs.df_meta = refs['phed_meta']
+    calcs.df_here = refs['here']
+    n_rows = len(calcs.df)
+
+    def run():
+        calcs.total_excessive_delay()
+        return calcs.TED_summation()
+    return n_rows, run
+
+
+def inrix_rows(paths):
+    """Loads every all vehicle reading with calendar keys, as the INRIX May
+    scripts do."""
+    df = read_store(paths['all_store'],
+                    columns=measure_columns('inrix_may'))
+    return add_calendar_keys(df).dropna()
+
+
+def bench_inrix_min(paths, refs):
+    df = inrix_rows(paths)
+    return len(df), lambda: hourly_profile(df, MIN_PROFILE)
+
+
+def bench_inrix_pctile(paths, refs):
+    df = inrix_rows(paths)
+    return len(df), lambda: hourly_profile(df, PCTILE_PROFILE)
+
+
+def bench_run_measures(paths, refs):
+    n_rows = len(read_store(paths['all_store'], columns=[]))
+    return n_rows, lambda: run_measures(
+        [paths['all']], paths['all_store'], [paths['truck']],
+        paths['truck_store'], refs)
+
+
+BENCHMARKS = [
+    ('npmrds_io.read_npmrds', bench_read_npmrds),
+    ('npmrds_store.read_store', bench_read_store),
+    ('lottr_calc.calc_lottr', bench_calc_lottr),
+    ('lottr_calc.agg_travel_times', bench_lottr_agg),
+    ('lottr_truck.agg_travel_times', bench_tttr_agg),
+    ('phed_calc', bench_phed_calc),
+    ('phed_plus_plus.Phed', bench_phed_class),
+    ('hourly_profile.MIN_PROFILE', bench_inrix_min),
+    ('hourly_profile.PCTILE_PROFILE', bench_inrix_pctile),
+    ('run_measures', bench_run_measures),
+]
+
+
+def run_benchmark(name, paths):
+    """Runs one benchmark in the current process.
+    Args: name, a benchmark name, see BENCHMARKS.
+          paths, the synthetic data set, see synth_npmrds.synth_paths().
+    Returns: a dict of the benchmark's measurements.
+    """
+    bench = dict(BENCHMARKS)[name]
+    n_rows, run = bench(paths, load_refs(paths))
+    rss_loaded = peak_rss_mb()
+
+    start = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - start
+    if n_rows is None:
+        n_rows = len(result)
+    return {'benchmark': name, 'rows': n_rows, 'seconds': seconds,
+            'rows_per_s': n_rows / seconds, 'rss_loaded_mb': rss_loaded,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_scale(n_tmcs, n_days, names=None, data_dir=DATA_DIR):
+    """Runs the benchmarks at one scale, each in a fresh worker process so
+    its peak RSS is its own.
+    Args: n_tmcs, n_days, the scale of the synthetic data set.
+          names, optional list of benchmark names (default: all).
+          data_dir, the directory holding the synthetic data sets.
+    Returns: df, a pandas dataframe of one row per benchmark.
+    """
+    paths = generate(os.path.join(data_dir, '{0}x{1}'.format(n_tmcs,
+                                                             n_days)),
+                     n_tmcs, n_days)
+    if names is None:
+        names = [name for name, _ in BENCHMARKS]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        print("Running {0} at {1} TMCs x {2} days...".format(name, n_tmcs,
+                                                             n_days))
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            results.append(executor.submit(run_benchmark, name,
+                                           paths).result())
+    df = pd.DataFrame(results)
+    df.insert(0, 'n_days', n_days)
+    df.insert(0, 'n_tmcs', n_tmcs)
+    return df
+
+
+def main():
+    """Main script to run the benchmark suite."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', 200)
+
+    scales = SCALES
+    if len(sys.argv) > 1:
+        scales = [tuple(int(x) for x in arg.split('x'))
+                  for arg in sys.argv[1:]]
+
+    df = pd.concat([run_scale(n_tmcs, n_days) for n_tmcs, n_days in scales],
+                   ignore_index=True)
+    df['run_at'] = startTime.isoformat(timespec='seconds')
+    df.to_csv(RESULTS_PATH, mode='a', header=not os.path.exists(RESULTS_PATH),
+              index=False)
+    print(df.drop(columns='run_at').round(3))
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""
+bootstrap.py
+
+Day block bootstrap confidence intervals for LOTTR, TTTR and PHED.
+
+The headline measures (interstate and non-interstate percent reliable, TTTR
+index, PHED per capita) are point estimates over a year of 15-minute
+readings. A replicate resamples whole days with replacement, keeping the
+readings of a day together, and recomputes the measures; the spread of 1000
+replicates gives their confidence intervals. Days are resampled within
+strata of the same month and day type (weekday / weekend), so every
+replicate keeps the year's seasonal and weekday mix, and only days with
+readings are drawn.
+
+A resample is a multiplicity per day, so replicates recombine per-day
+pieces computed once from the feed grids (see run_measures.load_feeds())
+instead of rebuilding the data:
+    lottr, tttr   the readings of every (TMC, period) sorted once, with the
+                  day of each reading (DayGroups); a percentile of the
+                  resample is a search in the running sum of the day
+                  multiplicities, and matches np.percentile on the resampled
+                  readings exactly
+    phed          the TED of every day (TED is a sum over readings), so a
+                  replicate is a dot product with the multiplicities
+The per-TMC weights (ttr, miles, interstate) come from the point estimate
+tables. Replicates are spread over a process pool; each worker receives the
+precomputed pieces once, and the results do not depend on the number of
+workers.
+
+Usage:
+>>>python bootstrap.py
+>>>from bootstrap import bootstrap_measures
+>>>feeds = load_feeds(all_paths, all_store, truck_paths, truck_store, refs)
+>>>results = {name: stage(feeds, refs) for name, stage in STAGES}
+>>>df_ci = bootstrap_measures(feeds, refs, results, n_replicates=1000)
+"""
+
+import os
+import pandas as pd
+import numpy as np
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+import phed_calc
+from lottr_calc import RELIABLE_THRESHOLD
+from npmrds_io import quarter_paths
+from npmrds_schema import table_columns
+from periods import LOTTR_PERIODS, TTTR_PERIODS
+from profiling import profiled
+from quantiles import lerp, percentile_positions
+from reference_cache import load_reference
+from run_measures import STAGES, fallback_grid, load_feeds
+from tmc_shards import default_workers
+from tt_grid import grid_periods, grid_tstamps
+
+
+MEASURES = ['lottr_interstate', 'lottr_non_interstate', 'tttr_index',
+            'phed_per_capita']
+
+# Replicate pieces of a worker process, see init_worker()
+_pieces = None
+
+
+class DayGroups:
+    """Travel time readings of (TMC, period) groups, sorted once, with the
+    day of each reading."""
+
+    def __init__(self, grid, present, rows, col_periods, n_periods,
+                 col_days):
+        """Collects and sorts the readings of grid rows by period.
+        Args: grid, a (n_tmc x n_epochs) travel time grid.
+              present, a boolean grid of readings.
+              rows, the grid rows to keep, in output order.
+              col_periods, the period id of each column (-1 for none).
+              n_periods, the number of periods.
+              col_days, the day number of each column.
+        """
+        values, groups, days = [], [], []
+        for period in range(n_periods):
+            cols = np.flatnonzero(col_periods == period)
+            row_ids, col_ids = np.nonzero(present[np.ix_(rows, cols)])
+            values.append(grid[rows[row_ids], cols[col_ids]].astype(
+                np.float64))
+            groups.append(row_ids * n_periods + period)
+            days.append(col_days[cols[col_ids]])
+        values = np.concatenate(values)
+        groups = np.concatenate(groups)
+
+        # NaN sort last within each group
+        order = np.lexsort((values, groups))
+        self.values = values[order]
+        self.days = np.concatenate(days)[order].astype(np.int32)
+        self.shape = (len(rows), n_periods)
+        counts = np.bincount(groups, minlength=len(rows) * n_periods)
+        self.ends = np.cumsum(counts)
+        self.starts = self.ends - counts
+        self.nan_starts = self.ends - np.bincount(
+            groups, weights=np.isnan(values),
+            minlength=len(counts)).astype(np.int64)
+
+    def percentiles(self, day_weights, pcts):
+        """Calculates percentiles of every group over resampled days.
+        Args: day_weights, the int multiplicity of each day.
+              pcts, a list of percentiles, 0-100.
+        Returns: a list of (n_rows x n_periods) arrays, one per percentile
+                 (NaN for groups without readings or with a missing travel
+                 time, as np.percentile).
+        """
+        if not len(self.values):
+            return [np.full(self.shape, np.nan) for pct in pcts]
+        cum_weights = np.cumsum(day_weights[self.days])
+        bounds = np.append(0, cum_weights)
+        base = bounds[self.starts]
+        counts = bounds[self.ends] - base
+        nan_weights = bounds[self.ends] - bounds[self.nan_starts]
+
+        last = len(self.values) - 1
+        results = []
+        for pct in pcts:
+            previous, next_, gamma = percentile_positions(counts, pct)
+            # the reading covering each weighted rank
+            lower = self.values[np.clip(np.searchsorted(
+                cum_weights, base + previous, side='right'), 0, last)]
+            upper = self.values[np.clip(np.searchsorted(
+                cum_weights, base + next_, side='right'), 0, last)]
+            result = lerp(lower, upper, gamma)
+            result[(nan_weights > 0) | (counts == 0)] = np.nan
+            results.append(result.reshape(self.shape))
+        return results
+
+
+def grid_days(start, n_epochs):
+    """Returns the day number (0 for the first day) of each grid column."""
+    tstamps = grid_tstamps(start, n_epochs)
+    return ((tstamps.normalize() - tstamps[0].normalize())
+            // pd.Timedelta(days=1)).values.astype(np.int64)
+
+
+def day_strata(start, col_days, observed):
+    """Groups the days with readings by month and day type.
+    Args: start, the grid's first timestamp.
+          col_days, the day number of each grid column.
+          observed, a boolean array, True for the columns with readings.
+    Returns: days, the observed day numbers ordered by stratum.
+             slot_starts, slot_sizes, the offset in days and the size of the
+                                      stratum of each of them.
+             n_days, the number of days in the grid.
+    """
+    n_days = col_days[-1] + 1
+    days = np.unique(col_days[observed])
+    dates = pd.Timestamp(start).normalize() + pd.to_timedelta(days, unit='D')
+    strata = ((dates.year * 12 + dates.month) * 2
+              + (dates.weekday >= 5)).values
+    order = np.argsort(strata, kind='mergesort')
+    days, strata = days[order], strata[order]
+    _, first, sizes = np.unique(strata, return_index=True,
+                                return_counts=True)
+    slot_sizes = np.repeat(sizes, sizes)
+    slot_starts = np.repeat(first, sizes)
+    return days, slot_starts, slot_sizes, n_days
+
+
+def resample_days(rng, strata):
+    """Draws one block bootstrap resample of the days.
+    Args: rng, a numpy random Generator.
+          strata, see day_strata().
+    Returns: day_weights, the int64 multiplicity of each day.
+    """
+    days, slot_starts, slot_sizes, n_days = strata
+    picks = slot_starts + (rng.random(len(days)) * slot_sizes).astype(
+        np.int64)
+    return np.bincount(days[picks], minlength=n_days)
+
+
+@profiled
+def replicate_pieces(feeds, refs, results, population=phed_calc.POP_PDX):
+    """Precomputes the per-day pieces the replicates recombine.
+    Args: feeds, see run_measures.load_feeds().
+          refs, a dict of reference tables, see
+                annual_update.annual_measures().
+          results, the point estimates, see run_measures.run_measures().
+          population, the PHED population.
+    Returns: a dict of the day strata, the LOTTR and TTTR DayGroups with
+             their per-TMC weights, and the PHED TED of each day.
+    """
+    start = feeds['start']
+    n_epochs = feeds['all'].shape[1]
+    col_days = grid_days(start, n_epochs)
+    strata = day_strata(start, col_days, feeds['present'].any(axis=0))
+    n_days = strata[3]
+
+    print("Bootstrap: LOTTR readings by day...")
+    df_lottr = results['lottr'][0]
+    lottr = DayGroups(feeds['all'], ~np.isnan(feeds['all']),
+                      feeds['dim'].positions(df_lottr['tmc_code']),
+                      grid_periods(start, n_epochs, LOTTR_PERIODS),
+                      len(LOTTR_PERIODS), col_days)
+
+    print("Bootstrap: TTTR readings by day...")
+    df_tttr = results['tttr'][0]
+    grid, available = fallback_grid(feeds, refs)
+    tttr = DayGroups(grid, available,
+                     feeds['dim'].positions(df_tttr['tmc_code']),
+                     grid_periods(start, n_epochs, TTTR_PERIODS),
+                     len(TTTR_PERIODS), col_days)
+    del grid, available
+
+    print("Bootstrap: PHED TED by day...")
+    dim = phed_calc.phed_dim(refs['phed_urban'], refs['phed_meta'],
+                             refs['here'])
+    df_ted, tmc, _, cols, delay = phed_calc.grid_peak_delay(
+        feeds['all'], feeds['dim'], start, dim, refs['peak'])
+    # TMCs missing a mode split have no TED, as in TED_summation()
+    avo = np.nan_to_num(df_ted['pct_auto'].values * phed_calc.VOC_AUTO
+                        + df_ted['pct_bus'].values * phed_calc.VOC_BUS
+                        + df_ted['pct_truck'].values * phed_calc.VOC_TRUCK)
+    day_ted = np.bincount(col_days[cols],
+                          weights=(delay * avo[tmc, None]).sum(axis=0),
+                          minlength=n_days)
+
+    return {'strata': strata,
+            'lottr': lottr,
+            'lottr_ttr': np.nan_to_num(df_lottr['ttr'].values),
+            'lottr_interstate': (df_lottr['interstate'] == 1).values,
+            'tttr': tttr,
+            'tttr_miles': np.nan_to_num(df_tttr['miles'].values),
+            'tttr_interstate': (df_tttr['interstate'] == 1).values,
+            'day_ted': day_ted,
+            'population': population}
+
+
+def replicate_measures(pieces, day_weights):
+    """Calculates the measures of one resample of the days.
+    Args: pieces, see replicate_pieces().
+          day_weights, the multiplicity of each day.
+    Returns: an array of the measures, in MEASURES order.
+    """
+    upper, median = pieces['lottr'].percentiles(day_weights, [80, 50])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lottr_max = (upper / median).max(axis=1)
+    # a missing period is never reliable
+    reliable = lottr_max < RELIABLE_THRESHOLD
+    ttr = pieces['lottr_ttr']
+    interstate = pieces['lottr_interstate']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        int_rel_pct = (ttr[interstate & reliable].sum()
+                       / ttr[interstate].sum())
+        non_int_rel_pct = (ttr[~interstate & reliable].sum()
+                           / ttr[~interstate].sum())
+
+    upper, median = pieces['tttr'].percentiles(day_weights, [95, 50])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tttr = np.fmax.reduce(upper / median, axis=1)
+    interstate = pieces['tttr_interstate']
+    miles = pieces['tttr_miles'][interstate]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tttr_index = np.nansum(miles * tttr[interstate]) / miles.sum()
+
+    phed = day_weights @ pieces['day_ted'] / pieces['population']
+    return np.array([int_rel_pct, non_int_rel_pct, tttr_index, phed])
+
+
+def run_replicates(pieces, seeds):
+    """Runs the replicates of a list of seeds.
+    Returns: an (n_seeds x n_measures) array.
+    """
+    rows = []
+    for seed in seeds:
+        day_weights = resample_days(np.random.default_rng(seed),
+                                    pieces['strata'])
+        rows.append(replicate_measures(pieces, day_weights))
+    return np.array(rows).reshape(len(seeds), len(MEASURES))
+
+
+def init_worker(pieces):
+    """Keeps the replicate pieces in a worker process."""
+    global _pieces
+    _pieces = pieces
+
+
+def worker_replicates(seeds):
+    """Runs replicates in a worker process, see run_replicates()."""
+    return run_replicates(_pieces, seeds)
+
+
+@profiled
+def bootstrap_replicates(pieces, n_replicates=1000, seed=0, workers=None):
+    """Runs the bootstrap replicates in a pool of worker processes.
+    Args: pieces, see replicate_pieces().
+          n_replicates, the number of replicates.
+          seed, the random seed; each replicate gets its own stream, so
+                results do not depend on the number of workers.
+          workers, the number of worker processes (default: all CPUs);
+                   1 runs serially in this process.
+    Returns: df_replicates, a pandas dataframe with one row per replicate
+             and one column per measure.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+    if workers is None:
+        workers = default_workers()
+    workers = max(min(workers, n_replicates), 1)
+
+    if workers == 1:
+        replicates = run_replicates(pieces, seeds)
+    else:
+        # a few batches per worker to even out their load
+        batches = [list(batch) for batch in
+                   np.array_split(np.array(seeds, dtype=object),
+                                  min(workers * 4, n_replicates))]
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(pieces,)) as pool:
+            replicates = np.concatenate(
+                list(pool.map(worker_replicates, batches)))
+    return pd.DataFrame(replicates, columns=MEASURES)
+
+
+def confidence_intervals(estimates, df_replicates, confidence=.95):
+    """Summarises the replicates as percentile confidence intervals.
+    Args: estimates, a dict of the point estimates keyed by measure.
+          df_replicates, see bootstrap_replicates().
+          confidence, the confidence level.
+    Returns: df_ci, a pandas dataframe with one row per measure: estimate,
+             std_error, ci_lower and ci_upper.
+    """
+    tail = (1 - confidence) / 2 * 100
+    values = df_replicates[MEASURES].values
+    return pd.DataFrame({
+        'measure': MEASURES,
+        'estimate': [estimates[measure] for measure in MEASURES],
+        'std_error': np.nanstd(values, axis=0, ddof=1),
+        'ci_lower': np.nanpercentile(values, tail, axis=0),
+        'ci_upper': np.nanpercentile(values, 100 - tail, axis=0),
+    })
+
+
+@profiled
+def bootstrap_measures(feeds, refs, results, n_replicates=1000,
+                       confidence=.95, seed=0, workers=None,
+                       population=phed_calc.POP_PDX):
+    """Calculates day block bootstrap confidence intervals of LOTTR, TTTR
+    and PHED.
+    Args: feeds, see run_measures.load_feeds().
+          refs, a dict of reference tables, see
+                annual_update.annual_measures().
+          results, the point estimates, see run_measures.run_measures().
+          n_replicates, the number of replicates.
+          confidence, the confidence level.
+          seed, workers, see bootstrap_replicates().
+          population, the PHED population.
+    Returns: df_ci, see confidence_intervals().
+             df_replicates, see bootstrap_replicates().
+    """
+    pieces = replicate_pieces(feeds, refs, results, population)
+    print("Bootstrap: {0} replicates...".format(n_replicates))
+    df_replicates = bootstrap_replicates(pieces, n_replicates, seed, workers)
+
+    int_rel_pct, non_int_rel_pct = results['lottr'][1]
+    estimates = {'lottr_interstate': int_rel_pct,
+                 'lottr_non_interstate': non_int_rel_pct,
+                 'tttr_index': results['tttr'][1],
+                 'phed_per_capita': results['phed'][1]}
+    return (confidence_intervals(estimates, df_replicates, confidence),
+            df_replicates)
+
+
+@profiled
+def main():
+    """Main script to calculate LOTTR, TTTR and PHED with confidence
+    intervals."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+
+    drive_path = 'H:/map21/2020/data/'
+    quarters = ['']
+    file_end = '.csv'
+    folder_end = 'pdx-3co-mtip-2019-all-15min'
+    all_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    all_store = os.path.join(os.path.dirname(__file__),
+                             drive_path + folder_end + '.h5')
+    meta_path = os.path.join(os.path.dirname(__file__),
+                             drive_path + folder_end + '/' +
+                             'TMC_Identification.csv')
+    folder_end = 'pdx-3co-mtip-2019-trucks-15min'
+    truck_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    truck_store = os.path.join(os.path.dirname(__file__),
+                               drive_path + folder_end + '.h5')
+
+    refs = {
+        'urban': load_reference('metro_network', 'lottr'),
+        'meta': load_reference('tmc_identification', 'lottr',
+                               path=meta_path),
+        'phed_urban': load_reference('urban_network', 'phed'),
+        'peak': load_reference('peak_factors', 'phed'),
+        'here': load_reference('here', 'phed'),
+    }
+    refs['truck_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'tttr')]
+    refs['phed_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'phed')]
+
+    # Replicates, confidence level and worker processes (None: all CPUs)
+    n_replicates = 1000
+    confidence = .95
+    workers = None
+
+    feeds = load_feeds(all_paths, all_store, truck_paths, truck_store, refs)
+    results = {name: stage(feeds, refs) for name, stage in STAGES}
+    df_ci, df_replicates = bootstrap_measures(
+        feeds, refs, results, n_replicates, confidence, workers=workers)
+    print(df_ci)
+    df_ci.to_csv('measures_ci_2019.csv', index=False)
+    df_replicates.to_csv('measures_replicates_2019.csv', index=False)
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
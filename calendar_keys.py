@@ -0,0 +1,106 @@
+"""
+calendar_keys.py
+
+Parses NPMRDS timestamps once and decodes them into compact integer calendar
+columns that filters and period assignment reuse, instead of re-deriving
+.dt.hour/.dt.weekday/.dt.day from the timestamp in every filter.
+
+Columns added by add_calendar_keys():
+    hour          int8,  0-23
+    epoch         int8,  15-minute epoch of day, 0-95
+    weekday       int8,  0 = Monday
+    day           int8,  day of month
+    day_of_year   int16, 1-366
+    month         int8,  1-12
+
+Usage:
+>>>from calendar_keys import add_calendar_keys
+>>>df = add_calendar_keys(df)
+>>>df = df[df['hour'].isin(range(6, 20))]
+"""
+
+import pandas as pd
+import numpy as np
+from profiling import profiled
+
+
+# RITIS export timestamp format, e.g. '2019-01-01 06:15:00'
+TSTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+CALENDAR_KEYS = ['hour', 'epoch', 'weekday', 'day', 'day_of_year', 'month']
+
+NS_PER_MINUTE = 60 * 10**9
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_tstamp(tstamp, fmt=TSTAMP_FORMAT):
+    """Parses a timestamp series, trying the fixed RITIS format first.
+    Args: tstamp, a pandas series of timestamp strings or datetimes.
+          fmt, the expected strftime format.
+    Returns: a datetime64 pandas series.
+    """
+    if pd.api.types.is_datetime64_any_dtype(tstamp):
+        return tstamp
+    if isinstance(tstamp.dtype, pd.CategoricalDtype):
+        # parse each distinct timestamp once; code -1 (missing) picks NaT
+        parsed = parse_tstamp(pd.Series(np.asarray(tstamp.cat.categories)),
+                              fmt).values
+        parsed = np.append(parsed, np.datetime64('NaT'))
+        return pd.Series(parsed[tstamp.cat.codes.values], index=tstamp.index,
+                         name=tstamp.name)
+    try:
+        return pd.to_datetime(tstamp, format=fmt)
+    except ValueError:
+        return pd.to_datetime(tstamp)
+
+
+def has_calendar_keys(df):
+    """Returns True if all calendar key columns are present."""
+    return all(key in df.columns for key in CALENDAR_KEYS)
+
+
+def calendar_keys(tstamp):
+    """Decodes timestamps into compact integer calendar keys.
+    Time of day comes from integer arithmetic on the timestamps; the date
+    keys are computed once per distinct day and gathered back to the rows.
+    Args: tstamp, a datetime64 pandas series (no missing values).
+    Returns: a dict of numpy arrays keyed by CALENDAR_KEYS.
+    """
+    minutes = tstamp.values.astype('datetime64[m]').astype(np.int64)
+    days, minute_of_day = np.divmod(minutes, MINUTES_PER_DAY)
+
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    dates = pd.DatetimeIndex(unique_days.astype('datetime64[D]'))
+
+    return {
+        'hour': (minute_of_day // 60).astype(np.int8),
+        'epoch': (minute_of_day // 15).astype(np.int8),
+        'weekday': np.asarray(dates.weekday, dtype=np.int8)[day_index],
+        'day': np.asarray(dates.day, dtype=np.int8)[day_index],
+        'day_of_year': np.asarray(dates.dayofyear,
+                                  dtype=np.int16)[day_index],
+        'month': np.asarray(dates.month, dtype=np.int8)[day_index],
+    }
+
+
+@profiled
+def add_calendar_keys(df, tstamp_col='measurement_tstamp'):
+    """Parses the timestamp column and adds the calendar key columns.
+    Rows with a missing timestamp get -1 keys. Does nothing if the keys are
+    already there (e.g. read back from the NPMRDS store).
+    Args: df, a pandas dataframe.
+          tstamp_col, name of the timestamp column.
+    Returns: df, a pandas dataframe with a datetime timestamp column and new
+             columns hour, epoch, weekday, day, day_of_year and month.
+    """
+    if has_calendar_keys(df):
+        return df
+
+    df[tstamp_col] = parse_tstamp(df[tstamp_col])
+    valid = df[tstamp_col].notna().values
+    keys = calendar_keys(df.loc[valid, tstamp_col])
+    for key, values in keys.items():
+        column = np.full(len(df), -1, dtype=values.dtype)
+        column[valid] = values
+        df[key] = column
+    return df
@@ -0,0 +1,30 @@
+"""
+conftest.py
+
+Shared pytest fixtures: the small synthetic data set (see synth_npmrds.py)
+the engine, bootstrap and reliability curve tests run on.
+"""
+
+import pytest
+import reference_cache
+from benchmark import load_refs
+from synth_npmrds import generate
+
+
+N_TMCS = 50
+N_DAYS = 30
+
+
+@pytest.fixture(scope='session')
+def data(tmp_path_factory):
+    """Generates the synthetic data set, with its reference cache kept in
+    the temporary directory.
+    Returns: paths, see synth_npmrds.synth_paths().
+             refs, see benchmark.load_refs().
+    """
+    root = tmp_path_factory.mktemp('synth')
+    cache_dir = reference_cache.CACHE_DIR
+    reference_cache.CACHE_DIR = str(root / 'ref_cache')
+    paths = generate(str(root), N_TMCS, N_DAYS)
+    yield paths, load_refs(paths)
+    reference_cache.CACHE_DIR = cache_dir
@@ -1,7 +1,6 @@
-# import numpy as np
-import pandas as pd
 import datetime as dt
-import os
+from npmrds_io import quarter_paths
+from npmrds_store import csv_to_store
 
 
 def main():
@@ -15,21 +14,10 @@ def main():
     folder_end = '_TriCounty_Metro_15-min'
     file_end = '_NPMRDS (Trucks and passenger vehicles).csv'
 
-    df = pd.DataFrame()  # Empty dataframe
-
-    for q in quarters:
-        filename = q + folder_end + file_end
-        path = q + folder_end
-        full_path = path + '/' + filename
-        print("Loading {0} data...".format(q))
-        df_temp = pd.read_csv(
-                    os.path.join(
-                        os.path.dirname(__file__), drive_path + full_path))
-        df = pd.concat([df, df_temp], sort=False)
-        del df_temp
-
-    # Save to HDF5
-    df.to_hdf('test.h5', 'data', mode='w', format='table')
+    paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+
+    # Save to partitioned HDF5 store
+    csv_to_store(paths, 'master_NPMRDS.h5')
 
     endTime = dt.datetime.now()
     print("Script finished in {0}.".format(endTime - startTime))
@@ -0,0 +1,160 @@
+"""
+date_rules.py
+
+Declarative day filters compiled into per-date lookup tables.
+
+A DateRules object describes which days to keep:
+    weekdays          days of the week (0 = Monday)
+    months            months (1-12)
+    ranges            (start, end) date ranges, inclusive: 'MM-DD' for every
+                      year (wrapping over the new year if end < start) or
+                      'YYYY-MM-DD' for one year
+    holidays          True to drop the US federal holidays (as observed), or
+                      a list of holiday names ('Memorial Day', ...)
+    holiday_adjacent  day offsets around those holidays to drop as well,
+                      e.g. [1, 2] for the two days after
+    exclude           explicit dates to drop ('YYYY-MM-DD'), e.g. incidents
+For each year the rules are evaluated once over the year's dates into a
+boolean table indexed by day of year, and readings are filtered with one
+array index on their day_of_year calendar key (see calendar_keys.py)
+instead of per-row .dt evaluation. Any year works; tables are built on
+first use.
+
+Usage:
+>>>from date_rules import DateRules
+>>>may_midweek = DateRules(weekdays=[1, 2, 3], months=[5], holidays=True,
+>>>                        holiday_adjacent=[1, 2, 3])
+>>>df = read_npmrds(paths, dates=may_midweek)
+>>>df = df[may_midweek.mask(df)]
+"""
+
+import pandas as pd
+import numpy as np
+from pandas.tseries.holiday import USFederalHolidayCalendar
+
+
+# Day of year 1-366 index the table directly; the last slot is never kept,
+# so a missing day_of_year (-1) indexes it
+LOOKUP_SIZE = 368
+
+
+def federal_holidays(start, end, names=None):
+    """Returns the US federal holidays, as observed, between two dates.
+    Args: start, end, the date range (inclusive).
+          names, optional list of holiday names to return (default: all).
+    Returns: a sorted DatetimeIndex.
+    """
+    dates = [rule.dates(start, end) for rule in USFederalHolidayCalendar.rules
+             if names is None or rule.name in names]
+    if not dates:
+        return pd.DatetimeIndex([])
+    return dates[0].append(dates[1:]).sort_values()
+
+
+def range_bound(bound, year):
+    """Returns a range bound as a Timestamp in a given year ('MM-DD'
+    bounds recur every year)."""
+    if len(bound) == 5:
+        return pd.Timestamp('{0}-{1}'.format(year, bound))
+    return pd.Timestamp(bound)
+
+
+class DateRules:
+    """A set of day filter rules, see the module docstring."""
+
+    def __init__(self, weekdays=None, months=None, ranges=None,
+                 holidays=False, holiday_adjacent=None, exclude=None):
+        self.weekdays = None if weekdays is None else list(weekdays)
+        self.months = None if months is None else list(months)
+        self.ranges = None if ranges is None else list(ranges)
+        self.holidays = holidays
+        self.holiday_adjacent = list(holiday_adjacent or [])
+        self.exclude = pd.DatetimeIndex(exclude or [])
+        self.lookups = {}
+
+    def keep_dates(self, dates):
+        """Evaluates the rules over a DatetimeIndex of days.
+        Returns: a boolean array, True for the days kept.
+        """
+        keep = np.ones(len(dates), dtype=bool)
+        if self.weekdays is not None:
+            keep &= np.isin(dates.weekday, self.weekdays)
+        if self.months is not None:
+            keep &= np.isin(dates.month, self.months)
+        if self.ranges is not None:
+            in_range = np.zeros(len(dates), dtype=bool)
+            for year in np.unique(dates.year):
+                for start, end in self.ranges:
+                    start = range_bound(start, year)
+                    end = range_bound(end, year)
+                    if start <= end:
+                        in_range |= (dates >= start) & (dates <= end)
+                    else:
+                        # a recurring range wrapping over the new year
+                        in_range |= (((dates >= start) | (dates <= end))
+                                     & (dates.year == year))
+            keep &= in_range
+        if self.holidays:
+            names = None if self.holidays is True else self.holidays
+            # look past the ends for holidays whose adjacent days fall inside
+            pad = pd.Timedelta(days=max([abs(offset) for offset in
+                                         self.holiday_adjacent] + [0]))
+            holidays = federal_holidays(dates.min() - pad, dates.max() + pad,
+                                        names)
+            dropped = holidays
+            for offset in self.holiday_adjacent:
+                dropped = dropped.append(holidays + pd.Timedelta(days=offset))
+            keep &= ~dates.isin(dropped)
+        if len(self.exclude):
+            keep &= ~dates.isin(self.exclude)
+        return keep
+
+    def lookup(self, year):
+        """Returns the year's boolean table indexed by day of year."""
+        if year not in self.lookups:
+            dates = pd.date_range('{0}-01-01'.format(year),
+                                  '{0}-12-31'.format(year), freq='D')
+            table = np.zeros(LOOKUP_SIZE, dtype=bool)
+            table[dates.dayofyear] = self.keep_dates(dates)
+            self.lookups[year] = table
+        return self.lookups[year]
+
+    def keep(self, day_of_year, years):
+        """Looks up the rules for each (year, day of year).
+        Args: day_of_year, an int array of days of year (-1 for missing).
+              years, an int array of years, or a single year.
+        Returns: a boolean array.
+        """
+        day_of_year = np.asarray(day_of_year, dtype=np.int64)
+        years = np.broadcast_to(np.asarray(years, dtype=np.int64),
+                                day_of_year.shape)
+        valid = day_of_year >= 0
+        if not valid.any():
+            return np.zeros(len(day_of_year), dtype=bool)
+
+        first, last = years[valid].min(), years[valid].max()
+        if first == last:
+            return self.lookup(first)[day_of_year]
+        table = np.concatenate([self.lookup(year)
+                                for year in range(first, last + 1)])
+        return table[np.where(valid, (years - first) * LOOKUP_SIZE
+                              + day_of_year, -1)]
+
+    def mask(self, df, tstamp_col='measurement_tstamp'):
+        """Returns the boolean mask of the rows kept.
+        Args: df, a pandas dataframe with a datetime timestamp column and
+                  the day_of_year calendar key (see calendar_keys.py).
+              tstamp_col, name of the timestamp column.
+        """
+        years = (df[tstamp_col].values.astype('datetime64[Y]')
+                 .astype(np.int64) + 1970)
+        return self.keep(df['day_of_year'].values, years)
+
+    def dates_mask(self, tstamps):
+        """Returns the boolean mask of an array of timestamps kept (e.g. the
+        columns of a travel time grid)."""
+        tstamps = np.asarray(tstamps, dtype='datetime64[ns]')
+        years = tstamps.astype('datetime64[Y]')
+        day_of_year = (tstamps.astype('datetime64[D]') - years).astype(
+            np.int64) + 1
+        return self.keep(day_of_year, years.astype(np.int64) + 1970)
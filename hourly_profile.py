@@ -0,0 +1,159 @@
+"""
+hourly_profile.py
+
+Hourly travel time profiles per TMC.
+
+The INRIX May scripts built their wide hour_<h>_... tables with 24 passes:
+filter the readings to one hour, group by TMC, merge onto the TMC table.
+hourly_profile() gets every (TMC, hour) statistic from one grouped pass
+instead: the readings are sorted once by (TMC, hour, travel time) (see
+quantiles.sorted_groups()), min, max, count and mean are read off the group
+bounds and every percentile comes out of the same sorted array, then the
+TMC x 24 results are laid out as one column per hour and statistic.
+
+Statistics are (stat, column name template) pairs, the stat being 'min',
+'max', 'mean', 'count' or a percentile (0-100, matching np.percentile), and
+the template formatted with the hour:
+    MIN_PROFILE      hour_<h>_tt_seconds (inrix_may_filter.py)
+    PCTILE_PROFILE   hour_<h>_mean_tt_seconds, hour_<h>_5th_pct,
+                     hour_<h>_95th_pct (inrix_may_filter_pctile.py)
+
+Usage:
+>>>from hourly_profile import MAY_MIDWEEK, MIN_PROFILE, hourly_profile
+>>>df = add_calendar_keys(df)
+>>>df_hours = hourly_profile(df, MIN_PROFILE, tmcs=df_wa['Tmc'],
+>>>                          dates=MAY_MIDWEEK)
+>>>df_tmc = profile_table(df, MIN_PROFILE, df_meta, df_wa, dates=MAY_MIDWEEK)
+"""
+
+import pandas as pd
+import numpy as np
+from date_rules import DateRules
+from profiling import profiled
+from quantiles import factorize_groups, sorted_groups, sorted_percentile
+
+
+HOURS = 24
+
+MIN_PROFILE = [('min', 'hour_{0}_tt_seconds')]
+
+PCTILE_PROFILE = [('mean', 'hour_{0}_mean_tt_seconds'),
+                  (5, 'hour_{0}_5th_pct'),
+                  (95, 'hour_{0}_95th_pct')]
+
+# Tuesdays to Thursdays of May, except Memorial Day week (the Tuesday to
+# Thursday after Memorial Day)
+MAY_MIDWEEK = DateRules(weekdays=[1, 2, 3], months=[5], holidays=True,
+                        holiday_adjacent=[1, 2, 3])
+
+
+def filter_profile_rows(df, tmcs=None, dates=None):
+    """Keeps the readings of a region and a set of dates.
+    Args: df, a pandas dataframe with calendar keys (see calendar_keys.py).
+          tmcs, optional list of TMC codes (e.g. the Metro or WA network).
+          dates, optional date_rules.DateRules of the days to keep.
+    Returns: df, the kept rows.
+    """
+    keep = np.ones(len(df), dtype=bool)
+    if tmcs is not None:
+        keep &= df['tmc_code'].isin(pd.Series(tmcs).astype(str)).values
+    if dates is not None:
+        keep &= dates.mask(df)
+    if keep.all():
+        return df
+    return df[keep]
+
+
+def group_stat(stat, sorted_values, starts, counts, nan_counts, sums):
+    """Reads one statistic per group out of group-sorted values.
+    Args: stat, 'min', 'max', 'mean', 'count' or a percentile.
+          sorted_values, starts, counts, nan_counts, see
+          quantiles.sorted_groups().
+          sums, the sum of the non-missing values per group.
+    Returns: an array with one value per group (NaN for empty groups).
+    """
+    valid = counts - nan_counts
+    if stat == 'count':
+        return valid.astype(np.int64)
+    if stat == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / valid
+    if stat in ('min', 'max'):
+        # missing values sort last, so the valid values of a group lead it
+        result = np.full(len(counts), np.nan)
+        has = valid > 0
+        offset = 0 if stat == 'min' else valid[has] - 1
+        result[has] = sorted_values[starts[has] + offset]
+        return result
+    return sorted_percentile(sorted_values, starts, counts, nan_counts, stat)
+
+
+@profiled
+def hourly_profile(df, stats, tmcs=None, dates=None,
+                   value_col='travel_time_seconds'):
+    """Calculates travel time statistics for every TMC and hour of day in
+    one pass.
+    Args: df, a pandas dataframe of readings with tmc_code, a datetime
+              measurement_tstamp and calendar keys.
+          stats, a list of (stat, column name template) pairs, see
+                 MIN_PROFILE.
+          tmcs, dates, optional region and date filters, see
+                filter_profile_rows().
+          value_col, the travel time column.
+    Returns: df_profile, a pandas dataframe of tmc_code followed by the
+             statistics of hour 0, hour 1, ... 23, one row per TMC with
+             readings, sorted by TMC. Min, max and mean keep the travel time
+             dtype, as groupby's would.
+    """
+    df = filter_profile_rows(df, tmcs, dates)
+    tmc_ids, df_profile = factorize_groups(df, 'tmc_code')
+    n_groups = len(df_profile) * HOURS
+    hours = df['hour'].values
+    group_ids = np.where((tmc_ids >= 0) & (hours >= 0),
+                         tmc_ids * HOURS + hours, -1)
+
+    values = df[value_col].values
+    sorted_values, starts, counts, nan_counts = sorted_groups(
+        group_ids, values, n_groups)
+    keep = (group_ids >= 0) & ~np.isnan(values)
+    sums = np.bincount(group_ids[keep], weights=values[keep],
+                       minlength=n_groups)
+
+    results = {}
+    for stat, template in stats:
+        result = group_stat(stat, sorted_values, starts, counts, nan_counts,
+                            sums)
+        if stat in ('min', 'max', 'mean'):
+            result = result.astype(values.dtype)
+        results[template] = result.reshape(len(df_profile), HOURS)
+
+    # hour-major column order, as the per-hour merges laid them out
+    df_hours = pd.DataFrame({template.format(hour): results[template][:, hour]
+                             for hour in range(HOURS)
+                             for _, template in stats})
+    return pd.concat([df_profile, df_hours], axis=1)
+
+
+def profile_table(df, stats, df_meta, df_region=None, dates=None):
+    """Builds the INRIX May output table: TMC metadata and hourly profile.
+    Args: df, a pandas dataframe of readings with calendar keys.
+          stats, a list of (stat, column name template) pairs, see
+                 MIN_PROFILE.
+          df_meta, TMC metadata ('tmc' and the columns to keep).
+          df_region, optional network TMC list ('Tmc'); its TMCs are kept,
+                     with or without readings, in its order.
+          dates, optional date filter, see filter_profile_rows().
+    Returns: df_tmc, a pandas dataframe of the region's columns (if any),
+             tmc_code, the metadata columns and the hourly statistics.
+    """
+    tmcs = None if df_region is None else df_region['Tmc']
+    df_hours = hourly_profile(df, stats, tmcs, dates)
+
+    df_tmc = pd.merge(df_hours[['tmc_code']], df_meta, left_on='tmc_code',
+                      right_on='tmc', how='inner')
+    df_tmc = df_tmc.drop(columns=['tmc'])
+    df_tmc = pd.merge(df_tmc, df_hours, on='tmc_code', how='left')
+    if df_region is not None:
+        df_tmc = pd.merge(df_region, df_tmc, left_on='Tmc',
+                          right_on='tmc_code', how='left')
+    return df_tmc
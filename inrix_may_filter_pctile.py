@@ -10,20 +10,11 @@ by Kevin Saavedra, kevin.saavedra@oregonmetro.gov
 """
 
 import os
-import pandas as pd
-import numpy as np
-
-
-def tt_by_hour(df_tt, hour):
-    """Process hourly travel time averages."""
-    df_tt = df_tt[df_tt['measurement_tstamp'].dt.hour.isin([hour])]
-    tmc_operations = ({'travel_time_seconds': 'mean',
-                       'hour_{0}_5th_pct'.format(hour).format(hour): lambda x: np.percentile(x, 5),
-                       'hour_{0}_95th_pct'.format(hour).format(hour): lambda x: np.percentile(x, 95)})
-    df_tt = df_tt.groupby('tmc_code', as_index=False).agg(tmc_operations)
-    df_avg_tt = df_tt.rename(
-        columns={'travel_time_seconds': 'hour_{}_mean_tt_seconds'.format(hour)})
-    return df_avg_tt
+from calendar_keys import add_calendar_keys
+from hourly_profile import MAY_MIDWEEK, PCTILE_PROFILE, profile_table
+from npmrds_io import read_npmrds
+from npmrds_schema import table_columns
+from reference_cache import load_reference
 
 
 def main():
@@ -32,42 +23,22 @@ def main():
 
     full_path = drive_path + filename
     print("Loading data...")
-    df = pd.read_csv(
+    df = read_npmrds(
             os.path.join(
-                os.path.dirname(__file__), full_path))
+                os.path.dirname(__file__), full_path),
+            usecols=table_columns('npmrds', 'inrix_may'))
 
     print("Filtering timestamps...")
-    df['measurement_tstamp'] = pd.to_datetime(df['measurement_tstamp'])
-
-    # Filter for Tuesday (excludes days following Memorial Day)
-    df = df[df['measurement_tstamp'].dt.day.isin(
-        [2, 3, 4, 9, 10, 11, 16, 17, 18, 23, 24, 25])]
+    df = add_calendar_keys(df)
     df = df.dropna()
 
-    tmc_list = df['tmc_code'].drop_duplicates().values.tolist()
-    tmc_format = {'tmc_code': tmc_list}
-    df_tmc = pd.DataFrame.from_dict(tmc_format)
-
     # Add segment length from metadata
     print("Join TMC Metadata...")
-    wd = 'H:/map21/perfMeasures/phed/data/'
-    df_meta = pd.read_csv(
-        os.path.join(
-            os.path.dirname(__file__),
-            wd +
-            'TMC_Identification_NPMRDS (Trucks and passenger vehicles).csv'),
-        usecols=['tmc', 'miles'])
-
-    df_tmc = pd.merge(df_tmc, df_meta, left_on='tmc_code',
-                      right_on='tmc', how='inner')
-    df_tmc = df_tmc.drop(columns=['tmc'])
+    df_meta = load_reference('phed_tmc_identification', 'inrix_may')
 
-    hours = list(range(0, 24))
-    for hour in hours:
-        df['hour_{0}_95th_pct'.format(hour)] = df['travel_time_seconds']
-        df['hour_{0}_5th_pct'.format(hour)] = df['travel_time_seconds']
-        df_time = tt_by_hour(df, hour)
-        df_tmc = pd.merge(df_tmc, df_time, on='tmc_code', how='left')
+    # Mean, 5th and 95th percentile travel time by hour, Tuesday - Thursday
+    # (excludes days following Memorial Day)
+    df_tmc = profile_table(df, PCTILE_PROFILE, df_meta, dates=MAY_MIDWEEK)
 
     df_tmc.to_csv('may_2017_INRIX_pctile.csv', index=False)
 
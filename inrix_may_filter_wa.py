@@ -8,17 +8,11 @@ by Kevin Saavedra, kevin.saavedra@oregonmetro.gov
 """
 
 import os
-import pandas as pd
-
-
-def tt_by_hour(df_tt, hour):
-    """Process hourly travel time averages."""
-    df_tt = df_tt[df_tt['measurement_tstamp'].dt.hour.isin([hour])]
-    tmc_operations = ({'travel_time_seconds': 'min'})
-    df_tt = df_tt.groupby('tmc_code', as_index=False).agg(tmc_operations)
-    df_avg_tt = df_tt.rename(
-        columns={'travel_time_seconds': 'hour_{}_tt_seconds'.format(hour)})
-    return df_avg_tt
+from calendar_keys import add_calendar_keys
+from hourly_profile import MAY_MIDWEEK, MIN_PROFILE, profile_table
+from npmrds_io import read_npmrds
+from npmrds_schema import table_columns
+from reference_cache import load_reference
 
 
 def main():
@@ -32,52 +26,26 @@ def main():
         path = q + folder_end
         full_path = path + '/' + filename
         print("Loading {0} data...".format(q))
-        df = pd.read_csv(
+        df = read_npmrds(
                 os.path.join(
-                    os.path.dirname(__file__), drive_path + full_path))
+                    os.path.dirname(__file__), drive_path + full_path),
+                usecols=table_columns('npmrds', 'inrix_may'))
 
     print("Filtering timestamps...".format(q))
-    df['measurement_tstamp'] = pd.to_datetime(df['measurement_tstamp'])
-
-    # Filter for May only.
-    df = df[df['measurement_tstamp'].dt.month.isin([5])]
-
-    # Filter for Tuesday (excludes days following Memorial Day)
-    df = df[df['measurement_tstamp'].dt.day.isin(
-        [2, 3, 4, 9, 10, 11, 16, 17, 18, 23, 24, 25])]
+    df = add_calendar_keys(df)
     df = df.dropna()
 
-    tmc_list = df['tmc_code'].drop_duplicates().values.tolist()
-    tmc_format = {'tmc_code': tmc_list}
-    df_tmc = pd.DataFrame.from_dict(tmc_format)
-
     # Add segment length from metadata
     print("Join TMC Metadata...")
-    wd = 'H:/map21/perfMeasures/phed/data/'
-    df_meta = pd.read_csv(
-        os.path.join(
-            os.path.dirname(__file__),
-            wd +
-            'TMC_Identification_NPMRDS (Trucks and passenger vehicles).csv'),
-        usecols=['tmc', 'miles'])
-
-    df_tmc = pd.merge(df_tmc, df_meta, left_on='tmc_code',
-                      right_on='tmc', how='inner')
-    df_tmc = df_tmc.drop(columns=['tmc'])
+    df_meta = load_reference('phed_tmc_identification', 'inrix_may')
 
     # Load Washington TMCs
-    df_wa = pd.read_csv(
-        os.path.join(
-            os.path.dirname(__file__), wd + 'WA_tmc.csv'),
-            usecols=['Tmc'])
-    
-    df_wa_only = pd.merge(df_wa, df_tmc, left_on='Tmc',
-                          right_on='tmc_code', how='left')
+    df_wa = load_reference('wa_network', 'inrix_may')
 
-    hours = list(range(0, 24))
-    for hour in hours:
-        df_time = tt_by_hour(df, hour)
-        df_wa_only = pd.merge(df_wa_only, df_time, on='tmc_code', how='left')
+    # Minimum travel time by hour on the Washington TMCs, May only, Tuesday
+    # - Thursday (excludes days following Memorial Day)
+    df_wa_only = profile_table(df, MIN_PROFILE, df_meta, df_wa,
+                               dates=MAY_MIDWEEK)
 
     df_wa_only.to_csv('may_2017_INRIX_wa.csv', index=False)
 
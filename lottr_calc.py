@@ -11,8 +11,25 @@ import os
 import pandas as pd
 import numpy as np
 import datetime as dt
+from npmrds_io import quarter_paths
+from npmrds_schema import measure_columns
+from npmrds_store import iter_cached, read_cached
+from periods import LOTTR_PERIODS, assign_period, period_codes
+from profiling import profiled
+from reference_cache import load_reference
+from tmc_dim import network_dim
+from tmc_shards import parallel_period_ttr
+from tt_cube import cached_cube, cube_period_ttr
+from tt_hist import (annual_period_ttr, cached_histogram, file_histogram,
+                     histogram_path)
+from tt_sketch import stream_period_ttr
 
 
+# A TMC is reliable when its LOTTR is below this in every time period
+RELIABLE_THRESHOLD = 1.5
+
+
+@profiled
 def calc_pct_reliability(df_pct):
     """
     Calculates percent reliability of interstate and non-interstate network.
@@ -35,6 +52,7 @@ def calc_pct_reliability(df_pct):
     return int_rel_pct, non_int_rel_pct
 
 
+@profiled
 def calc_ttr(df_ttr):
     """Calculate travel time reliability for auto and bus.
     Args: df_ttr, a pandas dataframe.
@@ -59,6 +77,7 @@ def calc_ttr(df_ttr):
     return df_ttr
 
 
+@profiled
 def AADT_splits(df_spl):
     """Calculates AADT per vehicle type.
     Args: df_spl, a pandas dataframe.
@@ -75,87 +94,128 @@ def AADT_splits(df_spl):
     return df_spl
 
 
-def check_reliable(df_rel):
+@profiled
+def check_reliable(df_rel, threshold=RELIABLE_THRESHOLD):
     """Check reliability of TMCs across time periods.
     Args: df_rel, a pandas dataframe.
+          threshold, the LOTTR a TMC must stay below in every period.
     Returns: df_rel, a pandas dataframe with new column:
              reliable, with value 1 if all time periods are reliable.
     """
     df_rel.loc[:, 'reliable'] = np.where(
-                                  (df_rel['MF_6_9'] < 1.5)
-                                   & (df_rel['MF_10_15'] < 1.5)
-                                   & (df_rel['MF_16_19'] < 1.5)
-                                   & (df_rel['SATSUN_6_19'] < 1.5),
+                                  (df_rel['MF_6_9'] < threshold)
+                                   & (df_rel['MF_10_15'] < threshold)
+                                   & (df_rel['MF_16_19'] < threshold)
+                                   & (df_rel['SATSUN_6_19'] < threshold),
                                    1, 0)
     return df_rel
 
 
-def calc_lottr(days, time_period, df_lottr):
+@profiled
+def worst_period(df_worst):
+    """Finds the least reliable time period of each TMC.
+    Args: df_worst, a pandas dataframe with one LOTTR column per period.
+    Returns: df_worst, a pandas dataframe with new columns:
+             lottr_max, the largest LOTTR across periods (NaN if a period
+             has none, as such a TMC is never reliable).
+             worst_period, the code of the period with the largest LOTTR.
+    """
+    codes = period_codes(LOTTR_PERIODS)
+    values = df_worst[codes].values.astype(np.float64)
+    missing = np.isnan(values)
+    worst = np.argmax(np.where(missing, -np.inf, values), axis=1)
+    df_worst['lottr_max'] = values.max(axis=1)
+    df_worst['worst_period'] = np.where(missing.all(axis=1), None,
+                                        np.array(codes, dtype=object)[worst])
+    return df_worst
+
+
+@profiled
+def calc_lottr(df_lottr, workers=1):
     """Calculates LOTTR (Level of Travel Time Reliability) using FHWA metrics.
-    Args: df_lottr, a pandas dataframe.
-    Returns: df_lottr, a pandas dataframe with new columns:
-             80_pct_tt, 95th percentile calculation.
-             50_pct_tt, 50th percentile calculation.
-             tttr, completed truck travel time reliability calculation.
+    Args: df_lottr, a pandas dataframe with a 'period' column.
+          workers, the number of worker processes, see tmc_shards.py.
+    Returns: df_lottr, a pandas dataframe with one row per TMC and one
+             80th/50th percentile travel time ratio column per time period:
+             MF_6_9, MF_10_15, MF_16_19, SATSUN_6_19.
     """
-    df_lottr.loc[:, '80_pct_tt'] = df_lottr['travel_time_seconds']
-    df_lottr.loc[:, '50_pct_tt'] = df_lottr['travel_time_seconds']
+    return parallel_period_ttr(df_lottr, 80, workers)
 
-    tmc_operations = ({'80_pct_tt': lambda x: np.percentile(x, 80),
-                       '50_pct_tt': lambda x: np.percentile(x, 50)})
 
-    df_lottr = df_lottr.groupby('tmc_code', as_index=False).agg(tmc_operations)
-    column_name = '{0}_{1}'.format(days, time_period)
-    df_lottr[column_name] = df_lottr['80_pct_tt'] / df_lottr['50_pct_tt']
-    #df_lottr = df_lottr.drop('travel_time_seconds', axis=1)
-
-    return df_lottr
+@profiled
+def agg_travel_times(df_tt, workers=1):
+    """Aggregates weekday and weekend travel time reliability values.
+    Args: df_tt, a pandas dataframe.
+          workers, the number of worker processes, see tmc_shards.py.
+    Returns: df_tmc, a pandas dataframe with one row per TMC and one LOTTR
+             column per time period.
+    """
+    df_tt = assign_period(df_tt, LOTTR_PERIODS)
+    df_tmc = calc_lottr(df_tt, workers)
 
+    return df_tmc
 
 
-def agg_travel_time_sat_sun(df_tt):
-    """Aggregates weekend truck travel time reliability values.
-    Args: df_tt, a pandas dataframe.
-    Returns: df_ttr_all_times, a pandas dataframe with stacked truck travel
-             time reliability numbers for easy group_by characteristics.
+@profiled
+def stream_travel_times(chunks, rel_error):
+    """Aggregates weekday and weekend travel time reliability values from
+    streamed chunks, holding only per-TMC quantile sketches in memory.
+    Args: chunks, an iterable of pandas dataframes.
+          rel_error, the sketch's relative error bound.
+    Returns: df_tmc, a pandas dataframe with one row per TMC and one LOTTR
+             column per time period.
     """
-    # create 'clean' dataframe consisting of non-duplicated TMCs
-    tmc_list = df_tt['tmc_code'].drop_duplicates().values.tolist()
-    tmc_format = {'tmc_code': tmc_list}
-    df_tmc = pd.DataFrame.from_dict(tmc_format)
+    df_tmc, df_error = stream_period_ttr(chunks, LOTTR_PERIODS, 80, rel_error)
+    print("Sketch error against exact percentiles:")
+    print(df_error)
 
-    df_6_19 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin(
-        [6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19])]
+    return df_tmc
 
-    df = calc_lottr('SATSUN', '6_19', df_6_19)
-    df_tmc = pd.merge(df_tmc, df, on='tmc_code', how='left')
+
+@profiled
+def hist_travel_times(hists, tmcs):
+    """Aggregates weekday and weekend travel time reliability values from
+    quarter travel time histograms.
+    Args: hists, a list of (tmc_code, period) histogram dataframes.
+          tmcs, the TMC codes to keep.
+    Returns: df_tmc, a pandas dataframe with one row per TMC and one LOTTR
+             column per time period.
+    """
+    df_tmc = annual_period_ttr(hists, 80, period_codes(LOTTR_PERIODS), tmcs)
 
     return df_tmc
 
 
-def agg_travel_times_mf(df_tt):
-    """Aggregates weekday truck travel time reliability values.
-    Args: df_tt, a pandas dataframe.
-    Returns: df_ttr_all_times, a pandas dataframe with stacked truck travel
-             time reliability numbers for easy group_by characteristics.
+@profiled
+def reliability_results(df, dim):
+    """Adds network and TMC metadata attributes to per-TMC LOTTR values and
+    weights them for the percent reliability calculation.
+    Args: df, a pandas dataframe with one row per TMC and one LOTTR column
+              per time period.
+          dim, a TMC dimension, see tmc_dim.network_dim().
+    Returns: df, a pandas dataframe, see calc_ttr().
     """
-    # create 'clean' dataframe consisting of non-duplicated TMCs
-    tmc_list = df_tt['tmc_code'].drop_duplicates().values.tolist()
-    tmc_format = {'tmc_code': tmc_list}
-    df_tmc = pd.DataFrame.from_dict(tmc_format)
+    # Join TMC Metadata and interstate, keeping TMCs with metadata
+    print("Join TMC Metadata...")
+    df = df[dim.isin('meta', df['tmc_code'])]
+    df = dim.attach(df, ['interstate', 'miles', 'tmclinear', 'faciltype',
+                         'aadt', 'aadt_singl', 'aadt_combi', 'nhs_pct'])
+    df = check_reliable(df)
+    df = worst_period(df)
 
-    df_6_9 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin([6, 7, 8, 9])]
-    df_10_15 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin([10, 11, 12, 13,
-                                                               14, 15])]
-    df_16_19 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin([16, 17, 18, 19])]
-    data = {'6_9': df_6_9, '10_15': df_10_15, '16_19': df_16_19}
+    # Note: superceded by single network file w/ `interstate` attribute
+    # Join Interstate values
+    # df_interstate = pd.read_csv(
+    #     os.path.join(os.path.dirname(__file__), wd + 'interstate_tmc_092618.csv'))
+    # df = pd.merge(df, df_interstate, left_on='tmc_code', right_on='Tmc',
+    #               how='left')
 
-    for key, value in data.items():
-        df = calc_lottr('MF', key, value)
-        df_tmc = pd.merge(df_tmc, df, on='tmc_code', how='left')
+    df = AADT_splits(df)
+    df = calc_ttr(df)
+    return df
 
-    return df_tmc
 
+@profiled
 def main():
     """Main script to calculate LOTTR."""
     startTime = dt.datetime.now()
@@ -169,94 +229,75 @@ def main():
     folder_end = 'pdx-3co-mtip-2019-all-15min'
     file_end = '.csv'
 
-    df = pd.DataFrame()  # Empty dataframe
-
-    for q in quarters:
-        filename = q + folder_end + file_end
-        path = q + folder_end
-        full_path = path + '/' + filename
-        print("Loading {0} data...".format(full_path))
-        df_temp = pd.read_csv(
-                    os.path.join(
-                        os.path.dirname(__file__), drive_path + full_path))
-        df = pd.concat([df, df_temp], sort=False)
-
-    # df = df.dropna()
-    if sum(pd.isna(df['travel_time_seconds'])) != 0:
-        df = df.dropna(subset=['travel_time_seconds'])
-
-    # Filter by timestamps
-    print("Filtering timestamps...".format(q))
-    df.loc[:, 'measurement_tstamp'] = pd.to_datetime(df['measurement_tstamp'])
-    df.loc[:, 'hour'] = df['measurement_tstamp'].dt.hour
-
-    wd = 'H:/map21/2020/data/networks/'
-
-    df = df[df['measurement_tstamp'].dt.hour.isin(
-        [6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19])]
-
-    # Join/filter on relevant Metro TMCs
-    print("Join/filter on Metro TMCs...")
-    df_urban = pd.read_csv(
-        os.path.join(os.path.dirname(__file__), wd + 'metro-2019.csv'),
-        usecols=('Tmc', 'interstate'))
-
-    # This is necessary in pandas > v.0.22.0 ####
-    #df = df.drop('key_0', axis=1)
-    #############################################
-
-    #df = pd.merge(df_urban, df, how='inner', left_on=df_urban['Tmc'],
-    #              right_on=df['tmc_code'])
-
-    df = pd.merge(df, df_urban, how='right', left_on=df['tmc_code'],
-                  right_on=df_urban['Tmc'])
-    df = df.drop('key_0', axis=1)
-
-    #df.describe()
-    # Apply calculation functions
-    print("Applying calculation functions...")
-    # df = AADT_splits(df)
-
-    # Separate weekend and weekday dataframes for processing
-    df_mf = df[df['measurement_tstamp'].dt.weekday.isin([0, 1, 2, 3, 4])]
-    df_sat_sun = df[df['measurement_tstamp'].dt.weekday.isin([5, 6])]
-    df_mf = agg_travel_times_mf(df_mf)
-    df_sat_sun = agg_travel_time_sat_sun(df_sat_sun)
-
-    # Combined weekend, weekday dataset
-    df = pd.merge(df_mf, df_sat_sun, on='tmc_code')
-    # Add interstate back (TODO: fix this in aggregate funcs)
-    df = pd.merge(df, df_urban, how='left', left_on='tmc_code',
-                  right_on='Tmc')
-    #df = df.drop('key_0', axis=1)
-    df = check_reliable(df)
+    # Metro TMCs, pushed down to the loader so other TMCs are never kept
+    df_urban = load_reference('metro_network', 'lottr')
 
-    # Join TMC Metadata
-    print("Join TMC Metadata...")
-    df_meta = pd.read_csv(
-        os.path.join(
+    # TMC Metadata
+    df_meta = load_reference(
+        'tmc_identification', 'lottr',
+        path=os.path.join(
             os.path.dirname(__file__),
             drive_path + folder_end + '/' +
-            'TMC_Identification.csv'),
-        usecols=['tmc', 'miles', 'tmclinear', 'faciltype', 'aadt',
-                 'aadt_singl', 'aadt_combi', 'nhs_pct'])
-
-    df = pd.merge(df, df_meta, left_on=df['tmc_code'],
-                  right_on=df_meta['tmc'], how='inner')
-
-    # ###########This is necessary in pandas > v.0.22.0 ####
-    df = df.drop('key_0', axis=1)
-    ########################################################
-
-    # Note: superceded by single network file w/ `interstate` attribute
-    # Join Interstate values
-    # df_interstate = pd.read_csv(
-    #     os.path.join(os.path.dirname(__file__), wd + 'interstate_tmc_092618.csv'))
-    # df = pd.merge(df, df_interstate, left_on='tmc_code', right_on='Tmc',
-    #               how='left')
-
-    df = AADT_splits(df)
-    df = calc_ttr(df)
+            'TMC_Identification.csv'))
+    dim = network_dim(df_urban, df_meta)
+
+    # Load and filter by timestamps (6am - 8pm) while reading, through the
+    # HDF5 store (built from the csv files on first use)
+    paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    store_path = os.path.join(
+        os.path.dirname(__file__), drive_path + folder_end + '.h5')
+
+    # Percentile engine: 'rows' loads every reading; 'cube' slices a
+    # memory-mapped TMC x day x epoch cube built once from the store (see
+    # tt_cube.py); 'histogram' sums saved per-quarter travel time histograms
+    # (exact, see tt_hist.py); 'sketch' streams month by month through
+    # quantile sketches with relative error sketch_error (see tt_sketch.py).
+    engine = 'rows'
+    sketch_error = 0.005
+    # Worker processes for the 'rows' engine's percentiles (None: all CPUs)
+    workers = 1
+
+    if engine == 'rows':
+        df = read_cached(paths, store_path, columns=measure_columns('lottr'),
+                         hours=range(6, 20), tmcs=df_urban['Tmc'])
+
+        # df = df.dropna()
+        if sum(pd.isna(df['travel_time_seconds'])) != 0:
+            df = df.dropna(subset=['travel_time_seconds'])
+
+        # Filter on relevant Metro TMCs
+        print("Filter on Metro TMCs...")
+        df = df[dim.isin('urban', df['tmc_code'])]
+
+        #df.describe()
+        # Apply calculation functions
+        print("Applying calculation functions...")
+        # df = AADT_splits(df)
+
+        df = agg_travel_times(df, workers)
+    elif engine == 'cube':
+        cube = cached_cube(
+            os.path.join(os.path.dirname(__file__),
+                         drive_path + folder_end + '.cube'),
+            paths, store_path, df_urban['Tmc'])
+        print("Applying calculation functions...")
+        df = cube_period_ttr(cube, LOTTR_PERIODS, 80)
+    elif engine == 'histogram':
+        print("Summing quarter histograms...")
+        hists = [cached_histogram(
+                     histogram_path(path, 'lottr'), [path],
+                     lambda path=path: file_histogram(path, LOTTR_PERIODS,
+                                                      hours=range(6, 20)))
+                 for path in paths]
+        df = hist_travel_times(hists, df_urban['Tmc'])
+    else:
+        print("Streaming through quantile sketches...")
+        chunks = iter_cached(paths, store_path,
+                             columns=measure_columns('lottr'),
+                             hours=range(6, 20), tmcs=df_urban['Tmc'])
+        df = stream_travel_times(chunks, sketch_error)
+
+    df = reliability_results(df, dim)
     print(calc_pct_reliability(df))
 
     #df.to_csv('lottr_out_2019_mtip2020_nhspct.csv')
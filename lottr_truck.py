@@ -12,8 +12,28 @@ import os
 import pandas as pd
 import numpy as np
 import datetime as dt
-
-
+from calendar_keys import add_calendar_keys
+from npmrds_io import quarter_paths, read_npmrds
+from npmrds_schema import measure_columns, table_columns
+from npmrds_store import ensure_store, iter_store, read_cached, store_months
+from periods import TTTR_PERIODS, assign_period, period_codes
+from profiling import profiled
+from reference_cache import load_reference
+from tmc_dim import TmcDim, network_dim
+from tmc_shards import parallel_period_ttr
+from tt_grid import (grid_period_ttr, grid_start, read_grid, truck_fallback,
+                     truck_missing_rows)
+from tt_hist import (build_histogram, cached_histogram, hist_period_ttr,
+                     histogram_path, keep_tmcs, merge_histograms)
+from tt_sketch import stream_period_ttr
+
+
+# Histogram bin counting Truck readings with a missing travel time, which
+# decide the missing travel time rule of fill_truck_times()
+TRUCK_MISSING_BIN = -2
+
+
+@profiled
 def calc_freight_reliability(df_rel):
     """
     Calculates TTTR (Truck Travel Time Reliability), AKA freight reliability.
@@ -34,6 +54,7 @@ def calc_freight_reliability(df_rel):
     return df_rel, tttr_index
 
 
+@profiled
 def calc_ttr(df_ttr):
     """Calculates travel time reliability.
     Args: df_ttr, a pandas dataframe.
@@ -47,6 +68,7 @@ def calc_ttr(df_ttr):
     return df_ttr
 
 
+@profiled
 def AADT_splits(df_spl):
     """Calculates AADT by truck vehicle type.
     Args: df_spl, a pandas dataframe.
@@ -60,79 +82,186 @@ def AADT_splits(df_spl):
     return df_spl
 
 
+@profiled
 def get_max_ttr(df_max):
     """Returns maximum ttr calculated per TMC.
-    Args: df_max, a pandas dataframe.
-    Returns: df_max, a dataframe containing grouped TMCs with max tttr values.
+    Args: df_max, a pandas dataframe with one TTTR column per time period.
+    Returns: df_max, a dataframe containing TMCs with max tttr values.
     """
-    ttr_operations = ({'tttr': 'max'})
-    df_max = df_max.groupby('tmc_code', as_index=False).agg(ttr_operations)
+    df_max['tttr'] = df_max[period_codes(TTTR_PERIODS)].max(axis=1)
+    df_max = df_max[['tmc_code', 'tttr']]
 
     return df_max
 
 
-def calc_lottr(df_lottr):
+@profiled
+def calc_lottr(df_lottr, workers=1):
     """Calculates LOTTR (Level of Travel Time Reliability) using FHWA metrics.
-    Args: df_lottr, a pandas dataframe.
-    Returns: df_lottr, a pandas dataframe with new columns:
-             95_pct_tt, 95th percentile calculation.
-             50_pct_tt, 50th percentile calculation.
-             tttr, completed truck travel time reliability calculation.
+    Args: df_lottr, a pandas dataframe with a 'period' column.
+          workers, the number of worker processes, see tmc_shards.py.
+    Returns: df_lottr, a pandas dataframe with one row per TMC and one
+             95th/50th percentile truck travel time ratio column per time
+             period.
     """
-    df_lottr.loc[:, '95_pct_tt'] = df_lottr['travel_time_seconds']
-    df_lottr.loc[:, '50_pct_tt'] = df_lottr['travel_time_seconds']
+    return parallel_period_ttr(df_lottr, 95, workers)
 
-    tmc_operations = ({'95_pct_tt': lambda x: np.percentile(x, 95),
-                       '50_pct_tt': lambda x: np.percentile(x, 50)})
 
-    df_lottr = df_lottr.groupby('tmc_code', as_index=False).agg(tmc_operations)
-    df_lottr['tttr'] = df_lottr['95_pct_tt'] / df_lottr['50_pct_tt']
+@profiled
+def agg_travel_times(df_tt, workers=1):
+    """Aggregates weekday and weekend truck travel time reliability values.
+    Args: df_tt, a pandas dataframe.
+          workers, the number of worker processes, see tmc_shards.py.
+    Returns: df_tmc, a pandas dataframe with one row per TMC and one TTTR
+             column per time period, including weekday and weekend
+             overnight.
+    """
+    df_tt = assign_period(df_tt, TTTR_PERIODS)
+    df_tmc = calc_lottr(df_tt, workers)
 
-    return df_lottr
+    return df_tmc
 
 
-def agg_travel_times(df_tt, days):
-    """Aggregates weekday truck travel time reliability values.
-    Args: df_tt, a pandas dataframe.
-    Returns: df_ttr_all_times, a pandas dataframe with stacked truck travel
-             time reliability numbers for easy group_by characteristics.
+@profiled
+def stream_travel_times(chunks, rel_error):
+    """Aggregates weekday and weekend truck travel time reliability values
+    from streamed chunks, holding only per-TMC quantile sketches in memory.
+    Args: chunks, an iterable of pandas dataframes.
+          rel_error, the sketch's relative error bound.
+    Returns: df_tmc, a pandas dataframe with one row per TMC and one TTTR
+             column per time period.
     """
-    # creates df containing all tmcs and ttrs listed vertically
-    tmc_list = df_tt['tmc_code'].drop_duplicates().values.tolist()
-    tmc_format = {'tmc_code': tmc_list}
-    df_tmc = pd.DataFrame.from_dict(tmc_format)
-
-    overnight = [list(range(20, 24)), list(range(0, 7))]
-    overnight = [hour for lst in overnight for hour in lst]
+    df_tmc, df_error = stream_period_ttr(chunks, TTTR_PERIODS, 95, rel_error)
+    print("Sketch error against exact percentiles:")
+    print(df_error)
 
-    if days == 'MF':
-        df_6_9 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin(
-            list(range(6, 10)))]
-        df_10_15 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin(
-            list(range(10, 16)))]
-        df_16_19 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin(
-            list(range(16, 20)))]
+    return df_tmc
 
-        df_20_6 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin(overnight)]
 
-        df_list = [df_6_9,  df_10_15, df_16_19, df_20_6]
+def truck_missing(chunks):
+    """Checks whether any Truck reading has a missing travel time.
+    Args: chunks, an iterable of pandas dataframes of Truck readings.
+    Returns: True if any reading's travel time is missing.
+    """
+    return any(chunk['travel_time_seconds'].isna().any() for chunk in chunks)
+
+
+@profiled
+def fill_truck_times(df, df2, drop_missing=None):
+    """Swaps in all vehicle travel times where Truck times are missing or
+    zero.
+    Args: df, a pandas dataframe of Truck travel times.
+          df2, a pandas dataframe of all vehicle travel times for the same
+               TMCs and dates.
+          drop_missing, True to drop all vehicle readings with a missing
+                        travel time; by default they are dropped if any
+                        Truck reading in df has one. Pass the rule decided
+                        over all the data when df is only part of it.
+    Returns: df, a pandas dataframe with one row per all vehicle reading and
+             calendar key columns.
+    """
+    # we'll use all vehicle times where Truck times missing, so all vehicle
+    # files define availability
+    if drop_missing is None:
+        drop_missing = truck_missing([df])
+    if drop_missing:
+        df2 = df2.dropna(subset=['travel_time_seconds'])
 
-    if days == 'SATSUN':
-        df_6_19 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin(
-            list(range(6, 20)))]
+    print('Merging Truck & All Vehicle data...')
+    # calendar keys come from the all vehicle side, which defines the rows
+    df = df[['tmc_code', 'measurement_tstamp', 'travel_time_seconds']]
+    df = pd.merge(df, df2, how='right', on=('tmc_code', 'measurement_tstamp'),
+                  suffixes=('', '_all'))
+    df = add_calendar_keys(df)
 
-        df_20_6 = df_tt[df_tt['measurement_tstamp'].dt.hour.isin(overnight)]
+    # Swap in All vehicle values where Truck missing or zero
+    df['travel_time_seconds'] = np.where(pd.isna(df['travel_time_seconds'])
+      | (df['travel_time_seconds'] == 0),
+      df['travel_time_seconds_all'], df['travel_time_seconds'])
 
-        df_list = [df_6_19, df_20_6]
+    return df
+
+
+@profiled
+def quarter_histogram(truck_path, all_path):
+    """Builds the truck travel time histogram of one quarter, filling in all
+    vehicle times where Truck times are missing or zero.
+    Whether all vehicle readings with a missing travel time are dropped is
+    decided over the network TMCs of the whole year (see
+    hist_travel_times()), so the histogram keeps them: the column
+    all_missing flags the readings whose all vehicle travel time is missing
+    (tt_hist.MISSING_BIN if the Truck one is too), and TRUCK_MISSING_BIN
+    counts the Truck readings with a missing travel time.
+    Args: truck_path, all_path, the quarter's Truck and all vehicle csv files.
+    Returns: df_hist, a (tmc_code, period, all_missing) histogram dataframe,
+             see tt_hist.py.
+    """
+    usecols = table_columns('npmrds', 'tttr')
+    df_truck = read_npmrds(truck_path, usecols=usecols)
+    df_missing = assign_period(
+        df_truck[df_truck['travel_time_seconds'].isna()].copy(),
+        TTTR_PERIODS)
+    df_missing = build_histogram(df_missing, keep_missing=True)
+    df_missing['bin'] = TRUCK_MISSING_BIN
+    df_missing['all_missing'] = False
+
+    df = fill_truck_times(df_truck, read_npmrds(all_path, usecols=usecols),
+                          drop_missing=False)
+    df = assign_period(df, TTTR_PERIODS)
+    all_missing = df['travel_time_seconds_all'].isna().values
+
+    hists = [df_missing]
+    for flag in [False, True]:
+        df_hist = build_histogram(df[all_missing == flag], keep_missing=True)
+        df_hist['all_missing'] = flag
+        hists.append(df_hist)
+    return merge_histograms(hists)
+
+
+@profiled
+def hist_travel_times(hists, tmcs):
+    """Aggregates weekday and weekend truck travel time reliability values
+    from quarter histograms (see quarter_histogram()).
+    As in fill_truck_times(), all vehicle readings with a missing travel
+    time are dropped only if some Truck reading of the TMCs kept has one.
+    Args: hists, a list of (tmc_code, period) histogram dataframes.
+          tmcs, the TMC codes to keep.
+    Returns: df_tmc, a pandas dataframe with one row per TMC and one TTTR
+             column per time period.
+    """
+    df_hist = keep_tmcs(merge_histograms(hists), tmcs)
+    truck_missing = (df_hist['bin'] == TRUCK_MISSING_BIN).values
+    df_hist = df_hist[~truck_missing]
+    if truck_missing.any():
+        df_hist = df_hist[~df_hist['all_missing'].values.astype(bool)]
+    df_tmc = hist_period_ttr(df_hist, 95, period_codes(TTTR_PERIODS))
+
+    return df_tmc
+
+
+@profiled
+def freight_results(df, dim):
+    """Adds network and TMC metadata attributes to per-TMC TTTR values and
+    calculates the freight reliability index.
+    Args: df, a pandas dataframe with one row per TMC and one TTTR column
+              per time period.
+          dim, a TMC dimension, see tmc_dim.network_dim().
+    Returns: df, a pandas dataframe, see calc_ttr().
+             reliability_index, see calc_freight_reliability().
+    """
+    df = get_max_ttr(df)
 
-    df_ttr_all_times = pd.DataFrame()
-    for df in df_list:
-        df_temp = calc_lottr(df)
-        df_ttr_all_times = pd.concat([df_ttr_all_times, df_temp], sort=False)
+    # Join TMC Metadata and interstate, keeping TMCs with metadata
+    print("Join TMC Metadata...")
+    df = df[dim.isin('meta', df['tmc_code'])]
+    df = dim.attach(df, ['interstate', 'miles', 'faciltype', 'aadt',
+                         'aadt_singl', 'aadt_combi'])
 
-    return df_ttr_all_times
+    df = AADT_splits(df)
+    df = calc_ttr(df)
+    return calc_freight_reliability(df)
 
 
+@profiled
 def main():
     """Main script to calculate TTTR."""
     startTime = dt.datetime.now()
@@ -144,112 +273,111 @@ def main():
     # quarters = ['2017Q0', '2017Q1', '2017Q2', '2017Q3', '2017Q4']
     folder_end = 'pdx-3co-mtip-2019-trucks-15min'
     file_end = '.csv'
-    df = pd.DataFrame()  # Empty dataframe
-
-    for q in quarters:
-        filename = q + folder_end + file_end
-        path = q + folder_end
-        full_path = path + '/' + filename
-        print("Loading {0} data (Truck)...".format(full_path))
-        df_temp = pd.read_csv(
-                    os.path.join(
-                        os.path.dirname(__file__), drive_path + full_path),
-                        usecols=('tmc_code', 'measurement_tstamp',
-                                       'travel_time_seconds'))
-        df = pd.concat([df, df_temp], sort=False)
-
-    # Load all vehicle files to use where Truck travel times missing or zero
-    folder_end = 'pdx-3co-mtip-2019-all-15min'
-    df2 = pd.DataFrame()  # Empty dataframe
-
-    for q in quarters:
-        filename = q + folder_end + file_end
-        path = q + folder_end
-        full_path = path + '/' + filename
-        print("Loading {0} data (All Vehicle)...".format(full_path))
-        df_temp = pd.read_csv(
-                    os.path.join(
-                        os.path.dirname(__file__), drive_path + full_path),
-                        usecols=('tmc_code', 'measurement_tstamp',
-                                       'travel_time_seconds'))
-        df_temp = pd.read_csv(drive_path + full_path)
-        df2 = pd.concat([df2, df_temp], sort=False)
-
-    # we'll use all vehicle times where Truck times missing, so all vehicle
-    # files define availability
-    if sum(pd.isna(df['travel_time_seconds'])) != 0:
-        df2 = df2.dropna(subset=['travel_time_seconds'])
-
-    print('Merging Truck & All Vehicle data...')
-    # len1 = len(df)
-    df = pd.merge(df, df2, how='right', on=('tmc_code', 'measurement_tstamp'),
-                  suffixes=('', '_all'))
-
-    # Filter by timestamps
-    print("Filtering timestamps...".format(q))
-    df.loc[:, 'measurement_tstamp'] = pd.to_datetime(df['measurement_tstamp'])
-    df.loc[:, 'hour'] = df['measurement_tstamp'].dt.hour
     wd = 'H:/map21/2020/data/networks/'
 
-    # Join/filter on relevant Metro TMCs
-    print("Join/filter on Metro TMCs...")
+    # Metro TMCs, pushed down to the loader so other TMCs are never kept
     # df_urban = pd.read_csv(
     #     os.path.join(os.path.dirname(__file__), wd + 'metro_tmc_092618.csv'))
-    df_urban = pd.read_csv(
-        os.path.join(os.path.dirname(__file__), wd + 'metro-2019.csv'),
-        usecols=('Tmc', 'interstate'))
-    df = pd.merge(df, df_urban, how='inner', left_on=df['tmc_code'],
-                  right_on=df_urban['Tmc'])
-    # df = df.drop('key_0', axis=1)
-
-    # Swap in All vehicle values where Truck missing or zero
-    df['travel_time_seconds'] = np.where(pd.isna(df['travel_time_seconds'])
-      | (df['travel_time_seconds'] == 0),
-      df['travel_time_seconds_all'], df['travel_time_seconds'])
-
-    # Apply calculation functions
-    print("Applying calculation functions...")
-    # Separate weekend and weekday dataframes for processing
-    df_mf = df[df['measurement_tstamp'].dt.weekday.isin([0, 1, 2, 3, 4])]
-    df_sat_sun = df[df['measurement_tstamp'].dt.weekday.isin([5, 6])]
-    df_mf = agg_travel_times(df_mf, 'MF')
-    df_sat_sun = agg_travel_times(df_sat_sun, 'SATSUN')
-
-    # Combine weekend, weekday dataset
-    df = pd.concat([df_mf, df_sat_sun], sort=False)
-    df = get_max_ttr(df)
+    df_urban = load_reference('metro_network', 'tttr')
 
-    # Add interstate back (TODO: fix this in aggregate funcs)
-    df = pd.merge(df, df_urban, how='left', left_on='tmc_code',
-                  right_on='Tmc')
-
-    # Join TMC Metadata
-    print("Join TMC Metadata...")
-    df_meta = pd.read_csv(
-        os.path.join(
+    # Both feeds are read through HDF5 stores built from the csv files on
+    # first use; all vehicle times fill in where Truck times are missing
+    truck_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    truck_store = os.path.join(os.path.dirname(__file__),
+                               drive_path + folder_end + '.h5')
+    folder_end = 'pdx-3co-mtip-2019-all-15min'
+    all_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    all_store = os.path.join(os.path.dirname(__file__),
+                             drive_path + folder_end + '.h5')
+
+    # TMC Metadata
+    df_meta = load_reference(
+        'tmc_identification', 'tttr',
+        path=os.path.join(
             os.path.dirname(__file__),
             drive_path + folder_end + '/' +
-            'TMC_Identification.csv'),
-        usecols=['tmc', 'miles', 'faciltype', 'aadt', 'aadt_singl',
-                 'aadt_combi'])
-
-    df = pd.merge(df, df_meta, left_on=df['tmc_code'],
-                  right_on=df_meta['tmc'], how='inner')
-
-    # ###########This is necessary in pandas > v.0.22.0 ####
-    df = df.drop('key_0', axis=1)
-    ########################################################
-
-    # Note: superceded by single network file w/ `interstate` attribute
-    # Join Interstate values
-    # df_interstate = pd.read_csv(
-    #     os.path.join(os.path.dirname(__file__), wd + 'interstate_tmc_092618.csv'))
-    # df = pd.merge(df, df_interstate, left_on='tmc_code', right_on='Tmc',
-    #               how='left')
-
-    df = AADT_splits(df)
-    df = calc_ttr(df)
-    df, reliability_index = calc_freight_reliability(df)
+            'TMC_Identification.csv'))
+    dim = network_dim(df_urban, df_meta)
+
+    # Percentile engine: 'grid' loads both feeds into aligned TMC x 15-minute
+    # arrays (see tt_grid.py); 'rows' loads and joins every reading;
+    # 'histogram' sums saved
+    # per-quarter travel time histograms (exact, see tt_hist.py); 'sketch'
+    # streams month by month through quantile sketches with relative error
+    # sketch_error (see tt_sketch.py).
+    engine = 'grid'
+    sketch_error = 0.005
+    # Worker processes for the 'rows' engine's percentiles (None: all CPUs)
+    workers = 1
+
+    if engine == 'rows':
+        print("Loading Truck data...")
+        df = read_cached(truck_paths, truck_store,
+                         columns=measure_columns('tttr'), tmcs=df_urban['Tmc'])
+
+        # Load all vehicle files to use where Truck travel times missing or
+        # zero
+        print("Loading All Vehicle data...")
+        df2 = read_cached(all_paths, all_store,
+                          columns=measure_columns('tttr'),
+                          tmcs=df_urban['Tmc'])
+
+        df = fill_truck_times(df, df2)
+
+        # Filter on relevant Metro TMCs
+        print("Filter on Metro TMCs...")
+        df = df[dim.isin('urban', df['tmc_code'])]
+
+        # Apply calculation functions
+        print("Applying calculation functions...")
+        df = agg_travel_times(df, workers)
+    elif engine == 'grid':
+        print("Loading Truck & All Vehicle grids...")
+        ensure_store(truck_paths, truck_store)
+        ensure_store(all_paths, all_store)
+        months = sorted(set(store_months(truck_store))
+                        & set(store_months(all_store)))
+        grid_dim = TmcDim(df_urban['Tmc'])
+        truck, truck_present = read_grid(truck_store, grid_dim, months)
+        drop_missing = truck_missing_rows(truck, truck_present).any()
+        del truck_present
+        all_tt, present = read_grid(all_store, grid_dim, months)
+        grid, present = truck_fallback(truck, all_tt, present, drop_missing)
+        del truck, all_tt
+
+        print("Applying calculation functions...")
+        df = grid_period_ttr(grid, grid_dim, grid_start(months),
+                             TTTR_PERIODS, 95, present)
+    elif engine == 'histogram':
+        print("Summing quarter histograms...")
+        hists = [cached_histogram(
+                     histogram_path(truck_path, 'tttr'),
+                     [truck_path, all_path],
+                     lambda truck_path=truck_path, all_path=all_path:
+                         quarter_histogram(truck_path, all_path))
+                 for truck_path, all_path in zip(truck_paths, all_paths)]
+        df = hist_travel_times(hists, df_urban['Tmc'])
+    else:
+        print("Streaming through quantile sketches...")
+        ensure_store(truck_paths, truck_store)
+        ensure_store(all_paths, all_store)
+        months = sorted(set(store_months(truck_store))
+                        & set(store_months(all_store)))
+        # the missing travel time rule holds for the whole year, so it is
+        # decided before streaming month by month
+        drop_missing = truck_missing(iter_store(
+            truck_store, columns=['travel_time_seconds'], months=months,
+            tmcs=df_urban['Tmc']))
+        truck_chunks = iter_store(truck_store,
+                                  columns=measure_columns('tttr'),
+                                  months=months, tmcs=df_urban['Tmc'])
+        all_chunks = iter_store(all_store, columns=measure_columns('tttr'),
+                                months=months, tmcs=df_urban['Tmc'])
+        chunks = (fill_truck_times(df, df2, drop_missing)
+                  for df, df2 in zip(truck_chunks, all_chunks))
+        df = stream_travel_times(chunks, sketch_error)
+
+    df, reliability_index = freight_results(df, dim)
     print(reliability_index)
 
     df.to_csv('lottr_truck_out_2018_mtip2020.csv')
@@ -0,0 +1,155 @@
+"""
+npmrds_io.py
+
+Shared multi-file NPMRDS loader.
+
+Reads a list of quarter/month files (or glob patterns) chunk by chunk,
+applies row filters (hours, weekdays, dates, TMC membership) to each chunk
+as it is read, and concatenates the surviving chunks once at the end. Rows
+that would be discarded straight away are never accumulated, and the result
+is not recopied once per file as it is with `pd.concat` in a loop. Columns
+and dtypes come from the shared schema (npmrds_schema.py): only the
+requested (default: declared) columns are parsed, TMC codes and timestamps
+as categories and measures as float32.
+
+Usage:
+>>>from npmrds_io import quarter_paths, read_npmrds
+>>>paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+>>>df = read_npmrds(paths, usecols=table_columns('npmrds', 'lottr'),
+                    hours=range(6, 20), tmcs=df_urban['Tmc'])
+"""
+
+import os
+import glob
+import pandas as pd
+import numpy as np
+from calendar_keys import add_calendar_keys
+from npmrds_schema import table_dtypes, table_usecols
+from profiling import profiled
+
+
+CHUNKSIZE = 1000000
+
+
+def quarter_paths(drive_path, quarters, folder_end, file_end):
+    """Builds NPMRDS file paths for the <q><folder_end>/<q><folder_end><file_end>
+    layout used by the RITIS downloads.
+    Args: drive_path, the data directory.
+          quarters, a list of quarter/month prefixes (e.g. ['2017Q1']).
+          folder_end, the download folder suffix.
+          file_end, the csv file suffix.
+    Returns: paths, a list of full file paths.
+    """
+    paths = []
+    for q in quarters:
+        filename = q + folder_end + file_end
+        path = q + folder_end
+        full_path = path + '/' + filename
+        paths.append(
+            os.path.join(os.path.dirname(__file__), drive_path + full_path))
+    return paths
+
+
+def expand_paths(paths):
+    """Expands glob patterns in a list of paths, keeping order.
+    Args: paths, a path, glob pattern or list of either.
+    Returns: a list of file paths.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    expanded = []
+    for path in paths:
+        if glob.has_magic(path):
+            expanded.extend(sorted(glob.glob(path)))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+@profiled
+def filter_rows(df, hours=None, weekdays=None, tmcs=None, dates=None,
+                tstamp_col='measurement_tstamp'):
+    """Applies row filters to a chunk of NPMRDS data.
+    Args: df, a pandas dataframe.
+          hours, optional list of hours of day to keep.
+          weekdays, optional list of weekdays to keep (0 = Monday).
+          tmcs, optional collection of TMC codes to keep.
+          dates, optional date_rules.DateRules of the days to keep.
+          tstamp_col, name of the timestamp column.
+    Returns: df, the filtered dataframe. The timestamp column is parsed and
+             calendar key columns added (see calendar_keys.py) when an hour,
+             weekday or date filter is given.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    if tmcs is not None:
+        mask &= df['tmc_code'].isin(tmcs).values
+
+    if hours is not None or weekdays is not None or dates is not None:
+        df = add_calendar_keys(df, tstamp_col)
+        if hours is not None:
+            mask &= np.isin(df['hour'].values, list(hours))
+        if weekdays is not None:
+            mask &= np.isin(df['weekday'].values, list(weekdays))
+        if dates is not None:
+            mask &= dates.mask(df, tstamp_col)
+
+    return df[mask]
+
+
+def iter_npmrds(paths, usecols=None, hours=None, weekdays=None, tmcs=None,
+                chunksize=CHUNKSIZE, dates=None, **kwargs):
+    """Streams one or more NPMRDS csv files as filtered chunks.
+    Args: paths, a path, glob pattern or list of either.
+          usecols, optional list of columns to read (default: the
+                   schema's NPMRDS columns the files have).
+          hours, weekdays, tmcs, dates, optional row filters, see
+                                        filter_rows().
+          chunksize, rows per chunk read (None reads each file at once).
+          kwargs, passed through to pd.read_csv (dtype defaults to the
+                  schema's).
+    Yields: filtered pandas dataframes, at most chunksize rows each.
+    """
+    kwargs.setdefault('dtype', table_dtypes('npmrds', usecols))
+    usecols = table_usecols('npmrds', usecols)
+    if tmcs is not None:
+        tmcs = pd.Index(pd.unique(np.asarray(tmcs)))
+
+    for path in expand_paths(paths):
+        print("Loading {0} data...".format(path))
+        if chunksize is None:
+            chunks = [pd.read_csv(path, usecols=usecols, **kwargs)]
+        else:
+            chunks = pd.read_csv(path, usecols=usecols, chunksize=chunksize,
+                                 **kwargs)
+        for chunk in chunks:
+            yield filter_rows(chunk, hours, weekdays, tmcs, dates)
+
+
+def concat_chunks(frames):
+    """Concatenates chunks, keeping categorical columns categorical.
+    Each chunk read has its own categories, which pd.concat would turn
+    into object columns; the categories are unified first.
+    Args: frames, a list of pandas dataframes with the same columns.
+    Returns: df, a pandas dataframe.
+    """
+    for col in frames[0].columns:
+        if not isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            continue
+        categories = pd.unique(np.concatenate(
+            [np.asarray(frame[col].cat.categories) for frame in frames]))
+        frames = [frame.assign(**{col: frame[col].cat.set_categories(
+                      categories)})
+                  for frame in frames]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+@profiled
+def read_npmrds(paths, usecols=None, hours=None, weekdays=None, tmcs=None,
+                chunksize=CHUNKSIZE, dates=None, **kwargs):
+    """Loads one or more NPMRDS csv files into a single dataframe.
+    Args: see iter_npmrds().
+    Returns: df, a pandas dataframe of all files, filtered.
+    """
+    frames = list(iter_npmrds(paths, usecols, hours, weekdays, tmcs,
+                              chunksize, dates, **kwargs))
+    return concat_chunks(frames)
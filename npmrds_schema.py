@@ -0,0 +1,163 @@
+"""
+npmrds_schema.py
+
+Shared schema of the NPMRDS and reference files.
+
+Declares the columns of each file the scripts read, with explicit compact
+dtypes, and the columns each measure needs from each file. Loaders read only
+those columns, with those dtypes, instead of every column with pandas'
+inferred int64/float64/object types:
+    - NPMRDS travel time files: tmc_code and measurement_tstamp as category
+      (every TMC code and timestamp repeats across the file), measure
+      columns as float32;
+    - reference tables (one row per TMC): TMC codes as strings, integer
+      valued attributes (AADT, facility type, ...) as float32, which holds
+      them exactly and allows blanks; miles and peaking factors stay
+      float64, as they are summed and multiplied into the measures.
+
+Tables:
+    'npmrds'              NPMRDS travel time csv downloads
+    'tmc_identification'  TMC_Identification metadata
+    'network'             Metro network TMC lists (urban_tmc, metro-2019,
+                          WA_tmc, ...)
+    'here'                HERE static speed limits
+    'peak_factors'        15-minute peaking factors
+
+Usage:
+>>>from npmrds_schema import measure_columns, read_table
+>>>df_meta = read_table(meta_path, 'tmc_identification', 'lottr')
+>>>df = read_cached(paths, store_path, columns=measure_columns('lottr'))
+"""
+
+import pandas as pd
+import numpy as np
+
+
+TABLES = {
+    'npmrds': {
+        'tmc_code': 'category',
+        'measurement_tstamp': 'category',
+        'speed': np.float32,
+        'average_speed': np.float32,
+        'reference_speed': np.float32,
+        'travel_time_seconds': np.float32,
+        'travel_time_minutes': np.float32,
+        'data_density': 'category',
+    },
+    'tmc_identification': {
+        'tmc': str,
+        'road': str,
+        'direction': str,
+        'county': str,
+        'state': str,
+        'miles': np.float64,
+        'tmclinear': np.float32,
+        'faciltype': np.float32,
+        'aadt': np.float32,
+        'aadt_singl': np.float32,
+        'aadt_combi': np.float32,
+        'nhs_pct': np.float32,
+    },
+    'network': {
+        'Tmc': str,
+        'interstate': np.float32,
+    },
+    'here': {
+        'TMC_HERE': str,
+        'SPEED_LIMIT': np.float32,
+    },
+    'peak_factors': {
+        'startTime': str,
+        '2015_15-min_Combined': np.float64,
+    },
+}
+
+# NPMRDS columns kept in the HDF5 store, see npmrds_store.py
+STORE_COLUMNS = ['tmc_code', 'measurement_tstamp', 'speed', 'average_speed',
+                 'reference_speed', 'travel_time_seconds',
+                 'travel_time_minutes']
+
+# Columns each measure reads from each table
+MEASURES = {
+    'lottr': {
+        'npmrds': ['tmc_code', 'measurement_tstamp', 'travel_time_seconds'],
+        'network': ['Tmc', 'interstate'],
+        'tmc_identification': ['tmc', 'miles', 'tmclinear', 'faciltype',
+                               'aadt', 'aadt_singl', 'aadt_combi',
+                               'nhs_pct'],
+    },
+    'tttr': {
+        'npmrds': ['tmc_code', 'measurement_tstamp', 'travel_time_seconds'],
+        'network': ['Tmc', 'interstate'],
+        'tmc_identification': ['tmc', 'miles', 'faciltype', 'aadt',
+                               'aadt_singl', 'aadt_combi'],
+    },
+    'phed': {
+        'npmrds': ['tmc_code', 'measurement_tstamp', 'travel_time_seconds'],
+        'network': ['Tmc'],
+        'tmc_identification': ['tmc', 'miles', 'tmclinear', 'faciltype',
+                               'aadt', 'aadt_singl', 'aadt_combi'],
+        'here': ['TMC_HERE', 'SPEED_LIMIT'],
+        'peak_factors': ['startTime', '2015_15-min_Combined'],
+    },
+    'inrix_may': {
+        'npmrds': ['tmc_code', 'measurement_tstamp', 'travel_time_seconds'],
+        'network': ['Tmc'],
+        'tmc_identification': ['tmc', 'miles'],
+    },
+}
+
+
+def table_columns(table, measure=None):
+    """Returns the columns read from a table.
+    Args: table, a table name, see TABLES.
+          measure, optional measure name, see MEASURES (default: every
+                   declared column).
+    """
+    if measure is None:
+        return list(TABLES[table])
+    return list(MEASURES[measure][table])
+
+
+def measure_columns(measure):
+    """Returns the NPMRDS measure columns a measure reads, for the column
+    projection of the store readers (tmc_code and measurement_tstamp are
+    always returned by them)."""
+    return [col for col in table_columns('npmrds', measure)
+            if col not in ['tmc_code', 'measurement_tstamp']]
+
+
+def table_dtypes(table, columns=None):
+    """Returns the read_csv dtype mapping of a table's columns.
+    Args: table, a table name, see TABLES.
+          columns, optional list of columns (default: every declared
+                   column; undeclared columns are left to pandas).
+    """
+    dtypes = TABLES[table]
+    if columns is None:
+        return dict(dtypes)
+    return {col: dtypes[col] for col in columns if col in dtypes}
+
+
+def table_usecols(table, columns=None):
+    """Returns the read_csv usecols of a table: the given columns, or a
+    callable keeping the declared columns a file has."""
+    if columns is not None:
+        return list(columns)
+    return lambda col: col in TABLES[table]
+
+
+def read_table(path, table, measure=None, columns=None, **kwargs):
+    """Reads a reference csv file with the schema's columns and dtypes.
+    Args: path, the csv file.
+          table, a table name, see TABLES.
+          measure, optional measure name whose columns to read, see
+                   MEASURES.
+          columns, optional list of columns to read instead.
+          kwargs, passed through to pd.read_csv.
+    Returns: df, a pandas dataframe.
+    """
+    if columns is None and measure is not None:
+        columns = table_columns(table, measure)
+    return pd.read_csv(path, usecols=table_usecols(table, columns),
+                       dtype=table_dtypes(table, columns), **kwargs)
@@ -0,0 +1,273 @@
+"""
+npmrds_store.py
+
+Partitioned HDF5 cache of NPMRDS travel time data.
+
+Converts the RITIS csv downloads once into an HDF5 store with one table per
+month (keys '/y2019/m01', ...). Tables use compact types (fixed-width TMC
+codes, unsigned integer unix time seconds, float32 travel times, plus the
+int8/int16 calendar keys from calendar_keys.py), hold only the schema's
+STORE_COLUMNS (see npmrds_schema.py), and tmc_code is an indexed
+data column, so readers can pull only the columns, months and TMCs they need
+instead of re-parsing the full csv files and timestamps. The store records
+its layout version and the size and modification time of its source files,
+and is rebuilt when either changes.
+
+Travel times are stored as float32 (about 7 significant digits), ample for
+NPMRDS' hundredths of a second, but percentiles can differ from a direct csv
+read in the trailing float64 digits.
+
+Requires PyTables (pandas HDF5 support).
+
+Usage:
+>>>from npmrds_store import read_cached
+>>>df = read_cached(paths, 'master_NPMRDS.h5',
+                    columns=['travel_time_seconds'], months=[(2019, 5)],
+                    tmcs=df_urban['Tmc'])
+"""
+
+import os
+import pandas as pd
+import numpy as np
+from calendar_keys import CALENDAR_KEYS, add_calendar_keys
+from npmrds_io import expand_paths, filter_rows, read_npmrds
+from npmrds_schema import STORE_COLUMNS, TABLES
+from profiling import profiled
+
+
+TMC_ITEMSIZE = 9
+
+# On-disk layout version, recorded in every store; bump it whenever the
+# table layout changes (2: unix_time and calendar key columns)
+STORE_LAYOUT = 2
+EPOCH = pd.Timestamp('1970-01-01')
+
+# Compact on-disk types for the numeric NPMRDS columns
+FLOAT_COLUMNS = [col for col in STORE_COLUMNS
+                 if TABLES['npmrds'][col] == np.float32]
+
+
+def partition_key(year, month):
+    """Returns the store key of a year/month partition."""
+    return '/y{0}/m{1:02d}'.format(year, month)
+
+
+def key_month(key):
+    """Returns the (year, month) of a store key."""
+    year, month = key.strip('/').split('/')
+    return int(year[1:]), int(month[1:])
+
+
+def to_unix_time(tstamp):
+    """Converts a datetime series to unsigned integer unix time seconds."""
+    seconds = (tstamp - EPOCH) // pd.Timedelta(seconds=1)
+    return seconds.astype(np.uint32)
+
+
+def from_unix_time(unix_time):
+    """Converts unix time seconds back to a datetime series."""
+    return EPOCH + pd.to_timedelta(unix_time.astype(np.int64), unit='s')
+
+
+def compact(df):
+    """Converts an NPMRDS dataframe to the store's on-disk layout.
+    Args: df, a pandas dataframe with a 'measurement_tstamp' column.
+    Returns: df, a pandas dataframe with 'unix_time' (uint32 seconds) in
+             place of 'measurement_tstamp', calendar key columns, float32
+             measure columns and string TMC codes, sorted by tmc_code then
+             unix_time.
+    """
+    df = add_calendar_keys(df.copy())
+    df['unix_time'] = to_unix_time(df['measurement_tstamp'])
+    df = df.drop('measurement_tstamp', axis=1)
+    df['tmc_code'] = df['tmc_code'].astype(str)
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.float32)
+    df = df.sort_values(['tmc_code', 'unix_time'], kind='mergesort')
+    return df.reset_index(drop=True)
+
+
+def write_store(df, store_path):
+    """Appends NPMRDS rows to their year/month partitions.
+    Args: df, a pandas dataframe with a 'measurement_tstamp' column.
+          store_path, the HDF5 file to append to.
+    """
+    df = compact(df)
+    year = from_unix_time(df['unix_time']).dt.year.values
+    with pd.HDFStore(store_path, mode='a', complevel=5,
+                     complib='blosc') as store:
+        for (year, month), part in df.groupby([year, df['month'].values]):
+            store.append(partition_key(year, month), part, format='table',
+                         data_columns=['tmc_code'], index=False,
+                         min_itemsize={'tmc_code': TMC_ITEMSIZE})
+
+
+def partition_keys(store):
+    """Returns the year/month partition keys of an open store."""
+    return [key for key in store.keys() if key.startswith('/y')]
+
+
+def source_table(paths):
+    """Describes csv source files by path, size and modification time."""
+    paths = expand_paths(paths)
+    return pd.DataFrame({'path': [os.path.abspath(path) for path in paths],
+                         'size': [os.path.getsize(path) for path in paths],
+                         'mtime': [os.path.getmtime(path) for path in paths]})
+
+
+def index_store(store_path):
+    """Builds the tmc_code index on every partition of a store."""
+    with pd.HDFStore(store_path, mode='a') as store:
+        for key in partition_keys(store):
+            store.create_table_index(key, columns=['tmc_code'], optlevel=9,
+                                     kind='full')
+
+
+@profiled
+def csv_to_store(paths, store_path, usecols=None):
+    """Converts NPMRDS csv files into a partitioned HDF5 store.
+    Args: paths, a path, glob pattern or list of either.
+          store_path, the HDF5 file to create (overwritten).
+          usecols, optional list of csv columns to keep (default: the
+                   STORE_COLUMNS a file has).
+    """
+    pd.HDFStore(store_path, mode='w').close()
+    for path in expand_paths(paths):
+        if usecols is None:
+            header = pd.read_csv(path, nrows=0).columns
+            columns = [col for col in STORE_COLUMNS if col in header]
+        else:
+            columns = usecols
+        write_store(read_npmrds(path, usecols=columns), store_path)
+    index_store(store_path)
+    with pd.HDFStore(store_path, mode='a') as store:
+        store.put('sources', source_table(paths))
+        store.put('layout', pd.DataFrame({'version': [STORE_LAYOUT]}))
+
+
+def store_layout(store):
+    """Returns the layout version of an open store (None if unrecorded)."""
+    if '/layout' not in store.keys():
+        return None
+    return int(store['layout']['version'].iloc[0])
+
+
+def store_is_current(store_path, paths):
+    """Checks that a store exists, has the current layout and was built
+    from the given csv files as they are now (same paths, sizes and
+    modification times). A store whose csv files are no longer available is
+    used as is if its layout is current.
+    Raises: ValueError, for a store of an older layout whose csv files are
+            no longer available to rebuild it.
+    """
+    if not os.path.exists(store_path):
+        return False
+    with pd.HDFStore(store_path, mode='r') as store:
+        layout = store_layout(store)
+        df_sources = store['sources'] if '/sources' in store.keys() else None
+    have_csv = all(os.path.exists(path) for path in expand_paths(paths))
+    if layout != STORE_LAYOUT:
+        if not have_csv:
+            raise ValueError(
+                "Store {0} has layout {1}, not {2}, and its csv files are "
+                "not available to rebuild it".format(store_path, layout,
+                                                     STORE_LAYOUT))
+        return False
+    if not have_csv:
+        return True
+    return df_sources is not None and df_sources.equals(source_table(paths))
+
+
+def store_months(store_path):
+    """Returns the sorted (year, month) partitions of a store."""
+    with pd.HDFStore(store_path, mode='r') as store:
+        return sorted(key_month(key) for key in partition_keys(store))
+
+
+def iter_store(store_path, columns=None, months=None, tmcs=None, hours=None,
+               weekdays=None, dates=None):
+    """Streams NPMRDS data from a partitioned store, one month at a time.
+    Only the requested months are opened, and only the requested columns and
+    TMCs are read from them.
+    Args: store_path, the HDF5 store.
+          columns, optional list of measure columns to read (tmc_code,
+                   measurement_tstamp and the calendar keys are always
+                   returned).
+          months, optional list of (year, month) partitions to read.
+          tmcs, optional collection of TMC codes to read.
+          hours, weekdays, dates, optional row filters, see
+                                  npmrds_io.filter_rows().
+    Yields: one pandas dataframe per month.
+    """
+    if columns is not None:
+        columns = ['tmc_code', 'unix_time'] + CALENDAR_KEYS + [
+            col for col in columns
+            if col not in ['tmc_code', 'measurement_tstamp'] + CALENDAR_KEYS]
+    if tmcs is not None:
+        tmc_list = [str(tmc) for tmc in pd.unique(np.asarray(tmcs))]
+        where = 'tmc_code in tmc_list'
+    else:
+        where = None
+
+    with pd.HDFStore(store_path, mode='r') as store:
+        keys = partition_keys(store)
+        if months is not None:
+            keys = [partition_key(year, month) for year, month in months
+                    if partition_key(year, month) in keys]
+        for key in keys:
+            print("Loading {0} data...".format(key))
+            part = store.select(key, where=where, columns=columns)
+            part['measurement_tstamp'] = from_unix_time(part['unix_time'])
+            part = part.drop('unix_time', axis=1)
+            yield filter_rows(part, hours, weekdays, dates=dates)
+
+
+@profiled
+def read_store(store_path, columns=None, months=None, tmcs=None, hours=None,
+               weekdays=None, dates=None):
+    """Loads NPMRDS data from a partitioned store.
+    Args: see iter_store().
+    Returns: df, a pandas dataframe with categorical tmc_code and datetime
+             measurement_tstamp columns.
+    """
+    frames = list(iter_store(store_path, columns, months, tmcs, hours,
+                             weekdays, dates))
+    df = pd.concat(frames, ignore_index=True, sort=False)
+    df['tmc_code'] = df['tmc_code'].astype('category')
+    return df
+
+
+def ensure_store(paths, store_path):
+    """(Re)builds a store from its csv files if it is missing or the csv
+    files have changed."""
+    if not store_is_current(store_path, paths):
+        print("Building NPMRDS store {0}...".format(store_path))
+        csv_to_store(paths, store_path)
+
+
+def iter_cached(paths, store_path, columns=None, months=None, tmcs=None,
+                hours=None, weekdays=None, dates=None):
+    """Streams NPMRDS data month by month through the store, see
+    ensure_store().
+    Args: paths, the csv source files (path, glob pattern or list).
+          store_path, the HDF5 store backing them.
+          columns, months, tmcs, hours, weekdays, dates, see iter_store().
+    Returns: an iterator over one pandas dataframe per month.
+    """
+    ensure_store(paths, store_path)
+    return iter_store(store_path, columns=columns, months=months, tmcs=tmcs,
+                      hours=hours, weekdays=weekdays, dates=dates)
+
+
+@profiled
+def read_cached(paths, store_path, columns=None, months=None, tmcs=None,
+                hours=None, weekdays=None, dates=None):
+    """Loads NPMRDS data through the store, see iter_cached().
+    Returns: df, a pandas dataframe, see read_store().
+    """
+    frames = list(iter_cached(paths, store_path, columns, months, tmcs, hours,
+                              weekdays, dates))
+    df = pd.concat(frames, ignore_index=True, sort=False)
+    df['tmc_code'] = df['tmc_code'].astype('category')
+    return df
@@ -0,0 +1,121 @@
+"""
+periods.py
+
+FHWA time period definitions for LOTTR/TTTR and a single-pass period
+aggregation.
+
+Every reading is tagged once with a categorical period code (MF_6_9,
+MF_10_15, ...) from a lookup table indexed by weekday and hour. One grouped
+percentile pass over (tmc_code, period) then produces the wide per-TMC
+reliability table directly, instead of building one filtered copy of the
+data per period and merging the results back together.
+
+Usage:
+>>>from periods import LOTTR_PERIODS, assign_period, calc_period_ttr
+>>>df = assign_period(df, LOTTR_PERIODS)
+>>>df_lottr = calc_period_ttr(df, 80)
+"""
+
+import pandas as pd
+import numpy as np
+from calendar_keys import add_calendar_keys
+from profiling import profiled
+from quantiles import grouped_percentiles
+
+
+WEEKDAYS = [0, 1, 2, 3, 4]
+WEEKEND = [5, 6]
+# 8pm - 6am
+OVERNIGHT = list(range(20, 24)) + list(range(0, 6))
+
+# (period code, weekdays, hours) - a reading belongs to at most one period.
+LOTTR_PERIODS = [
+    ('MF_6_9', WEEKDAYS, list(range(6, 10))),
+    ('MF_10_15', WEEKDAYS, list(range(10, 16))),
+    ('MF_16_19', WEEKDAYS, list(range(16, 20))),
+    ('SATSUN_6_19', WEEKEND, list(range(6, 20))),
+]
+
+TTTR_PERIODS = LOTTR_PERIODS + [
+    ('MF_20_6', WEEKDAYS, OVERNIGHT),
+    ('SATSUN_20_6', WEEKEND, OVERNIGHT),
+]
+
+
+def period_codes(periods):
+    """Returns the list of period codes of a period table."""
+    return [code for code, days, hours in periods]
+
+
+def period_lookup(periods):
+    """Builds a weekday x hour lookup table of period ids.
+    Args: periods, a list of (code, weekdays, hours) tuples.
+    Returns: lookup, an int8 array of length 7 * 24 indexed by
+             weekday * 24 + hour, holding the position of the period in
+             `periods`, or -1 outside every period.
+    """
+    lookup = np.full(7 * 24, -1, dtype=np.int8)
+    for i, (code, days, hours) in enumerate(periods):
+        for day in days:
+            for hour in hours:
+                if lookup[day * 24 + hour] != -1:
+                    raise ValueError(
+                        '{0} overlaps {1} on weekday {2}, hour {3}'.format(
+                            code, periods[lookup[day * 24 + hour]][0],
+                            day, hour))
+                lookup[day * 24 + hour] = i
+    return lookup
+
+
+@profiled
+def assign_period(df, periods, tstamp_col='measurement_tstamp'):
+    """Tags every reading with its time period.
+    Args: df, a pandas dataframe with a timestamp column.
+          periods, a list of (code, weekdays, hours) tuples.
+          tstamp_col, name of the timestamp column.
+    Returns: df, a pandas dataframe with new categorical column 'period'
+             (NaN for readings outside every period).
+    """
+    df = add_calendar_keys(df, tstamp_col)
+    lookup = period_lookup(periods)
+    weekday = df['weekday'].values.astype(np.float64)
+    hour = df['hour'].values.astype(np.float64)
+    # keys are -1 (or NaN after an outer join) where the timestamp is missing
+    valid = (weekday >= 0) & (hour >= 0)
+    index = np.where(valid, weekday * 24 + hour, 0).astype(np.int64)
+    codes = np.where(valid, lookup[index], -1)
+    df['period'] = pd.Categorical.from_codes(
+        codes, categories=period_codes(periods))
+    return df
+
+
+@profiled
+def calc_period_ttr(df, upper_pct, value_col='travel_time_seconds'):
+    """Calculates travel time reliability for every TMC and time period in
+    one grouped percentile pass.
+    Args: df, a pandas dataframe with 'tmc_code' and 'period' columns.
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+          value_col, the travel time column.
+    Returns: df_ttr, a pandas dataframe with one row per TMC and one column
+             per period code holding upper_pct / 50th percentile travel time
+             (NaN where a TMC has no readings in that period).
+    """
+    df_pct = grouped_percentiles(df, ['tmc_code', 'period'], value_col,
+                                 [upper_pct, 50], names=['upper', 'median'])
+    return ttr_table(df_pct, list(df['period'].cat.categories))
+
+
+def ttr_table(df_pct, codes):
+    """Pivots per (TMC, period) percentiles into the wide reliability table.
+    Args: df_pct, a pandas dataframe with tmc_code, period, upper and median
+                  columns.
+          codes, the period codes, in output column order.
+    Returns: df_ttr, a pandas dataframe with one row per TMC and one
+             upper / median ratio column per period code.
+    """
+    df_pct['ttr'] = df_pct['upper'] / df_pct['median']
+    df_ttr = df_pct.set_index(['tmc_code', 'period'])['ttr'].unstack()
+    df_ttr = df_ttr.reindex(columns=codes)
+    df_ttr.columns = list(df_ttr.columns)
+    df_ttr = df_ttr.reset_index()
+    return df_ttr
@@ -13,37 +13,66 @@ import os
 import pandas as pd
 import numpy as np
 import datetime as dt
+from calendar_keys import add_calendar_keys, parse_tstamp
+from date_rules import DateRules
+from npmrds_io import quarter_paths
+from npmrds_schema import measure_columns
+from npmrds_store import read_cached
+from profiling import profiled
+from reference_cache import load_reference
+from tmc_dim import TmcDim
+from tt_grid import grid_epoch_keys, grid_tstamps
 
 
-def per_capita_TED(sum_12_mo):
+# Weekday peak hours (6am - 11am, 3pm - 8pm)
+PEAK_HOURS = [6, 7, 8, 9, 10, 15, 16, 17, 18, 19]
+PEAK_DAYS = DateRules(weekdays=[0, 1, 2, 3, 4])
+
+# Portland urbanized area population
+POP_PDX = 1577456
+
+# Working vehicle occupancy assumptions: car, bus, truck
+VOC_AUTO = 1.4
+VOC_BUS = 12.6
+VOC_TRUCK = 1
+
+# Threshold speed: the larger of the posted speed limit * factor and the
+# minimum speed (mph)
+THRESHOLD_FACTOR = .6
+MIN_THRESHOLD_SPEED = 20
+
+# Peaking factor table start times, e.g. '06:00:00'
+PEAK_TIME_FORMAT = '%H:%M:%S'
+
+
+@profiled
+def per_capita_TED(sum_12_mo, population=POP_PDX):
     """Calculates final Peak Hour Excessive Delay number.
     Args: sum_12_mo, the integer sum of all TED values.
+          population, the region's population (default: Portland).
     Returns: A value for Peak Hour Excessive Delay per capita.
     """
     print(sum_12_mo)
-    pop_PDX = 1577456
-    return sum_12_mo / pop_PDX
+    return sum_12_mo / population
 
 
+@profiled
 def TED_summation(df_teds):
     """Calculates final TED summation.
     Args: df_teds, a pandas dataframe.
     Returns: df_teds, a pandas dataframe with new columns:
         AVOc, AVOb, AVOt (car, bus, and truck average vehicle occupancy).
     """
-    # Working vehicle occupancy assumptions:
-    VOCa = 1.4
-    VOCb = 12.6
-    VOCt = 1
-    df_teds['AVOc'] = df_teds['pct_auto'] * VOCa
-    df_teds['AVOb'] = df_teds['pct_bus'] * VOCb
-    df_teds['AVOt'] = df_teds['pct_truck'] * VOCt
+    df_teds['AVOc'] = df_teds['pct_auto'] * VOC_AUTO
+    df_teds['AVOb'] = df_teds['pct_bus'] * VOC_BUS
+    df_teds['AVOt'] = df_teds['pct_truck'] * VOC_TRUCK
     df_teds['TED'] = (df_teds['TED_seg'] *
                       (df_teds['AVOc'] + df_teds['AVOb'] + df_teds['AVOt'])
                       )
     return df_teds
 
 
+@profiled
 def total_excessive_delay(df_ted):
     """Calculates Total Excessive Delay per given TMC using padas groupby
     function.
@@ -59,6 +88,7 @@ def total_excessive_delay(df_ted):
     return df_ted
 
 
+@profiled
 def peak_hr(df_pk):
     """Performs Peak Hour calculations by combining directional aadt values
     with vehicle hourly volume factors determined by Metro.
@@ -71,6 +101,7 @@ def peak_hr(df_pk):
     return df_pk
 
 
+@profiled
 def excessive_delay(df_ed):
     """Calculates Excessive Delay.
     Args: df_ed, a pandas dataframe.
@@ -82,6 +113,7 @@ def excessive_delay(df_ed):
     return df_ed
 
 
+@profiled
 def RSD(df_rsd):
     """Calculates RSD (Travel Time Segment delay).
     Args: df_rsd, a pandas dataframe.
@@ -93,6 +125,7 @@ def RSD(df_rsd):
     return df_rsd
 
 
+@profiled
 def segment_delay(df_sd):
     """Calculates Excessive Delay Threshold Travel Time (EDTTT).
     Args: df_sd, a pandas dataframe.
@@ -103,6 +136,7 @@ def segment_delay(df_sd):
     return df_sd
 
 
+@profiled
 def AADT_splits(df_spl):
     """Calculates AADT per vehicle type.
     Args: df_spl, a pandas dataframe.
@@ -121,6 +155,7 @@ def AADT_splits(df_spl):
     return df_spl
 
 
+@profiled
 def threshold_speed(df_ts):
     """Calculates Threshold Speed, defined as the larger of 20mph or
     Posted Speed Limit * .6.
@@ -128,11 +163,189 @@ def threshold_speed(df_ts):
     Returns: df_ts, A pandas dataframe with new columns:
         'posted_mult', 'TS'.
     """
-    df_ts['posted_mult'] = df_ts['SPEED_LIMIT'] * .6
-    df_ts['TS'] = np.where(df_ts['posted_mult'] > 20, df_ts['posted_mult'], 20)
+    df_ts['posted_mult'] = df_ts['SPEED_LIMIT'] * THRESHOLD_FACTOR
+    df_ts['TS'] = np.where(df_ts['posted_mult'] > MIN_THRESHOLD_SPEED,
+                           df_ts['posted_mult'], MIN_THRESHOLD_SPEED)
     return df_ts
 
 
+@profiled
+def phed_dim(df_urban, df_meta, df_here):
+    """Builds the TMC dimension PHED reads its per-TMC inputs from.
+    Args: df_urban, the urban TMC table ('Tmc').
+          df_meta, the TMC metadata table.
+          df_here, the HERE speed limit table ('TMC_HERE', 'SPEED_LIMIT').
+    Returns: dim, a tmc_dim.TmcDim over the metadata TMCs, with their
+             metadata, speed limits and an 'urban' membership mask.
+    """
+    dim = TmcDim(df_meta['tmc'])
+    dim.add_table(df_meta, 'tmc', ['miles', 'faciltype', 'aadt', 'aadt_singl',
+                                   'aadt_combi'])
+    dim.add_table(df_here, 'TMC_HERE', ['SPEED_LIMIT'])
+    dim.add_table(df_urban, 'Tmc', name='urban')
+    return dim
+
+
+@profiled
+def tmc_constants(dim):
+    """Calculates the per-TMC PHED constants once, on one row per TMC.
+    Args: dim, a TMC dimension, see phed_dim().
+    Returns: df_tmc, a pandas dataframe aligned to the dimension's TMC
+             positions with columns tmc_code, SD, dir_aadt, pct_auto,
+             pct_bus and pct_truck.
+    """
+    df_tmc = dim.frame(['miles', 'faciltype', 'aadt', 'aadt_singl',
+                        'aadt_combi', 'SPEED_LIMIT'])
+    df_tmc = threshold_speed(df_tmc)
+    df_tmc = AADT_splits(df_tmc)
+    df_tmc = segment_delay(df_tmc)
+    return df_tmc[['tmc_code', 'SD', 'dir_aadt', 'pct_auto', 'pct_bus',
+                   'pct_truck']]
+
+
+def peak_factors(df_peak):
+    """Returns the peaking factor of each hour of day as a 24 value array
+    (NaN for hours without one). Factors sharing an hour add up, as the
+    readings they join to are counted once per factor."""
+    hours = parse_tstamp(df_peak['startTime'], PEAK_TIME_FORMAT).dt.hour
+    factors = df_peak.groupby(hours.values)['2015_15-min_Combined'].sum(
+        min_count=1)
+    return factors.reindex(range(24)).values
+
+
+def ted_seg_sums(df, dim, df_ted, factors, value_col='travel_time_seconds'):
+    """Sums TED_seg per TMC position from peak hour readings.
+    Args: df, a pandas dataframe of weekday peak hour readings.
+          dim, a TMC dimension, see phed_dim().
+          df_ted, the per-TMC constants, see tmc_constants().
+          factors, the peaking factor of each hour, see peak_factors().
+          value_col, the travel time column.
+    Returns: sums, the float64 TED_seg of each dimension position.
+             counts, the int64 number of urban readings of each position.
+    """
+    df = add_calendar_keys(df)
+    # hour -1 (missing timestamp) picks the trailing NaN
+    factors = np.append(factors, np.nan)
+
+    tmc = dim.positions(df['tmc_code'])
+    keep = dim.gather('urban', tmc)
+    tmc = tmc[keep]
+
+    # missing travel times give no delay
+    delay = np.fmax(df[value_col].values[keep].astype(np.float64)
+                    - df_ted['SD'].values[tmc], 0)
+    delay = np.round(delay / 3600, 3)
+    delay *= df_ted['dir_aadt'].values[tmc] * factors[
+        df['hour'].values[keep]]
+    # rows without a volume or peaking factor add nothing, as in a groupby
+    # sum
+    delay[np.isnan(delay)] = 0
+
+    n_tmcs = len(dim)
+    return (np.bincount(tmc, weights=delay, minlength=n_tmcs),
+            np.bincount(tmc, minlength=n_tmcs))
+
+
+def ted_seg_table(df_ted, sums, counts):
+    """Builds the per-TMC TED_seg table of the TMCs with readings.
+    Args: df_ted, the per-TMC constants, see tmc_constants().
+          sums, counts, see ted_seg_sums().
+    Returns: df_ted, see total_excessive_delay().
+    """
+    df_ted = df_ted.assign(TED_seg=sums)[counts > 0]
+    return df_ted[['tmc_code', 'TED_seg', 'pct_auto', 'pct_bus',
+                   'pct_truck']].reset_index(drop=True)
+
+
+@profiled
+def calc_ted_seg(df, dim, df_peak, value_col='travel_time_seconds'):
+    """Sums TED_seg per urban TMC from peak hour readings in one fused pass.
+    The per-TMC constants (SD, dir_aadt, AADT splits) are calculated once
+    per TMC and gathered by TMC position, so the readings only ever carry
+    one temporary array:
+        ED = round(max(travel time - SD, 0) / 3600, 3)
+        TED_seg = sum of ED * dir_aadt * peaking factor per TMC
+    Results match the row-level chain (threshold_speed ... peak_hr,
+    total_excessive_delay). TED_seg is additive, so results for separate
+    months or quarters can be summed (see phed_chunks.py).
+    Args: df, a pandas dataframe of weekday peak hour readings.
+          dim, a TMC dimension, see phed_dim().
+          df_peak, the peaking factor table ('startTime',
+                   '2015_15-min_Combined').
+          value_col, the travel time column.
+    Returns: df_ted, a pandas dataframe grouped by TMC, see
+             total_excessive_delay().
+    """
+    df_ted = tmc_constants(dim)
+
+    print("Applying calculation functions...")
+    sums, counts = ted_seg_sums(df, dim, df_ted, peak_factors(df_peak),
+                                value_col)
+    return ted_seg_table(df_ted, sums, counts)
+
+
+def grid_peak_delay(grid, grid_dim, start, dim, df_peak):
+    """Calculates the delay of every weekday peak hour reading of the urban
+    TMCs in a travel time grid (see tt_grid.py), as calc_ted_seg() does.
+    Args: grid, a (n_tmc x n_epochs) travel time grid.
+          grid_dim, the TMC dimension the grid rows follow.
+          start, the grid's first timestamp.
+          dim, a TMC dimension, see phed_dim().
+          df_peak, the peaking factor table.
+    Returns: df_ted, the per-TMC constants, see tmc_constants().
+             tmc, the dim positions of the urban TMC grid rows.
+             rows, cols, the grid rows and peak hour columns read.
+             delay, the (rows x cols) ED * dir_aadt * peaking factor.
+    """
+    df_ted = tmc_constants(dim)
+    keys = grid_epoch_keys(start, grid.shape[1])
+    cols = np.flatnonzero(
+        PEAK_DAYS.dates_mask(grid_tstamps(start, grid.shape[1]))
+        & np.isin(keys['hour'], PEAK_HOURS))
+    factors = peak_factors(df_peak)[keys['hour'][cols]]
+
+    tmc = dim.positions(pd.Series(grid_dim.tmcs))
+    rows = np.flatnonzero(dim.gather('urban', tmc))
+    tmc = tmc[rows]
+
+    delay = np.fmax(grid[np.ix_(rows, cols)].astype(np.float64)
+                    - df_ted['SD'].values[tmc, None], 0)
+    delay = np.round(delay / 3600, 3)
+    delay *= df_ted['dir_aadt'].values[tmc, None] * factors
+    delay[np.isnan(delay)] = 0
+    return df_ted, tmc, rows, cols, delay
+
+
+@profiled
+def grid_ted_seg(grid, grid_dim, start, dim, df_peak, present=None):
+    """Sums TED_seg per urban TMC from a travel time grid (see tt_grid.py),
+    with the same formula as calc_ted_seg() applied to the weekday peak hour
+    columns.
+    Args: grid, a (n_tmc x n_epochs) travel time grid.
+          grid_dim, the TMC dimension the grid rows follow.
+          start, the grid's first timestamp.
+          dim, a TMC dimension, see phed_dim().
+          df_peak, the peaking factor table.
+          present, optional boolean grid of readings (a reading with a
+                   missing travel time keeps its TMC in the results, as in
+                   calc_ted_seg()).
+    Returns: df_ted, see calc_ted_seg().
+    """
+    if present is None:
+        present = ~np.isnan(grid)
+    print("Applying calculation functions...")
+    df_ted, tmc, rows, cols, delay = grid_peak_delay(grid, grid_dim, start,
+                                                     dim, df_peak)
+
+    # grid rows follow sorted TMC codes, as dim positions do
+    has_readings = present[np.ix_(rows, cols)].any(axis=1)
+    df_ted = df_ted.iloc[tmc[has_readings]].copy()
+    df_ted['TED_seg'] = delay.sum(axis=1)[has_readings]
+    return df_ted[['tmc_code', 'TED_seg', 'pct_auto', 'pct_bus',
+                   'pct_truck']].reset_index(drop=True)
+
+
+@profiled
 def main():
     """Main script to calculate PHED."""
     startTime = dt.datetime.now()
@@ -147,101 +360,38 @@ def main():
     folder_end = '_TriCounty_Metro_15-min'
     file_end = '_NPMRDS (Trucks and passenger vehicles).csv'
 
-    df = pd.DataFrame()  # Empty dataframe
-
-    for q in quarters:
-        filename = q + folder_end + file_end
-        path = q + folder_end
-        full_path = path + '/' + filename
-        print("Loading {0} data...".format(q))
-        df_temp = pd.read_csv(
-                    os.path.join(
-                        os.path.dirname(__file__), drive_path + full_path))
-        df = pd.concat([df, df_temp], sort=False)
+    # Weekday peak hours on urban TMCs only, filtered while reading from
+    # the HDF5 store (built from the csv files on first use)
+    df_urban = load_reference('urban_network', 'phed')
+    paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    store_path = os.path.join(
+        os.path.dirname(__file__), drive_path + 'TriCounty_Metro_15-min.h5')
+    df = read_cached(paths, store_path, columns=measure_columns('phed'),
+                     hours=PEAK_HOURS, dates=PEAK_DAYS,
+                     tmcs=df_urban['Tmc'])
 
     ###########################################################################
    
     ###########################################################################
     #              UNCOMMENT TO USE SINGLE-CSV DATASET                        #
     #drive_path = 'H:/map21/perfMeasures/phed/data/original_data/2018Q1-Q3_TriCounty_Metro_15-min'
-    #df = pd.read_csv(os.path.join(os.path.dirname(__file__), drive_path,
-    #                 '2018Q1-Q3_TriCounty_Metro_15-min.csv'))
-    #q = 'ALL'
+    #df = read_npmrds(os.path.join(os.path.dirname(__file__), drive_path,
+    #                  '2018Q1-Q3_TriCounty_Metro_15-min.csv'),
+    #                  hours=[6, 7, 8, 9, 10, 15, 16, 17, 18, 19],
+    #                  weekdays=[0, 1, 2, 3, 4], tmcs=df_urban['Tmc'])
     ###########################################################################
 
-    # Filter by timestamps
-    print("Filtering timestamps...".format(q))
-    df['measurement_tstamp'] = pd.to_datetime(df['measurement_tstamp'])
-    df['hour'] = df['measurement_tstamp'].dt.hour
-
-    wd = 'H:/map21/perfMeasures/phed/data/'
-    # Join peakingFactor data
-    df_peak = pd.read_csv(
-        os.path.join(
-            os.path.dirname(__file__),
-            wd + 'peakingFactors_join_edit.csv'),
-        usecols=['startTime', '2015_15-min_Combined'])
-    df_peak['pk_hour'] = pd.to_datetime(df_peak['startTime']).dt.hour
-    df = pd.merge(
-        df, df_peak, left_on=df['hour'],
-        right_on=df_peak['pk_hour'], how='left')
-
-    # Capture weekdays only
-    df = df[df['measurement_tstamp'].dt.weekday.isin([0, 1, 2, 3, 4])]
-    df = df[df['measurement_tstamp'].dt.hour.isin(
-        [6, 7, 8, 9, 10, 15, 16, 17, 18, 19])]
-
-    # Join/filter on relevant urban TMCs
-    print("Join/filter on urban TMCs...")
-    df_urban = pd.read_csv(
-        os.path.join(os.path.dirname(__file__), wd + 'urban_tmc.csv'))
-
-    # This is necessary in pandas > v.0.22.0 ####
-    df = df.drop('key_0', axis=1)
-    #############################################
-
-    df = pd.merge(df_urban, df, how='inner', left_on=df_urban['Tmc'],
-                  right_on=df['tmc_code'])
-    df = df.drop('key_0', axis=1)
-
-    # Join TMC Metadata
-    print("Join TMC Metadata...")
-    df_meta = pd.read_csv(
-        os.path.join(
-            os.path.dirname(__file__),
-            wd +
-            'TMC_Identification_NPMRDS (Trucks and passenger vehicles).csv'),
-        usecols=['tmc', 'miles', 'tmclinear', 'faciltype', 'aadt',
-                 'aadt_singl', 'aadt_combi'])
-
-    df = pd.merge(df, df_meta, left_on=df['tmc_code'],
-                  right_on=df_meta['tmc'], how='inner')
-    # This is necessary in pandas > v.0.22.0 ####
-    df = df.drop('key_0', axis=1)
-    #############################################
-
-    # Join HERE data
-    df_here = pd.read_csv(
-        os.path.join(
-            os.path.dirname(__file__), wd +
-            'HERE_OR_Static_TriCounty_edit.csv'),
-        usecols=['TMC_HERE', 'SPEED_LIMIT'])
-
-    df = pd.merge(df, df_here, left_on=df['tmc_code'],
-                  right_on=df_here['TMC_HERE'], how='left', validate='m:1')
-    # This is necessary in pandas > v.0.22.0 ####
-    df = df.drop('key_0', axis=1)
-    #############################################
-
-    # Apply calculation functions
-    print("Applying calculation functions...")
-    df = threshold_speed(df)
-    df = AADT_splits(df)
-    df = segment_delay(df)
-    df = RSD(df)
-    df = excessive_delay(df)
-    df = peak_hr(df)
-    df = total_excessive_delay(df)
+    # peakingFactor data
+    df_peak = load_reference('peak_factors', 'phed')
+
+    # TMC Metadata
+    df_meta = load_reference('phed_tmc_identification', 'phed')
+
+    # HERE data
+    df_here = load_reference('here', 'phed')
+
+    dim = phed_dim(df_urban, df_meta, df_here)
+    df = calc_ted_seg(df, dim, df_peak)
     df = TED_summation(df)
     df = df[['tmc_code', 'TED']]
     df.to_csv('phed_out.csv')
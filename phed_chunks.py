@@ -0,0 +1,157 @@
+"""
+phed_chunks.py
+
+Out-of-core PHED: chunked map-reduce over the NPMRDS csv files.
+
+TED_seg is a per-TMC sum, so it does not need every reading in memory at
+once. Each file (a quarter, a year, a state download ...) is streamed in
+fixed-size chunks (see npmrds_io.iter_npmrds()) filtered to the weekday peak
+hours and urban TMCs while reading; every chunk is reduced straight away to
+per-TMC partial sums over the TMC dimension (see phed_calc.ted_seg_sums()),
+and the partials are added up. Files are mapped in parallel worker
+processes; each worker holds one chunk and two arrays of one value per TMC,
+so peak memory is bounded by the chunk size and the number of workers, not
+by the years or TMCs covered. The final reduce applies TED_summation() and
+per_capita_TED() as phed_calc.py does. Results match calc_ted_seg() on the
+whole data up to floating point summation order.
+
+Usage:
+>>>python phed_chunks.py
+>>>from phed_chunks import chunked_phed
+>>>dim = phed_dim(df_urban, df_meta, df_here)
+>>>df_ted, phed = chunked_phed(paths, dim, df_peak, workers=4)
+"""
+
+import pandas as pd
+import numpy as np
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from npmrds_io import CHUNKSIZE, expand_paths, iter_npmrds, quarter_paths
+from npmrds_schema import table_columns
+from phed_calc import (PEAK_DAYS, PEAK_HOURS, TED_summation, peak_factors,
+                       per_capita_TED, phed_dim, ted_seg_sums, ted_seg_table,
+                       tmc_constants)
+from profiling import profiled
+from reference_cache import load_reference
+from tmc_shards import default_workers
+
+
+def file_ted_seg(path, dim, df_ted, factors, chunksize=CHUNKSIZE):
+    """Maps one NPMRDS csv file to per-TMC partial sums, chunk by chunk.
+    Args: path, the csv file.
+          dim, a TMC dimension, see phed_calc.phed_dim().
+          df_ted, the per-TMC constants, see phed_calc.tmc_constants().
+          factors, the peaking factor of each hour, see
+                   phed_calc.peak_factors().
+          chunksize, rows per chunk read.
+    Returns: sums, counts, see phed_calc.ted_seg_sums().
+    """
+    sums = np.zeros(len(dim))
+    counts = np.zeros(len(dim), dtype=np.int64)
+    urban = dim.tmcs[dim.attrs['urban']]
+    for chunk in iter_npmrds(path, usecols=table_columns('npmrds', 'phed'),
+                             hours=PEAK_HOURS, tmcs=urban,
+                             chunksize=chunksize, dates=PEAK_DAYS):
+        chunk_sums, chunk_counts = ted_seg_sums(chunk, dim, df_ted, factors)
+        sums += chunk_sums
+        counts += chunk_counts
+    return sums, counts
+
+
+def add_partials(partials, n_tmcs):
+    """Reduces per-file partial sums, in file order, as they arrive.
+    Args: partials, an iterable of (sums, counts), see file_ted_seg().
+          n_tmcs, the size of the TMC dimension.
+    Returns: sums, counts, the totals.
+    """
+    sums = np.zeros(n_tmcs)
+    counts = np.zeros(n_tmcs, dtype=np.int64)
+    for file_sums, file_counts in partials:
+        sums += file_sums
+        counts += file_counts
+    return sums, counts
+
+
+@profiled
+def chunked_ted_seg(paths, dim, df_peak, workers=None, chunksize=CHUNKSIZE):
+    """Sums TED_seg per urban TMC over NPMRDS csv files, out of core.
+    Args: paths, a path, glob pattern or list of either.
+          dim, a TMC dimension, see phed_calc.phed_dim().
+          df_peak, the peaking factor table.
+          workers, the number of worker processes mapping files (default:
+                   all CPUs, at most one per file); 1 runs serially in this
+                   process.
+          chunksize, rows per chunk read.
+    Returns: df_ted, see phed_calc.calc_ted_seg().
+    """
+    paths = expand_paths(paths)
+    if workers is None:
+        workers = default_workers()
+    workers = max(min(workers, len(paths)), 1)
+    df_ted = tmc_constants(dim)
+    factors = peak_factors(df_peak)
+
+    args = ([dim] * len(paths), [df_ted] * len(paths),
+            [factors] * len(paths), [chunksize] * len(paths))
+    if workers == 1:
+        sums, counts = add_partials(map(file_ted_seg, paths, *args),
+                                    len(dim))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            sums, counts = add_partials(
+                pool.map(file_ted_seg, paths, *args), len(dim))
+    return ted_seg_table(df_ted, sums, counts)
+
+
+@profiled
+def chunked_phed(paths, dim, df_peak, workers=None, chunksize=CHUNKSIZE):
+    """Calculates PHED over NPMRDS csv files, out of core.
+    Args: see chunked_ted_seg().
+    Returns: df_ted, the per-TMC table, see phed_calc.TED_summation().
+             PHED per capita.
+    """
+    df_ted = TED_summation(chunked_ted_seg(paths, dim, df_peak, workers,
+                                           chunksize))
+    return df_ted, per_capita_TED(df_ted['TED'].sum())
+
+
+@profiled
+def main():
+    """Main script to calculate PHED out of core, year by year."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+
+    # Point folder_end at the statewide downloads (and urban_network at the
+    # statewide TMC list) to run all Oregon TMCs
+    drive_path = 'H:/map21/perfMeasures/phed/data/original_data/'
+    years = [2017, 2018, 2019, 2020]
+    folder_end = '_TriCounty_Metro_15-min'
+    file_end = '_NPMRDS (Trucks and passenger vehicles).csv'
+
+    dim = phed_dim(load_reference('urban_network', 'phed'),
+                   load_reference('phed_tmc_identification', 'phed'),
+                   load_reference('here', 'phed'))
+    df_peak = load_reference('peak_factors', 'phed')
+
+    # Worker processes mapping files (None: all CPUs) and rows per chunk;
+    # peak memory grows with both
+    workers = None
+    chunksize = 1000000
+
+    for year in years:
+        quarters = ['{0}Q{1}'.format(year, q) for q in range(1, 5)]
+        paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+        df, result = chunked_phed(paths, dim, df_peak, workers, chunksize)
+        df[['tmc_code', 'TED']].to_csv('phed_out_{0}.csv'.format(year))
+        print("==============================================================")
+        print("{0}: calculated {1} peak hour excessive delay per capita."
+              .format(year, round(result, 2)))
+        print("==============================================================")
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+phed_sweep.py
+
+PHED scenario sweep over the occupancy, threshold speed and population
+assumptions.
+
+PHED per capita for a scenario is
+    sum over TMCs of TED_seg(threshold) * (pct_auto * voc_auto
+                                           + pct_bus * voc_bus
+                                           + pct_truck * voc_truck)
+    / population
+so hundreds of scenarios need not rerun the pipeline:
+    - occupancy and population only reweight TED_seg: per threshold, the
+      TED_seg of every TMC is reduced once to three sums (weighted by the
+      auto, bus and truck splits), and every scenario is a dot product of
+      them with its occupancies, over its population.
+    - threshold speeds move each TMC's threshold travel time SD. The peak
+      hour readings are sorted once by (TMC, travel time) (see DelayCurves),
+      so the readings above any SD are found with one binary search per
+      TMC, and each distinct threshold sums the rounded ED of only those
+      readings, as calc_ted_seg() does:
+          ED = round((tt - SD) / 3600, 3) over tt > SD
+The scenario at the phed_calc.py defaults matches calc_ted_seg() up to
+summation order.
+
+Usage:
+>>>python phed_sweep.py
+>>>from phed_sweep import DelayCurves, scenario_grid, sweep_phed
+>>>curves = DelayCurves(df, phed_dim(df_urban, df_meta, df_here), df_peak)
+>>>df_scenarios = scenario_grid(voc_auto=[1.4, 1.5],
+>>>                             threshold_factor=[.6, .65])
+>>>df_scenarios = sweep_phed(curves, df_scenarios)
+"""
+
+import os
+import pandas as pd
+import numpy as np
+import datetime as dt
+from calendar_keys import add_calendar_keys
+from npmrds_io import quarter_paths
+from npmrds_schema import measure_columns
+from npmrds_store import read_cached
+from phed_calc import (MIN_THRESHOLD_SPEED, PEAK_DAYS, PEAK_HOURS, POP_PDX,
+                       THRESHOLD_FACTOR, VOC_AUTO, VOC_BUS, VOC_TRUCK,
+                       peak_factors, phed_dim, tmc_constants)
+from profiling import profiled
+from reference_cache import load_reference
+
+
+# Scenario parameters and their phed_calc.py defaults
+PARAMETERS = [
+    ('voc_auto', VOC_AUTO),
+    ('voc_bus', VOC_BUS),
+    ('voc_truck', VOC_TRUCK),
+    ('threshold_factor', THRESHOLD_FACTOR),
+    ('min_speed', MIN_THRESHOLD_SPEED),
+    ('population', POP_PDX),
+]
+
+MODES = ['pct_auto', 'pct_bus', 'pct_truck']
+
+
+class DelayCurves:
+    """Per-TMC excess delay as a function of the threshold travel time,
+    see the module docstring."""
+
+    @profiled
+    def __init__(self, df, dim, df_peak, value_col='travel_time_seconds'):
+        """Sorts the peak hour readings by TMC and travel time once.
+        Args: df, a pandas dataframe of weekday peak hour readings.
+              dim, a TMC dimension, see phed_calc.phed_dim().
+              df_peak, the peaking factor table.
+              value_col, the travel time column.
+        """
+        df = add_calendar_keys(df)
+        # hour -1 (missing timestamp) picks the trailing NaN
+        factors = np.append(peak_factors(df_peak), np.nan)
+        df_tmc = dim.frame(['miles', 'SPEED_LIMIT'])
+        df_tmc = df_tmc.join(tmc_constants(dim)[['dir_aadt'] + MODES])
+
+        tmc = dim.positions(df['tmc_code'])
+        keep = dim.gather('urban', tmc)
+        tmc = tmc[keep]
+        tt = df[value_col].values[keep].astype(np.float64)
+        weight = factors[df['hour'].values[keep]]
+        # readings of urban TMCs, kept in the results even without delay
+        self.has_readings = np.bincount(tmc, minlength=len(dim)) > 0
+
+        # readings without a travel time or peaking factor add nothing
+        valid = ~np.isnan(tt) & ~np.isnan(weight)
+        tmc, tt, weight = tmc[valid], tt[valid], weight[valid]
+        order = np.lexsort((tt, tmc))
+        tmc, tt, weight = tmc[order], tt[order], weight[order]
+
+        # one ascending search key over all TMCs: TMC blocks of width
+        # span, each holding its travel times
+        self.span = tt.max() + 1 if len(tt) else 1.
+        self.keys = tmc * self.span + tt
+        self.ends = np.cumsum(np.bincount(tmc, minlength=len(dim)))
+        self.tt = tt
+        self.weight = weight
+
+        self.tmcs = df_tmc['tmc_code'].values
+        self.miles = df_tmc['miles'].values
+        self.speed_limit = df_tmc['SPEED_LIMIT'].values
+        # rows without a volume add nothing, as in calc_ted_seg()
+        self.dir_aadt = np.nan_to_num(df_tmc['dir_aadt'].values)
+        self.modes = df_tmc[MODES].values
+
+    def __len__(self):
+        return len(self.tmcs)
+
+    def threshold_times(self, threshold_factor, min_speed):
+        """Calculates the threshold travel time SD of every TMC, as
+        phed_calc.threshold_speed() and segment_delay() do.
+        Args: threshold_factor, min_speed, arrays of n thresholds.
+        Returns: an (n x n_tmcs) array of SD in seconds.
+        """
+        threshold_factor = np.asarray(threshold_factor, dtype=np.float64)
+        min_speed = np.asarray(min_speed, dtype=np.float64)
+        posted_mult = self.speed_limit * threshold_factor[:, None]
+        ts = np.where(posted_mult > min_speed[:, None], posted_mult,
+                      min_speed[:, None])
+        return self.miles / ts * 3600
+
+    def ted_seg(self, sd):
+        """Sums TED_seg per TMC for threshold travel times.
+        Args: sd, an (n x n_tmcs) array of threshold travel times.
+        Returns: an (n x n_tmcs) array of TED_seg.
+        """
+        # TMCs without a threshold have no delay
+        sd = np.where(np.isnan(sd), np.inf, sd)
+        return np.array([self.threshold_ted_seg(row) for row in sd])
+
+    def threshold_ted_seg(self, sd):
+        """Sums TED_seg per TMC for one threshold, from the readings above
+        each TMC's threshold travel time only.
+        Args: sd, an array of n_tmcs threshold travel times.
+        Returns: an array of n_tmcs TED_seg.
+        """
+        positions = np.arange(len(self))
+        starts = np.append(0, self.ends[:-1])
+        first = np.searchsorted(self.keys, positions * self.span + sd,
+                                side='right')
+        first = np.clip(first, starts, self.ends)
+
+        # positions of the readings from first to end of every TMC
+        counts = self.ends - first
+        offsets = np.cumsum(counts) - counts
+        tmc = np.repeat(positions, counts)
+        index = np.arange(counts.sum()) + np.repeat(first - offsets, counts)
+
+        delay = np.round((self.tt[index] - sd[tmc]) / 3600, 3)
+        sums = np.bincount(tmc, weights=delay * self.weight[index],
+                           minlength=len(self))
+        return sums * self.dir_aadt
+
+    def ted_seg_table(self, threshold_factor=THRESHOLD_FACTOR,
+                      min_speed=MIN_THRESHOLD_SPEED):
+        """Builds the per-TMC TED_seg table of one threshold.
+        Returns: df_ted, see phed_calc.calc_ted_seg().
+        """
+        sd = self.threshold_times([threshold_factor], [min_speed])
+        df_ted = pd.DataFrame({'tmc_code': self.tmcs,
+                               'TED_seg': self.ted_seg(sd)[0]})
+        for i, mode in enumerate(MODES):
+            df_ted[mode] = self.modes[:, i]
+        return df_ted[self.has_readings].reset_index(drop=True)
+
+
+def scenario_grid(**params):
+    """Builds every combination of scenario parameter values.
+    Args: params, a list of values (or one value) per parameter name, see
+                  PARAMETERS; parameters left out keep their default.
+    Returns: df_scenarios, a pandas dataframe with one row per scenario and
+             one column per parameter.
+    """
+    names = [name for name, _ in PARAMETERS]
+    unknown = set(params) - set(names)
+    if unknown:
+        raise ValueError(
+            "Unknown scenario parameters: {0}".format(sorted(unknown)))
+    values = [np.atleast_1d(params.get(name, default))
+              for name, default in PARAMETERS]
+    return pd.MultiIndex.from_product(values, names=names).to_frame(
+        index=False)
+
+
+@profiled
+def sweep_phed(curves, df_scenarios):
+    """Calculates TED and PHED per capita for every scenario.
+    Args: curves, a DelayCurves of the peak hour readings.
+          df_scenarios, a pandas dataframe with one row per scenario and a
+                        column per parameter, see scenario_grid().
+    Returns: df_scenarios, with new columns TED and phed_per_capita.
+    """
+    df_scenarios = df_scenarios.copy()
+    thresholds = ['threshold_factor', 'min_speed']
+    df_thresholds = df_scenarios[thresholds].drop_duplicates().reset_index(
+        drop=True)
+    sd = curves.threshold_times(df_thresholds['threshold_factor'].values,
+                                df_thresholds['min_speed'].values)
+
+    # TED_seg per threshold reduced to one sum per mode split; TMCs missing
+    # a split have no TED, as in TED_summation()
+    modes = curves.modes
+    modes = np.where(np.isnan(modes).any(axis=1)[:, None], 0, modes)
+    mode_teds = curves.ted_seg(sd) @ modes
+
+    rows = pd.merge(df_scenarios[thresholds],
+                    df_thresholds.reset_index(), on=thresholds,
+                    how='left')['index'].values
+    vocs = df_scenarios[['voc_auto', 'voc_bus', 'voc_truck']].values
+    df_scenarios['TED'] = (mode_teds[rows] * vocs).sum(axis=1)
+    df_scenarios['phed_per_capita'] = (df_scenarios['TED']
+                                       / df_scenarios['population'])
+    return df_scenarios
+
+
+@profiled
+def main():
+    """Main script to sweep PHED scenarios."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+
+    drive_path = 'H:/map21/perfMeasures/phed/data/original_data/'
+    quarters = ['2017Q0', '2017Q1', '2017Q2', '2017Q3', '2017Q4']
+    folder_end = '_TriCounty_Metro_15-min'
+    file_end = '_NPMRDS (Trucks and passenger vehicles).csv'
+
+    # Weekday peak hours on urban TMCs only, filtered while reading from
+    # the HDF5 store (built from the csv files on first use), as in
+    # phed_calc.py
+    df_urban = load_reference('urban_network', 'phed')
+    paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    store_path = os.path.join(
+        os.path.dirname(__file__), drive_path + 'TriCounty_Metro_15-min.h5')
+    df = read_cached(paths, store_path, columns=measure_columns('phed'),
+                     hours=PEAK_HOURS, dates=PEAK_DAYS,
+                     tmcs=df_urban['Tmc'])
+    dim = phed_dim(df_urban, load_reference('phed_tmc_identification', 'phed'),
+                   load_reference('here', 'phed'))
+    curves = DelayCurves(df, dim, load_reference('peak_factors', 'phed'))
+    del df
+
+    df_scenarios = scenario_grid(
+        voc_auto=np.round(np.arange(1.2, 1.61, .05), 2),
+        voc_bus=[10.5, 12.6, 15],
+        threshold_factor=np.round(np.arange(.5, .76, .05), 2),
+        min_speed=[15, 20, 25])
+    df_scenarios = sweep_phed(curves, df_scenarios)
+    print(df_scenarios)
+    df_scenarios.to_csv('phed_scenarios.csv', index=False)
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+profiling.py
+
+Stage-level timing and memory instrumentation.
+
+Pipeline functions are wrapped with @profiled (or blocks with
+`with stage(name):`). When profiling is on, each stage records wall time,
+CPU time, rows in/out (length of the first dataframe argument and of the
+result), how far the stage raised the process's peak RSS (its high-water
+mark only grows, so a stage that stays under an earlier peak records 0; the
+report also gives the peak RSS of the whole run) and, optionally, the peak
+memory allocated during the stage (tracemalloc, which slows pandas down
+noticeably).
+Repeated stages (e.g. per chunk) are aggregated by their path of nested
+stage names, and a JSON report is written per run.
+
+Profiling is off unless the NPMRDS_PROFILE environment variable names a
+report file (NPMRDS_PROFILE_MEMORY=1 adds tracemalloc), or enable() is
+called. Off, a wrapped function costs one flag check.
+
+Usage:
+>>>NPMRDS_PROFILE=lottr_report.json python lottr_calc.py
+>>>from profiling import profiled, stage
+>>>@profiled
+>>>def calc_ttr(df_ttr):
+>>>    ...
+>>>with stage('load'):
+>>>    df = read_cached(...)
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import tracemalloc
+import contextlib
+import multiprocessing
+import datetime as dt
+import pandas as pd
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+ENABLED = False
+
+# Run state: report path, tracemalloc on/off, the open stages and the
+# aggregated records keyed by stage path
+_run = {'path': None, 'memory': False, 'started': None, 'stack': [],
+        'records': {}}
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process, in MB."""
+    # VmHWM restarts at exec, unlike ru_maxrss, which a spawned worker
+    # inherits from the process it was forked from
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    if resource is None:
+        return np.nan
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024
+
+
+def count_rows(obj):
+    """Returns the rows of a dataframe, series or array (or of the first item
+    of a tuple), None for anything else."""
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(obj)
+    return None
+
+
+def enable(report_path=None, trace_memory=False):
+    """Turns profiling on for this process.
+    Args: report_path, optional JSON report file, written at exit (see
+                       write_report()).
+          trace_memory, True to record peak allocations with tracemalloc.
+    """
+    global ENABLED
+    ENABLED = True
+    _run.update(path=report_path, memory=trace_memory,
+                started=dt.datetime.now(), stack=[], records={})
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    # worker processes (e.g. tmc_shards.py) inherit the environment but do
+    # not write the report
+    if report_path is not None and multiprocessing.parent_process() is None:
+        atexit.register(write_report)
+
+
+def disable():
+    """Turns profiling off."""
+    global ENABLED
+    ENABLED = False
+    if _run['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """Records a block as a stage.
+    Args: name, the stage name.
+          rows_in, optional rows going into the stage.
+    Yields: a dict; set its 'rows_out' to record the rows produced.
+    """
+    if not ENABLED:
+        yield {}
+        return
+
+    stack = _run['stack']
+    frame = {'name': name, 'rows_out': None, 'peak': 0,
+             'start_rss': peak_rss_mb()}
+    if _run['memory']:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame['start_memory'] = current
+    stack.append(frame)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield frame
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        stack.pop()
+        peak_alloc = None
+        if _run['memory']:
+            _, peak = tracemalloc.get_traced_memory()
+            frame['peak'] = max(frame['peak'], peak)
+            peak_alloc = (frame['peak'] - frame['start_memory']) / 2 ** 20
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], frame['peak'])
+            tracemalloc.reset_peak()
+        rss_increase = max(0, peak_rss_mb() - frame['start_rss'])
+        path = '/'.join([f['name'] for f in stack] + [name])
+        add_record(path, len(stack), wall, cpu, rows_in, frame['rows_out'],
+                   peak_alloc, rss_increase)
+
+
+def add_record(path, depth, wall, cpu, rows_in, rows_out, peak_alloc,
+               rss_increase):
+    """Adds one stage call to its aggregated record."""
+    record = _run['records'].setdefault(path, {
+        'stage': path, 'depth': depth, 'calls': 0, 'wall_s': 0.0,
+        'cpu_s': 0.0, 'rows_in': None, 'rows_out': None,
+        'peak_alloc_mb': None, 'peak_rss_increase_mb': 0.0})
+    record['calls'] += 1
+    record['wall_s'] += wall
+    record['cpu_s'] += cpu
+    for key, value in [('rows_in', rows_in), ('rows_out', rows_out)]:
+        if value is not None:
+            record[key] = (record[key] or 0) + value
+    if peak_alloc is not None:
+        record['peak_alloc_mb'] = max(record['peak_alloc_mb'] or 0,
+                                      peak_alloc)
+    record['peak_rss_increase_mb'] = max(record['peak_rss_increase_mb'],
+                                         rss_increase)
+
+
+def profiled(func=None, name=None):
+    """Decorator recording each call of a function as a stage named
+    <module>.<function> (or name).
+    Usage: @profiled or @profiled(name='load').
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+    if name is None:
+        module = func.__module__
+        if module == '__main__':
+            module = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        name = '{0}.{1}'.format(module, func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        rows_in = None
+        for arg in args:
+            rows_in = count_rows(arg)
+            if rows_in is not None:
+                break
+        with stage(name, rows_in) as frame:
+            result = func(*args, **kwargs)
+            frame['rows_out'] = count_rows(result)
+        return result
+    return wrapper
+
+
+def report():
+    """Returns the run report as a dict: script, start time, settings and one
+    record per stage path, in order of first completion."""
+    return {
+        'script': os.path.basename(sys.argv[0]) if sys.argv else None,
+        'started': (_run['started'].isoformat(timespec='seconds')
+                    if _run['started'] else None),
+        'trace_memory': _run['memory'],
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': list(_run['records'].values()),
+    }
+
+
+def write_report(path=None):
+    """Writes the run report as JSON.
+    Args: path, the report file (default: the one given to enable()).
+    """
+    path = path or _run['path']
+    if path is None or not _run['records']:
+        return
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+    print("Profile report written to {0}".format(path))
+
+
+if os.environ.get('NPMRDS_PROFILE'):
+    enable(os.environ['NPMRDS_PROFILE'],
+           os.environ.get('NPMRDS_PROFILE_MEMORY') == '1')
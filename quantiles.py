@@ -0,0 +1,206 @@
+"""
+quantiles.py
+
+Grouped percentile engine for NPMRDS travel times.
+
+Replaces the `groupby(...).agg(lambda x: np.percentile(x, p))` pattern used
+in the LOTTR/TTTR and INRIX scripts. The data is sorted once by
+(group, travel time) and every requested percentile for every group is read
+straight out of the sorted array, using the same linear interpolation as
+np.percentile.
+
+Usage:
+>>>from quantiles import grouped_percentiles
+>>>df = grouped_percentiles(df, 'tmc_code', 'travel_time_seconds', [80, 50])
+"""
+
+import pandas as pd
+import numpy as np
+
+
+def factorize_groups(df, by):
+    """Maps every row to a dense, sorted group id.
+    Args: df, a pandas dataframe.
+          by, a column name or list of column names to group on.
+    Returns: group_ids, an int64 array with one group id per row (-1 where
+             any key is missing, matching groupby's dropna behaviour).
+             df_keys, a pandas dataframe of the group keys, one row per
+             group id, in sorted order.
+    """
+    if isinstance(by, str):
+        by = [by]
+
+    combined = np.zeros(len(df), dtype=np.int64)
+    missing = np.zeros(len(df), dtype=bool)
+    level_uniques = []
+    for col in by:
+        codes, uniques = pd.factorize(df[col], sort=True)
+        missing |= codes < 0
+        combined = combined * len(uniques) + codes
+        level_uniques.append(uniques)
+
+    group_ids = np.full(len(df), -1, dtype=np.int64)
+    codes, combined_uniques = pd.factorize(combined[~missing], sort=True)
+    group_ids[~missing] = codes
+
+    # Decode the mixed-radix group keys back into one column per level
+    keys = {}
+    remainder = np.asarray(combined_uniques, dtype=np.int64)
+    for col, uniques in reversed(list(zip(by, level_uniques))):
+        keys[col] = np.asarray(uniques)[remainder % len(uniques)]
+        remainder = remainder // len(uniques)
+    df_keys = pd.DataFrame({col: keys[col] for col in by})
+
+    return group_ids, df_keys
+
+
+def sorted_groups(group_ids, values, n_groups):
+    """Sorts values once by (group id, value).
+    Args: group_ids, an int array of group ids (rows with -1 are dropped).
+          values, a float array of values.
+          n_groups, the number of groups.
+    Returns: sorted_values, values ordered by group then value, NaN last.
+             starts, the offset of each group in sorted_values.
+             counts, the number of values per group (NaN included).
+             nan_counts, the number of NaN values per group.
+    """
+    keep = group_ids >= 0
+    group_ids = group_ids[keep]
+    values = np.asarray(values, dtype=np.float64)[keep]
+
+    order = np.lexsort((values, group_ids))
+    sorted_values = values[order]
+    counts = np.bincount(group_ids, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    nan_counts = np.bincount(group_ids, weights=np.isnan(values),
+                             minlength=n_groups)
+
+    return sorted_values, starts, counts, nan_counts
+
+
+def percentile_positions(counts, pct):
+    """Locates a percentile within groups of sorted values.
+    Follows np.percentile's default ('linear') method step for step.
+    Args: counts, an int array with the number of values per group.
+          pct, the percentile, 0-100.
+    Returns: previous, next_, the 0-based ranks of the two order statistics
+             to interpolate between, and gamma, the interpolation weight.
+    """
+    quantile = np.true_divide(pct, 100)
+    virtual = (counts - 1) * quantile
+
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = previous.astype(np.int64)
+    next_ = previous + 1
+    above = virtual >= counts - 1
+    previous[above] = counts[above] - 1
+    next_[above] = counts[above] - 1
+    below = virtual < 0
+    previous[below] = 0
+    next_[below] = 0
+    return previous, next_, gamma
+
+
+def lerp(lower, upper, gamma):
+    """np.percentile's two-sided linear interpolation, for bit-for-bit
+    agreement with it."""
+    diff = upper - lower
+    result = lower + diff * gamma
+    np.subtract(upper, diff * (1 - gamma), out=result, where=gamma >= 0.5)
+    return result
+
+
+def sorted_percentile(sorted_values, starts, counts, nan_counts, pct):
+    """Reads one percentile per group out of group-sorted values.
+    Matches np.percentile bit-for-bit; groups holding a NaN return NaN, as
+    np.percentile does.
+    Args: sorted_values, starts, counts, nan_counts, see sorted_groups().
+          pct, the percentile to compute, 0-100.
+    Returns: a float64 array with one value per group.
+    """
+    if not len(sorted_values):
+        return np.full(len(counts), np.nan)
+
+    previous, next_, gamma = percentile_positions(counts, pct)
+    last = len(sorted_values) - 1
+    lower = sorted_values[np.clip(starts + previous, 0, last)]
+    upper = sorted_values[np.clip(starts + next_, 0, last)]
+
+    result = lerp(lower, upper, gamma)
+    result[(nan_counts > 0) | (counts == 0)] = np.nan
+    return result
+
+
+def grouped_percentiles(df, by, value_col, pcts, names=None):
+    """Calculates several percentiles per group in one sorted pass.
+    Args: df, a pandas dataframe.
+          by, a column name or list of column names to group on.
+          value_col, the column to take percentiles of.
+          pcts, a list of percentiles, 0-100 (e.g. [5, 50, 80, 95]).
+          names, optional list of output column names, one per percentile.
+                 Defaults to '<pct>_pct'.
+    Returns: df_pct, a pandas dataframe with the group key columns followed
+             by one column per percentile, one row per group, sorted by key
+             (the same layout as groupby(by, as_index=False).agg(...)).
+    """
+    if names is None:
+        names = ['{0}_pct'.format(pct) for pct in pcts]
+
+    group_ids, df_pct = factorize_groups(df, by)
+    sorted_values, starts, counts, nan_counts = sorted_groups(
+        group_ids, df[value_col].values, len(df_pct))
+
+    for name, pct in zip(names, pcts):
+        df_pct[name] = sorted_percentile(
+            sorted_values, starts, counts, nan_counts, pct)
+
+    return df_pct
+
+
+def counts_percentiles(df, by, value_col, count_col, pcts, names=None):
+    """Calculates percentiles per group from value counts.
+    Each row holds a distinct value and how many times it occurs in its
+    group; results are those np.percentile would give on the expanded
+    values (NaN for groups holding a NaN value, as np.percentile does).
+    Args: df, a pandas dataframe of (group keys, value, count) rows.
+          by, a column name or list of column names to group on.
+          value_col, the value column.
+          count_col, the count column.
+          pcts, a list of percentiles, 0-100.
+          names, optional list of output column names, one per percentile.
+    Returns: df_pct, a pandas dataframe laid out as in grouped_percentiles().
+    """
+    if names is None:
+        names = ['{0}_pct'.format(pct) for pct in pcts]
+
+    group_ids, df_pct = factorize_groups(df, by)
+    keep = group_ids >= 0
+    group_ids = group_ids[keep]
+    values = np.asarray(df[value_col].values, dtype=np.float64)[keep]
+    counts = np.asarray(df[count_col].values, dtype=np.int64)[keep]
+
+    group_counts = np.bincount(group_ids, weights=counts,
+                               minlength=len(df_pct)).astype(np.int64)
+    nan_counts = np.bincount(group_ids, weights=counts * np.isnan(values),
+                             minlength=len(df_pct))
+
+    order = np.lexsort((values, group_ids))
+    values = values[order]
+    cum_counts = np.cumsum(counts[order])
+    group_starts = np.concatenate(([0], np.cumsum(group_counts)[:-1]))
+
+    last = len(values) - 1
+    for name, pct in zip(names, pcts):
+        previous, next_, gamma = percentile_positions(group_counts, pct)
+        # the value holding rank r is the first row whose cumulative count
+        # exceeds r
+        lower = values[np.minimum(np.searchsorted(
+            cum_counts, group_starts + previous, side='right'), last)]
+        upper = values[np.minimum(np.searchsorted(
+            cum_counts, group_starts + next_, side='right'), last)]
+        result = lerp(lower, upper, gamma)
+        result[(group_counts == 0) | (nan_counts > 0)] = np.nan
+        df_pct[name] = result
+
+    return df_pct
@@ -0,0 +1,177 @@
+"""
+reference_cache.py
+
+Content-addressed cache of the parsed reference tables.
+
+TMC_Identification, the network TMC lists, the HERE speed limits and the
+peaking factors are small but were re-parsed from csv (often on H:/) by
+every script on every run. load_reference() reads them through the schema
+(see npmrds_schema.read_table()) once and keeps the parsed, dtype-normalized
+dataframe as a pickle in the cache directory:
+    <cache_dir>/<content hash>_<spec>.pkl   the parsed table, shared by every
+                                            path with the same contents
+    <cache_dir>/<source>_<spec>.json        the source file's path, size,
+                                            mtime and content hash
+where spec is a hash of the table, the columns read and their dtypes, so
+schema changes miss the cache too.
+
+A source whose size and mtime match its index is read straight from the
+pickle without touching the csv. Otherwise the csv is hashed: unchanged
+contents (e.g. a copied file) reuse the pickle, changed contents are parsed
+again. The cache directory defaults to ref_cache/ next to this file, or the
+NPMRDS_REF_CACHE environment variable.
+
+Usage:
+>>>from reference_cache import load_reference
+>>>df_meta = load_reference('tmc_identification', 'lottr')
+>>>df_urban = load_reference('network', 'phed', path='urban_tmc.csv')
+"""
+
+import os
+import json
+import hashlib
+import pandas as pd
+from npmrds_schema import TABLES, read_table, table_columns, table_dtypes
+from profiling import profiled
+
+
+PHED_DATA = 'H:/map21/perfMeasures/phed/data/'
+
+# Reference files by name: (default path, schema table)
+REFERENCES = {
+    'tmc_identification': (
+        'H:/map21/2020/data/pdx-3co-mtip-2019-all-15min/'
+        'TMC_Identification.csv', 'tmc_identification'),
+    'phed_tmc_identification': (
+        PHED_DATA +
+        'TMC_Identification_NPMRDS (Trucks and passenger vehicles).csv',
+        'tmc_identification'),
+    'metro_network': ('H:/map21/2020/data/networks/metro-2019.csv',
+                      'network'),
+    'urban_network': (PHED_DATA + 'urban_tmc.csv', 'network'),
+    'wa_network': (PHED_DATA + 'WA_tmc.csv', 'network'),
+    'here': (PHED_DATA + 'HERE_OR_Static_TriCounty_edit.csv', 'here'),
+    'peak_factors': (PHED_DATA + 'peakingFactors_join_edit.csv',
+                     'peak_factors'),
+}
+
+CACHE_DIR = os.environ.get(
+    'NPMRDS_REF_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ref_cache'))
+
+HASH_CHUNK = 2 ** 20
+
+
+def digest(text):
+    """Returns a short hex digest of a string."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def file_hash(path):
+    """Returns the sha1 hex digest of a file's contents."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def table_spec(table, columns):
+    """Returns the digest of what is read from a table: its name, columns
+    and dtypes."""
+    dtypes = table_dtypes(table, columns)
+    return digest(repr((table, columns, sorted(
+        (col, str(dtype)) for col, dtype in dtypes.items()))))
+
+
+def write_atomic(path, write):
+    """Writes a file through a temporary file, so readers never see a
+    partial one.
+    Args: path, the file to write.
+          write, a function of the temporary path that writes it.
+    """
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def reference_path(name, path=None):
+    """Returns the csv path and schema table of a reference name.
+    Args: name, a name in REFERENCES, or a schema table name (see
+                npmrds_schema.TABLES) when path is given.
+          path, optional csv path overriding the default.
+    """
+    if name in REFERENCES:
+        default, table = REFERENCES[name]
+        return path or default, table
+    if name in TABLES and path is not None:
+        return path, name
+    raise KeyError("Unknown reference table {0}; expected one of {1}, or a "
+                   "schema table with a path".format(name,
+                                                     sorted(REFERENCES)))
+
+
+@profiled
+def load_reference(name, measure=None, path=None, columns=None,
+                   cache_dir=None):
+    """Reads a reference table through the cache.
+    Args: name, a reference name, see reference_path().
+          measure, optional measure name whose columns to read, see
+                   npmrds_schema.MEASURES.
+          path, optional csv path overriding the default of name.
+          columns, optional list of columns to read instead.
+          cache_dir, the cache directory (default CACHE_DIR).
+    Returns: df, a pandas dataframe, as npmrds_schema.read_table() returns
+             it.
+    """
+    path, table = reference_path(name, path)
+    if columns is None and measure is not None:
+        columns = table_columns(table, measure)
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    spec = table_spec(table, columns)
+    index_path = os.path.join(cache_dir, '{0}_{1}.json'.format(
+        digest(os.path.abspath(path)), spec))
+    stat = os.stat(path)
+    source = {'path': os.path.abspath(path), 'size': stat.st_size,
+              'mtime': stat.st_mtime}
+
+    index = None
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    if index is not None and all(index[key] == value
+                                 for key, value in source.items()):
+        pickle_path = os.path.join(cache_dir, '{0}_{1}.pkl'.format(
+            index['sha1'], spec))
+        if os.path.exists(pickle_path):
+            return pd.read_pickle(pickle_path)
+
+    # new or changed source: hash the contents, parse them unless another
+    # source with the same contents already did
+    source['sha1'] = file_hash(path)
+    pickle_path = os.path.join(cache_dir, '{0}_{1}.pkl'.format(
+        source['sha1'], spec))
+    if os.path.exists(pickle_path):
+        df = pd.read_pickle(pickle_path)
+    else:
+        df = read_table(path, table, columns=columns)
+        write_atomic(pickle_path, df.to_pickle)
+
+    def write_index(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(source, f)
+    write_atomic(index_path, write_index)
+    return df
+
+
+def clear_cache(cache_dir=None):
+    """Removes every cached table and index."""
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.exists(cache_dir):
+        return
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(('.pkl', '.json')):
+            os.remove(os.path.join(cache_dir, filename))
@@ -0,0 +1,252 @@
+"""
+region_batch.py
+
+LOTTR, TTTR and PHED for many networks from one scan of the data.
+
+Metro, the WA side of the region and the other MPO and ODOT networks are
+each defined by a network file (metro-2019.csv, urban_tmc.csv, WA_tmc.csv
+...). Rather than rerunning the scripts once per network file, which reads
+the whole dataset every time, the measures run once (see run_measures.py)
+over the union of the networks, giving their per-TMC tables: LOTTR ttr and
+reliable flag, TTTR index weights, PHED TED. A TMC x region bitmask (bit r
+set when network r lists the TMC) then selects each region's TMCs from
+those tables for the summary measures:
+    lottr   percent reliable, interstate and non-interstate
+    tttr    freight reliability index
+    phed    TED per capita, over the region's own population
+PHED keeps to the urbanized area TMC list (urban_tmc.csv, refs['phed_urban'])
+as phed_calc.py does: a region's PHED sums the TED of its TMCs on that list.
+Each region's LOTTR and TTTR split its TMCs by its own network file's
+interstate flags; a network file without them takes the flags of the other
+network files, which must agree (see region_interstate()).
+
+Usage:
+>>>python region_batch.py
+>>>from region_batch import run_regions
+>>>refs['phed_urban'] = load_reference('urban_network', 'phed')
+>>>regions = [('metro', df_metro, 1577456), ('wa', df_wa, 488241)]
+>>>results, df_regions = run_regions(all_paths, all_store, truck_paths,
+>>>                                  truck_store, refs, regions)
+"""
+
+import os
+import pandas as pd
+import numpy as np
+import datetime as dt
+import lottr_calc
+import lottr_truck
+import phed_calc
+from npmrds_io import quarter_paths
+from npmrds_schema import table_columns
+from profiling import profiled
+from reference_cache import load_reference
+from run_measures import run_measures
+from tmc_dim import TmcDim
+
+
+# Bits of the region mask
+MAX_REGIONS = 64
+
+
+def union_network(networks):
+    """Combines network tables into one network of all their TMCs.
+    Args: networks, a list of network tables ('Tmc', optional 'interstate').
+    Returns: df_union, a network table with one row per TMC; interstate if
+             any network flags the TMC interstate (for the per-TMC tables;
+             the region summaries use region_interstate()).
+    """
+    df_union = pd.concat([df_net[[col for col in ['Tmc', 'interstate']
+                                  if col in df_net.columns]]
+                          for df_net in networks], ignore_index=True)
+    df_union['Tmc'] = df_union['Tmc'].astype(str)
+    if 'interstate' not in df_union.columns:
+        return df_union.drop_duplicates('Tmc').reset_index(drop=True)
+    return df_union.groupby('Tmc', as_index=False, sort=False).agg(
+        {'interstate': 'max'})
+
+
+def region_dim(networks):
+    """Builds the TMC x region bitmask over the networks' TMCs.
+    Args: networks, a list of network tables ('Tmc'), at most MAX_REGIONS.
+    Returns: dim, a tmc_dim.TmcDim over the networks' TMCs with a 'regions'
+             uint64 attribute, bit r set for the TMCs of networks[r].
+    """
+    if len(networks) > MAX_REGIONS:
+        raise ValueError("At most {0} regions, got {1}".format(
+            MAX_REGIONS, len(networks)))
+    dim = TmcDim(pd.concat([df_net['Tmc'].astype(str)
+                            for df_net in networks]))
+    bits = np.zeros(len(dim), dtype=np.uint64)
+    for region, df_net in enumerate(networks):
+        positions = dim.positions(df_net['Tmc'])
+        bits[positions] |= np.uint64(1) << np.uint64(region)
+    dim.attrs['regions'] = bits
+    return dim
+
+
+def region_mask(dim, region, tmc_codes):
+    """Returns a boolean mask of the TMC codes in a region.
+    Args: dim, see region_dim().
+          region, the region's position in the network list.
+          tmc_codes, a pandas series of TMC codes.
+    """
+    positions = dim.positions(tmc_codes)
+    bits = np.where(positions >= 0, dim.attrs['regions'][positions],
+                    np.uint64(0))
+    return (bits >> np.uint64(region)) & np.uint64(1) == 1
+
+
+def region_interstate(networks, region):
+    """Returns the interstate flags of a region's TMCs.
+    Args: networks, a list of network tables ('Tmc', optional 'interstate').
+          region, the region's position in the network list.
+    Returns: interstate, a pandas series of interstate flags indexed by Tmc.
+             A network without an interstate column takes the flags the
+             other networks give its TMCs (0 for TMCs none of them flag).
+    Raises: ValueError, if the other networks disagree on any of its TMCs.
+    """
+    df_net = networks[region]
+    tmcs = df_net['Tmc'].astype(str)
+    if 'interstate' in df_net.columns:
+        return pd.Series(df_net['interstate'].values, index=tmcs)
+    df_flags = pd.concat(
+        [pd.DataFrame({'Tmc': other['Tmc'].astype(str),
+                       'interstate': other['interstate']})
+         for other in networks if 'interstate' in other.columns],
+        ignore_index=True)
+    df_flags = df_flags[df_flags['Tmc'].isin(tmcs)]
+    conflicts = df_flags.groupby('Tmc')['interstate'].nunique()
+    conflicts = conflicts[conflicts > 1]
+    if len(conflicts) > 0:
+        raise ValueError(
+            "Networks disagree on the interstate flag of {0} TMCs of "
+            "region {1} (e.g. {2}); give its network an interstate "
+            "column".format(len(conflicts), region, conflicts.index[0]))
+    flags = df_flags.drop_duplicates('Tmc').set_index('Tmc')['interstate']
+    return flags.reindex(tmcs).fillna(0)
+
+
+def region_measures(results, dim, region, population, interstate):
+    """Calculates the summary measures of one region from the per-TMC
+    tables.
+    Args: results, see run_measures.run_measures().
+          dim, see region_dim().
+          region, the region's position in the network list.
+          population, the region's population.
+          interstate, the region's interstate flags, see
+                      region_interstate().
+    Returns: a dict of the region's LOTTR interstate and non-interstate
+             percent reliable, TTTR index and PHED per capita.
+    """
+    df_lottr = results['lottr'][0]
+    df_lottr = df_lottr[region_mask(dim, region, df_lottr['tmc_code'])].copy()
+    df_lottr['interstate'] = df_lottr['tmc_code'].map(interstate)
+    int_rel_pct, non_int_rel_pct = lottr_calc.calc_pct_reliability(df_lottr)
+
+    df_tttr = results['tttr'][0]
+    df_tttr = df_tttr[region_mask(dim, region, df_tttr['tmc_code'])].copy()
+    df_tttr['interstate'] = df_tttr['tmc_code'].map(interstate)
+    _, tttr_index = lottr_truck.calc_freight_reliability(df_tttr)
+
+    df_phed = results['phed'][0]
+    df_phed = df_phed[region_mask(dim, region, df_phed['tmc_code'])]
+    phed = phed_calc.per_capita_TED(df_phed['TED'].sum(), population)
+
+    return {'lottr_interstate': int_rel_pct,
+            'lottr_non_interstate': non_int_rel_pct,
+            'tttr_index': tttr_index,
+            'phed_per_capita': phed}
+
+
+@profiled
+def run_regions(all_paths, all_store, truck_paths, truck_store, refs,
+                regions):
+    """Calculates LOTTR, TTTR and PHED for many regions from one load of
+    both feeds.
+    Args: all_paths, all_store, truck_paths, truck_store, see
+          run_measures.load_feeds().
+          refs, a dict of reference tables, see
+                annual_update.annual_measures(), without the LOTTR/TTTR
+                network table ('urban'); 'phed_urban' is the urbanized area
+                TMC list each region's PHED is limited to.
+          regions, a list of (name, network table, population) tuples.
+    Returns: results, the per-TMC tables over all regions, see
+                      run_measures.run_measures().
+             df_regions, a pandas dataframe of the summary measures, one
+                         row per region.
+    """
+    networks = [df_net for _, df_net, _ in regions]
+    df_union = union_network(networks)
+    refs = dict(refs, urban=df_union)
+    results = run_measures(all_paths, all_store, truck_paths, truck_store,
+                           refs)
+
+    print("Region measures...")
+    dim = region_dim(networks)
+    rows = []
+    for region, (name, _, population) in enumerate(regions):
+        interstate = region_interstate(networks, region)
+        row = {'region': name, 'population': population}
+        row.update(region_measures(results, dim, region, population,
+                                   interstate))
+        rows.append(row)
+    return results, pd.DataFrame(rows)
+
+
+@profiled
+def main():
+    """Main script to calculate LOTTR, TTTR and PHED per region."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+
+    drive_path = 'H:/map21/2020/data/'
+    quarters = ['']
+    file_end = '.csv'
+    folder_end = 'pdx-3co-mtip-2019-all-15min'
+    all_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    all_store = os.path.join(os.path.dirname(__file__),
+                             drive_path + folder_end + '.h5')
+    meta_path = os.path.join(os.path.dirname(__file__),
+                             drive_path + folder_end + '/' +
+                             'TMC_Identification.csv')
+    folder_end = 'pdx-3co-mtip-2019-trucks-15min'
+    truck_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    truck_store = os.path.join(os.path.dirname(__file__),
+                               drive_path + folder_end + '.h5')
+
+    refs = {
+        'meta': load_reference('tmc_identification', 'lottr',
+                               path=meta_path),
+        'phed_urban': load_reference('urban_network', 'phed'),
+        'peak': load_reference('peak_factors', 'phed'),
+        'here': load_reference('here', 'phed'),
+    }
+    refs['truck_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'tttr')]
+    refs['phed_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'phed')]
+
+    # (name, network file, population); add a network file per MPO or ODOT
+    # region to report. urban_tmc.csv and WA_tmc.csv are plain TMC lists
+    # and take their interstate flags from metro-2019.csv.
+    regions = [
+        ('metro', load_reference('metro_network', 'lottr'),
+         phed_calc.POP_PDX),
+        ('urban', load_reference('urban_network', 'phed'),
+         phed_calc.POP_PDX),
+        # Clark County, WA (2019 estimate)
+        ('wa', load_reference('wa_network', 'phed'), 488241),
+    ]
+
+    results, df_regions = run_regions(all_paths, all_store, truck_paths,
+                                      truck_store, refs, regions)
+    print(df_regions)
+    df_regions.to_csv('region_measures_2019.csv', index=False)
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
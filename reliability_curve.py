@@ -0,0 +1,134 @@
+"""
+reliability_curve.py
+
+LOTTR percent reliable as a curve over reliability thresholds.
+
+calc_pct_reliability() answers one threshold (1.5, see
+lottr_calc.check_reliable()). A TMC is reliable at threshold t when its LOTTR
+is below t in every period, that is when its largest LOTTR across periods
+(lottr_max, see lottr_calc.worst_period()) is below t. So the TMCs of every
+group (interstate / non-interstate, and any extra grouping) are sorted by
+lottr_max once, and their person-mile weights (ttr) are summed cumulatively in
+that order: the reliable weight at any threshold is then the cumulative
+weight at a binary search position, and a whole curve of thresholds is one
+np.searchsorted() call per group. A TMC missing a period's LOTTR is never
+reliable, and a missing ttr weighs nothing, as in calc_pct_reliability().
+
+Usage:
+>>>python reliability_curve.py
+>>>from reliability_curve import ReliabilityCurve
+>>>curve = ReliabilityCurve(df_lottr, by='county')
+>>>df_curve = curve.pct_reliable(np.arange(1.2, 2.01, .01))
+"""
+
+import pandas as pd
+import numpy as np
+import datetime as dt
+from lottr_calc import worst_period
+from profiling import profiled
+from quantiles import factorize_groups
+
+
+# Threshold range of the target setting curve
+CURVE_THRESHOLDS = np.round(np.arange(1.2, 2.001, .01), 2)
+
+
+class ReliabilityCurve:
+    """Percent reliable of groups of TMCs at any threshold, see the module
+    docstring."""
+
+    @profiled
+    def __init__(self, df, by=None, weight_col='ttr'):
+        """Sorts each group's TMCs by their largest LOTTR once.
+        Args: df, a pandas dataframe with one row per TMC, its LOTTR per
+                  period, interstate and weight columns, see
+                  lottr_calc.reliability_results(); its lottr_max column
+                  is used if present, see lottr_calc.worst_period().
+              by, optional column name or list of column names to group on
+                  besides interstate (e.g. 'county').
+              weight_col, the person-mile weight column.
+        """
+        if by is None:
+            by = []
+        elif isinstance(by, str):
+            by = [by]
+        df = df.assign(interstate=(df['interstate'] == 1).astype(int))
+        if 'lottr_max' not in df.columns:
+            df = worst_period(df)
+        group_ids, self.df_keys = factorize_groups(df, ['interstate'] + by)
+
+        lottr_max = df['lottr_max'].values.astype(np.float64)
+        # never reliable
+        lottr_max[np.isnan(lottr_max)] = np.inf
+        weights = np.nan_to_num(df[weight_col].values.astype(np.float64))
+
+        keep = group_ids >= 0
+        group_ids = group_ids[keep]
+        order = np.lexsort((lottr_max[keep], group_ids))
+        self.lottr_max = lottr_max[keep][order]
+        cum_weights = np.cumsum(weights[keep][order])
+        self.cum_weights = np.append(0, cum_weights)
+        counts = np.bincount(group_ids, minlength=len(self.df_keys))
+        self.ends = np.cumsum(counts)
+        self.starts = self.ends - counts
+
+    def reliable_weights(self, thresholds):
+        """Sums the weight of the reliable TMCs of every group.
+        Args: thresholds, an array of n thresholds.
+        Returns: reliable, total, (n_groups x n) and (n_groups x 1) arrays of
+                 reliable and total weights.
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        reliable = np.empty((len(self.df_keys), len(thresholds)))
+        for group, (start, end) in enumerate(zip(self.starts, self.ends)):
+            # TMCs with lottr_max strictly below the threshold
+            below = start + np.searchsorted(self.lottr_max[start:end],
+                                            thresholds, side='left')
+            reliable[group] = self.cum_weights[below]
+        reliable -= self.cum_weights[self.starts, None]
+        total = (self.cum_weights[self.ends]
+                 - self.cum_weights[self.starts])[:, None]
+        return reliable, total
+
+    def pct_reliable(self, thresholds=CURVE_THRESHOLDS):
+        """Calculates the percent reliable of every group at each
+        threshold.
+        Args: thresholds, a threshold or list of thresholds.
+        Returns: df_curve, a pandas dataframe of the group keys, threshold
+                 and pct_reliable (the reliable share of the group's
+                 weight), one row per group and threshold.
+        """
+        thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+        reliable, total = self.reliable_weights(thresholds)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pct = reliable / total
+
+        df_curve = self.df_keys.loc[
+            np.repeat(np.arange(len(self.df_keys)), len(thresholds))
+        ].reset_index(drop=True)
+        df_curve['threshold'] = np.tile(thresholds, len(self.df_keys))
+        df_curve['pct_reliable'] = pct.ravel()
+        return df_curve
+
+
+@profiled
+def main():
+    """Main script to calculate the LOTTR reliability curve."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+
+    # Per-TMC LOTTR table written by run_measures.py
+    df_lottr = pd.read_csv('lottr_out_2019_mtip2020.csv')
+    curve = ReliabilityCurve(df_lottr)
+    df_curve = curve.pct_reliable(CURVE_THRESHOLDS)
+    print(df_curve.pivot(index='threshold', columns='interstate',
+                         values='pct_reliable'))
+    df_curve.to_csv('lottr_reliability_curve.csv', index=False)
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+run_measures.py
+
+Calculates LOTTR, TTTR and PHED in one run.
+
+lottr_calc.py, lottr_truck.py and phed_calc.py each read the all vehicle
+feed, decode its timestamps and join the TMC metadata on their own. Here the
+shared data is prepared once: both feeds are read from their HDF5 stores
+(built from the csv files on first use) into aligned TMC x 15-minute grids
+(see tt_grid.py) over the union of the measures' TMCs, and the three
+measures run as stages over those grids:
+    lottr   all vehicle grid, 6am - 8pm periods, 80th percentile
+    tttr    Truck grid with all vehicle fallback, 95th percentile
+    phed    all vehicle grid, weekday peak hour columns
+Each stage returns its per-TMC table and its summary result.
+
+The grids hold a float32 travel time and a boolean presence cell per TMC and
+15-minute epoch for both feeds (GRID_CELL_BYTES, about 350 kB per TMC-year),
+and the stages need about as much again while they run. When the TMCs do not
+fit in max_grid_bytes (MAX_GRID_BYTES by default, e.g. a statewide network)
+they are split into blocks that do: each block's grids are loaded and run
+through the stages in turn, and the summary results are taken over the
+concatenated per-TMC tables.
+
+Usage:
+>>>python run_measures.py
+"""
+
+import os
+import pandas as pd
+import numpy as np
+import datetime as dt
+import lottr_calc
+import lottr_truck
+import phed_calc
+from npmrds_io import quarter_paths
+from npmrds_schema import table_columns
+from npmrds_store import ensure_store, iter_store, store_months
+from periods import LOTTR_PERIODS, TTTR_PERIODS
+from profiling import profiled
+from reference_cache import load_reference
+from tmc_dim import TmcDim, network_dim
+from tt_grid import (grid_epochs, grid_period_ttr, grid_start, read_grid,
+                     truck_fallback, truck_missing_rows)
+
+
+# Grid memory budget, and the bytes per TMC x epoch cell of both feeds'
+# float32 travel times and boolean presence
+MAX_GRID_BYTES = 2 * 1024**3
+GRID_CELL_BYTES = 2 * (4 + 1)
+
+
+def feed_months(all_store, truck_store):
+    """Returns the sorted (year, month) partitions both stores hold."""
+    return sorted(set(store_months(all_store))
+                  & set(store_months(truck_store)))
+
+
+def feed_tmcs(refs):
+    """Returns the sorted distinct TMC codes any measure reads, as
+    strings."""
+    return np.sort(pd.unique(pd.concat(
+        [refs['urban']['Tmc'].astype(str),
+         refs['phed_urban']['Tmc'].astype(str)])))
+
+
+def tmc_blocks(tmcs, n_epochs, max_grid_bytes=MAX_GRID_BYTES):
+    """Splits TMCs into blocks whose feed grids fit in a memory budget.
+    Args: tmcs, an array of TMC codes.
+          n_epochs, the number of grid columns.
+          max_grid_bytes, the memory budget of one block's grids.
+    Returns: a list of arrays of TMC codes.
+    """
+    size = max(int(max_grid_bytes // (n_epochs * GRID_CELL_BYTES)), 1)
+    return [tmcs[i:i + size] for i in range(0, len(tmcs), size)] or [tmcs]
+
+
+@profiled
+def load_feeds(all_paths, all_store, truck_paths, truck_store, refs,
+               tmcs=None, drop_missing=None):
+    """Loads both NPMRDS feeds once, as grids over every TMC a measure
+    reads.
+    Args: all_paths, truck_paths, the all vehicle and Truck csv files.
+          all_store, truck_store, the HDF5 stores backing them.
+          refs, a dict of reference tables, see
+                annual_update.annual_measures().
+          tmcs, optional block of TMC codes to load (default: every TMC a
+                measure reads, see feed_tmcs()).
+          drop_missing, the TTTR missing travel time rule (see
+                        tt_grid.truck_fallback()); by default decided from
+                        the loaded Truck grid, so pass it when loading a
+                        block.
+    Returns: a dict with 'dim' (the grid TMC dimension), 'start' (the
+             grids' first timestamp), 'all' and 'present' (all vehicle
+             travel times and readings), 'truck' (Truck travel times) and
+             'drop_missing'.
+    """
+    ensure_store(all_paths, all_store)
+    ensure_store(truck_paths, truck_store)
+    months = feed_months(all_store, truck_store)
+    dim = TmcDim(feed_tmcs(refs) if tmcs is None else tmcs)
+
+    print("Loading All Vehicle & Truck grids...")
+    all_tt, present = read_grid(all_store, dim, months)
+    truck, truck_present = read_grid(truck_store, dim, months)
+    if drop_missing is None:
+        # the Truck rows the row engine (lottr_truck.py) reads
+        network = dim.tmcs.isin(refs['urban']['Tmc'].astype(str))
+        drop_missing = truck_missing_rows(truck, truck_present)[
+            network].any()
+    return {'dim': dim, 'start': grid_start(months), 'all': all_tt,
+            'present': present, 'truck': truck,
+            'drop_missing': drop_missing}
+
+
+def fallback_grid(feeds, refs):
+    """Builds the TTTR grid: Truck times, with all vehicle times where they
+    are missing or zero (see tt_grid.truck_fallback()).
+    Returns: grid, available, see tt_grid.truck_fallback().
+    """
+    return truck_fallback(feeds['truck'], feeds['all'], feeds['present'],
+                          feeds['drop_missing'])
+
+
+@profiled
+def lottr_stage(feeds, refs):
+    """Calculates LOTTR from the all vehicle grid.
+    Returns: df, the per-TMC table, see lottr_calc.reliability_results().
+             the interstate and non-interstate percent reliability.
+    """
+    print("LOTTR...")
+    dim = network_dim(refs['urban'], refs['meta'])
+    df = grid_period_ttr(feeds['all'], feeds['dim'], feeds['start'],
+                         LOTTR_PERIODS, 80)
+    df = df[dim.isin('urban', df['tmc_code'])]
+    df = lottr_calc.reliability_results(df, dim)
+    return df, lottr_calc.calc_pct_reliability(df)
+
+
+@profiled
+def tttr_stage(feeds, refs):
+    """Calculates TTTR from the Truck grid, with all vehicle times where
+    Truck times are missing or zero.
+    Returns: df, the per-TMC table, see lottr_truck.freight_results().
+             the freight reliability index.
+    """
+    print("TTTR...")
+    dim = network_dim(refs['urban'], refs['truck_meta'])
+    grid, available = fallback_grid(feeds, refs)
+    df = grid_period_ttr(grid, feeds['dim'], feeds['start'], TTTR_PERIODS,
+                         95, available)
+    del grid, available
+    df = df[dim.isin('urban', df['tmc_code'])]
+    return lottr_truck.freight_results(df, dim)
+
+
+@profiled
+def phed_stage(feeds, refs):
+    """Calculates PHED from the all vehicle grid.
+    Returns: df, the per-TMC table, see phed_calc.TED_summation().
+             PHED per capita.
+    """
+    print("PHED...")
+    dim = phed_calc.phed_dim(refs['phed_urban'], refs['phed_meta'],
+                             refs['here'])
+    df = phed_calc.grid_ted_seg(feeds['all'], feeds['dim'], feeds['start'],
+                                dim, refs['peak'], feeds['present'])
+    df = phed_calc.TED_summation(df)
+    return df, phed_calc.per_capita_TED(df['TED'].sum())
+
+
+STAGES = [('lottr', lottr_stage), ('tttr', tttr_stage), ('phed', phed_stage)]
+
+# Summary result of each stage from its per-TMC table
+SUMMARIES = {
+    'lottr': lottr_calc.calc_pct_reliability,
+    'tttr': lambda df: lottr_truck.calc_freight_reliability(df)[1],
+    'phed': lambda df: phed_calc.per_capita_TED(df['TED'].sum()),
+}
+
+
+@profiled
+def run_measures(all_paths, all_store, truck_paths, truck_store, refs,
+                 max_grid_bytes=MAX_GRID_BYTES):
+    """Calculates LOTTR, TTTR and PHED from one load of both feeds, block by
+    block of TMCs if their grids do not fit in max_grid_bytes.
+    Args: see load_feeds().
+          max_grid_bytes, the memory budget of the feed grids.
+    Returns: a dict of (per-TMC dataframe, result) keyed by 'lottr', 'tttr'
+             and 'phed'.
+    """
+    ensure_store(all_paths, all_store)
+    ensure_store(truck_paths, truck_store)
+    months = feed_months(all_store, truck_store)
+    blocks = tmc_blocks(feed_tmcs(refs), grid_epochs(months), max_grid_bytes)
+    if len(blocks) == 1:
+        feeds = load_feeds(all_paths, all_store, truck_paths, truck_store,
+                           refs)
+        return {name: stage(feeds, refs) for name, stage in STAGES}
+
+    # the TTTR missing travel time rule holds across blocks
+    print("{0} TMC blocks".format(len(blocks)))
+    drop_missing = lottr_truck.truck_missing(iter_store(
+        truck_store, columns=['travel_time_seconds'], months=months,
+        tmcs=refs['urban']['Tmc']))
+    tables = {name: [] for name, _ in STAGES}
+    for tmcs in blocks:
+        feeds = load_feeds(all_paths, all_store, truck_paths, truck_store,
+                           refs, tmcs, drop_missing)
+        # a block's own summary results are not used (and may divide by
+        # zero)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, stage in STAGES:
+                tables[name].append(stage(feeds, refs)[0])
+        del feeds
+
+    results = {}
+    for name, _ in STAGES:
+        df = pd.concat(tables[name], ignore_index=True, sort=False)
+        results[name] = (df, SUMMARIES[name](df))
+    return results
+
+
+@profiled
+def main():
+    """Main script to calculate LOTTR, TTTR and PHED."""
+    startTime = dt.datetime.now()
+    print('Script started at {0}'.format(startTime))
+    pd.set_option('display.max_rows', None)
+
+    drive_path = 'H:/map21/2020/data/'
+    quarters = ['']
+    file_end = '.csv'
+    folder_end = 'pdx-3co-mtip-2019-all-15min'
+    all_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    all_store = os.path.join(os.path.dirname(__file__),
+                             drive_path + folder_end + '.h5')
+    meta_path = os.path.join(os.path.dirname(__file__),
+                             drive_path + folder_end + '/' +
+                             'TMC_Identification.csv')
+    folder_end = 'pdx-3co-mtip-2019-trucks-15min'
+    truck_paths = quarter_paths(drive_path, quarters, folder_end, file_end)
+    truck_store = os.path.join(os.path.dirname(__file__),
+                               drive_path + folder_end + '.h5')
+
+    refs = {
+        'urban': load_reference('metro_network', 'lottr'),
+        'meta': load_reference('tmc_identification', 'lottr',
+                               path=meta_path),
+        'phed_urban': load_reference('urban_network', 'phed'),
+        'peak': load_reference('peak_factors', 'phed'),
+        'here': load_reference('here', 'phed'),
+    }
+    refs['truck_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'tttr')]
+    refs['phed_meta'] = refs['meta'][
+        table_columns('tmc_identification', 'phed')]
+
+    results = run_measures(all_paths, all_store, truck_paths, truck_store,
+                           refs)
+    print("LOTTR percent reliable (interstate, non-interstate): {0}"
+          .format(results['lottr'][1]))
+    print("TTTR index: {0}".format(results['tttr'][1]))
+    print("PHED per capita: {0}".format(round(results['phed'][1], 2)))
+
+    results['lottr'][0].to_csv('lottr_out_2019_mtip2020.csv')
+    results['tttr'][0].to_csv('lottr_truck_out_2018_mtip2020.csv')
+    results['phed'][0][['tmc_code', 'TED']].to_csv('phed_out.csv')
+
+    endTime = dt.datetime.now()
+    print("Script finished in {0}.".format(endTime - startTime))
+
+
+if __name__ == '__main__':
+    main()
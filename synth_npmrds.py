@@ -0,0 +1,212 @@
+"""
+synth_npmrds.py
+
+Synthetic NPMRDS data for benchmarks.
+
+Generates NPMRDS-shaped 15-minute travel time csv files (all vehicle and
+Truck feeds) and matching reference tables for any number of TMCs and days,
+so the pipelines can be timed without the files on H:/map21/:
+    npmrds_all.csv, npmrds_truck.csv   travel time downloads
+    npmrds_all.h5, npmrds_truck.h5     their HDF5 stores, see
+                                       npmrds_store.py
+    TMC_Identification.csv             TMC metadata
+    metro_tmc.csv                      LOTTR/TTTR network ('Tmc',
+                                       'interstate')
+    urban_tmc.csv                      PHED network ('Tmc')
+    HERE_speed_limits.csv              HERE speed limits
+    peaking_factors.csv                15-minute peaking factors
+
+Travel times are free-flow times (segment length at 40 mph) scaled by
+weekday AM/PM peaks, a weekend midday bump and lognormal noise. Readings
+are missing at random, more so overnight, on a few sparse TMCs and on the
+Truck feed (about 40% coverage), which also has a few zero travel times,
+as in the RITIS downloads.
+
+Usage:
+>>>from synth_npmrds import generate
+>>>paths = generate('synth/1000x365', n_tmcs=1000, n_days=365)
+>>>df = read_cached([paths['all']], paths['all_store'])
+"""
+
+import os
+import pandas as pd
+import numpy as np
+from npmrds_store import ensure_store
+
+
+EPOCHS_PER_DAY = 96
+
+FILES = {
+    'all': 'npmrds_all.csv',
+    'truck': 'npmrds_truck.csv',
+    'all_store': 'npmrds_all.h5',
+    'truck_store': 'npmrds_truck.h5',
+    'meta': 'TMC_Identification.csv',
+    'urban': 'metro_tmc.csv',
+    'phed_urban': 'urban_tmc.csv',
+    'here': 'HERE_speed_limits.csv',
+    'peak': 'peaking_factors.csv',
+}
+
+
+def synth_paths(out_dir):
+    """Returns the paths of a synthetic data set, keyed as FILES."""
+    return {name: os.path.join(out_dir, filename)
+            for name, filename in FILES.items()}
+
+
+def tmc_codes(n_tmcs):
+    """Returns n_tmcs TMC-shaped codes ('114+00000', '114-00000', ...)."""
+    i = np.arange(n_tmcs)
+    signs = np.where(i % 2 == 0, '+', '-')
+    return np.array(['114{0}{1:05d}'.format(sign, j // 2)
+                     for sign, j in zip(signs, i)])
+
+
+def synth_reference(tmcs, rs):
+    """Generates the reference tables of a set of TMCs.
+    Args: tmcs, an array of TMC codes.
+          rs, a numpy RandomState.
+    Returns: a dict of pandas dataframes keyed by 'meta', 'urban',
+             'phed_urban', 'here' and 'peak'.
+    """
+    n = len(tmcs)
+    interstate = rs.rand(n) < 0.2
+    faciltype = rs.choice([1, 2], n, p=[0.3, 0.7])
+    aadt = np.where(interstate, rs.randint(40000, 150000, n),
+                    rs.randint(2000, 40000, n))
+    df_meta = pd.DataFrame({
+        'tmc': tmcs,
+        'road': np.where(interstate, 'I-5', 'SYNTH RD'),
+        'direction': np.where(np.arange(n) % 2 == 0, 'NORTHBOUND',
+                              'SOUTHBOUND'),
+        'county': 'MULTNOMAH',
+        'state': 'OR',
+        'miles': np.round(rs.uniform(0.05, 2.0, n), 6),
+        'tmclinear': np.arange(n) // 10 + 1,
+        'faciltype': faciltype,
+        'aadt': aadt,
+        'aadt_singl': np.round(aadt * rs.uniform(0.01, 0.05, n)),
+        'aadt_combi': np.round(aadt * rs.uniform(0.02, 0.10, n)),
+        'nhs_pct': np.where(rs.rand(n) < 0.8, 100, 0),
+    })
+    in_urban = rs.rand(n) < 0.8
+    df_urban = pd.DataFrame({'Tmc': tmcs[in_urban],
+                             'interstate': interstate[in_urban].astype(int)})
+    df_phed_urban = pd.DataFrame({'Tmc': tmcs[rs.rand(n) < 0.7]})
+    df_here = pd.DataFrame({
+        'TMC_HERE': tmcs,
+        'SPEED_LIMIT': np.where(interstate, rs.choice([55, 65], n),
+                                rs.choice([25, 35, 45], n))})
+
+    # Peaking factors by 15-minute start time, summing to about 1 a day
+    minutes = np.arange(EPOCHS_PER_DAY) * 15
+    hours = minutes / 60
+    shape = (0.2 + np.exp(-(hours - 8) ** 2 / 2)
+             + 1.2 * np.exp(-(hours - 17) ** 2 / 3))
+    df_peak = pd.DataFrame({
+        'startTime': ['{0:02d}:{1:02d}:00'.format(m // 60, m % 60)
+                      for m in minutes],
+        '2015_15-min_Combined': np.round(shape / shape.sum(), 6)})
+
+    return {'meta': df_meta, 'urban': df_urban, 'phed_urban': df_phed_urban,
+            'here': df_here, 'peak': df_peak}
+
+
+def congestion(hours, weekday):
+    """Returns the travel time multiplier by hour of day (float array)."""
+    if weekday < 5:
+        return (1 + 0.8 * np.exp(-(hours - 8) ** 2 / 2)
+                + 1.0 * np.exp(-(hours - 17) ** 2 / 3))
+    return 1 + 0.2 * np.exp(-(hours - 14) ** 2 / 8)
+
+
+def synth_day(date, tmcs, free_flow, severity, coverage, rs, truck=False):
+    """Generates one day of 15-minute readings.
+    Args: date, a pandas Timestamp.
+          tmcs, an array of TMC codes.
+          free_flow, per-TMC free-flow travel times (seconds).
+          severity, per-TMC congestion severity (0-1).
+          coverage, per-TMC reading probability.
+          rs, a numpy RandomState.
+          truck, True for the Truck feed.
+    Returns: df, a pandas dataframe of NPMRDS columns.
+    """
+    n = len(tmcs)
+    tmc = np.repeat(np.arange(n), EPOCHS_PER_DAY)
+    epoch = np.tile(np.arange(EPOCHS_PER_DAY), n)
+    hours = epoch / 4
+
+    # fewer probe vehicles overnight
+    p = coverage[tmc] * np.where((hours < 5) | (hours >= 22), 0.6, 1.0)
+    if truck:
+        p = p * 0.4
+    keep = rs.rand(len(tmc)) < p
+    tmc = tmc[keep]
+    epoch = epoch[keep]
+
+    multiplier = 1 + (congestion(epoch / 4, date.weekday()) - 1) * severity[
+        tmc]
+    tt = free_flow[tmc] * multiplier * rs.lognormal(0, 0.15, len(tmc))
+    if truck:
+        tt *= 1.1
+        tt[rs.rand(len(tt)) < 0.002] = 0
+    tt = np.round(tt, 2)
+
+    tstamps = (date + pd.to_timedelta(np.arange(EPOCHS_PER_DAY) * 15,
+                                      unit='m')).strftime('%Y-%m-%d %H:%M:%S')
+    miles = free_flow / 3600 * 40
+    with np.errstate(divide='ignore'):
+        speed = np.where(tt > 0, miles[tmc] / tt * 3600, np.nan)
+    return pd.DataFrame({
+        'tmc_code': pd.Categorical.from_codes(tmc, categories=tmcs),
+        'measurement_tstamp': pd.Categorical.from_codes(
+            epoch, categories=tstamps),
+        'speed': np.round(speed, 2),
+        'average_speed': np.round(speed, 2),
+        'reference_speed': np.round(miles[tmc] / free_flow[tmc] * 3600, 2),
+        'travel_time_seconds': tt,
+        'data_density': np.where(rs.rand(len(tmc)) < 0.7, 'A', 'B'),
+    })
+
+
+def generate(out_dir, n_tmcs, n_days, start='2019-01-01', seed=0):
+    """Writes a synthetic data set, unless it already exists.
+    Args: out_dir, the output directory (created if missing).
+          n_tmcs, the number of TMCs.
+          n_days, the number of days of 15-minute readings.
+          start, the first day.
+          seed, the random seed.
+    Returns: a dict of file paths, see synth_paths().
+    """
+    paths = synth_paths(out_dir)
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    print("Generating {0} TMCs x {1} days in {2}...".format(n_tmcs, n_days,
+                                                             out_dir))
+    rs = np.random.RandomState(seed)
+    tmcs = tmc_codes(n_tmcs)
+    refs = synth_reference(tmcs, rs)
+    for name in ['meta', 'urban', 'phed_urban', 'here', 'peak']:
+        refs[name].to_csv(paths[name], index=False)
+
+    # free flow at 40 mph over a segment length consistent with the
+    # metadata, so speeds and travel times agree
+    free_flow = refs['meta']['miles'].values / 40 * 3600
+    severity = rs.beta(2, 3, n_tmcs)
+    coverage = np.where(rs.rand(n_tmcs) < 0.05, 0.2, rs.uniform(0.8, 1.0,
+                                                                n_tmcs))
+
+    for name, truck in [('all', False), ('truck', True)]:
+        header = True
+        for date in pd.date_range(start, periods=n_days, freq='D'):
+            df = synth_day(date, tmcs, free_flow, severity, coverage, rs,
+                           truck)
+            df.to_csv(paths[name], mode='w' if header else 'a',
+                      header=header, index=False)
+            header = False
+        ensure_store([paths[name]], paths[name + '_store'])
+    return paths
@@ -0,0 +1,64 @@
+"""
+test_annual_update.py
+
+Checks the rolling window of the annual state store: the running histogram
+totals always equal the sum of the months kept.
+
+Usage:
+>>>python -m pytest -q test_annual_update.py
+"""
+
+import numpy as np
+import pandas as pd
+from annual_update import (HISTOGRAMS, evict, put_month, state_key,
+                           state_months, total_key)
+from tt_hist import build_histogram, merge_histograms
+
+
+def month_partials(seed):
+    """Returns the partials of a made-up month."""
+    rs = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        'tmc_code': rs.choice(['114+04100', '114+04101'], 500),
+        'period': rs.choice(['MF_6_9', 'MF_16_19'], 500),
+        'travel_time_seconds': rs.randint(3000, 3100, 500) / 100})
+    df_phed = pd.DataFrame({'tmc_code': ['114+04100'], 'TED_seg': [1.0],
+                            'pct_auto': [.9], 'pct_bus': [.01],
+                            'pct_truck': [.09]})
+    return {'lottr': build_histogram(df), 'tttr': build_histogram(df),
+            'phed': df_phed}
+
+
+def sorted_hist(df_hist):
+    return df_hist.sort_values(['tmc_code', 'period', 'bin']).reset_index(
+        drop=True)
+
+
+def assert_totals(store, partials, months):
+    """Asserts the state holds the months and totals of their partials."""
+    assert state_months(store) == months
+    for measure in HISTOGRAMS:
+        df_expected = merge_histograms([partials[month][measure]
+                                        for month in months])
+        pd.testing.assert_frame_equal(sorted_hist(store[total_key(measure)]),
+                                      sorted_hist(df_expected))
+
+
+def test_rolling_window(tmp_path):
+    months = [(2018, 11), (2018, 12), (2019, 1), (2019, 2)]
+    partials = {month: month_partials(seed)
+                for seed, month in enumerate(months)}
+    with pd.HDFStore(str(tmp_path / 'state.h5'), mode='a') as store:
+        for month in months:
+            put_month(store, month[0], month[1], partials[month])
+            evict(store, 3)
+        assert_totals(store, partials, months[1:])
+        assert state_key('lottr', 2018, 11) not in store.keys()
+
+        # re-ingesting a month replaces it
+        partials[(2019, 1)] = month_partials(10)
+        put_month(store, 2019, 1, partials[(2019, 1)])
+        assert_totals(store, partials, months[1:])
+
+        evict(store, 1)
+        assert_totals(store, partials, months[3:])
@@ -0,0 +1,29 @@
+"""
+test_bootstrap.py
+
+Checks that bootstrap replicates depend on the seed only, not on the number
+of worker processes.
+
+Usage:
+>>>python -m pytest -q test_bootstrap.py
+"""
+
+import pandas as pd
+from bootstrap import bootstrap_replicates, replicate_pieces
+from run_measures import STAGES, load_feeds
+
+
+def test_replicates_per_seed(data):
+    paths, refs = data
+    feeds = load_feeds([paths['all']], paths['all_store'], [paths['truck']],
+                       paths['truck_store'], refs)
+    results = {name: stage(feeds, refs) for name, stage in STAGES}
+    pieces = replicate_pieces(feeds, refs, results)
+
+    df_replicates = bootstrap_replicates(pieces, 20, seed=1, workers=1)
+    pd.testing.assert_frame_equal(
+        bootstrap_replicates(pieces, 20, seed=1, workers=1), df_replicates)
+    pd.testing.assert_frame_equal(
+        bootstrap_replicates(pieces, 20, seed=1, workers=3), df_replicates)
+    assert not bootstrap_replicates(pieces, 20, seed=2,
+                                    workers=1).equals(df_replicates)
@@ -0,0 +1,53 @@
+"""
+test_date_rules.py
+
+Checks the date rules against day lists picked by hand.
+
+Usage:
+>>>python -m pytest -q test_date_rules.py
+"""
+
+import numpy as np
+import pandas as pd
+from date_rules import DateRules
+from hourly_profile import MAY_MIDWEEK
+
+
+def kept_days(rules, start, end):
+    """Returns the days of month kept by the rules between two dates."""
+    dates = pd.date_range(start, end, freq='D')
+    return dates[rules.dates_mask(dates)].day.tolist()
+
+
+def test_may_midweek_2017():
+    # the day list the INRIX May scripts hardcoded for 2017
+    assert kept_days(MAY_MIDWEEK, '2017-05-01', '2017-05-31') == [
+        2, 3, 4, 9, 10, 11, 16, 17, 18, 23, 24, 25]
+
+
+def test_may_midweek_2020():
+    # Memorial Day is May 25th; the Thursday after it is in May
+    assert kept_days(MAY_MIDWEEK, '2020-05-01', '2020-05-31') == [
+        5, 6, 7, 12, 13, 14, 19, 20, 21]
+
+
+def test_observed_holidays_and_exclusions():
+    # July 4th 2020 is a Saturday, observed on Friday the 3rd
+    rules = DateRules(weekdays=[0, 1, 2, 3, 4], holidays=True,
+                      exclude=['2020-07-08'])
+    assert kept_days(rules, '2020-07-01', '2020-07-10') == [1, 2, 6, 7, 9, 10]
+
+
+def test_ranges_wrap_over_the_new_year():
+    rules = DateRules(ranges=[('12-30', '01-02')])
+    dates = pd.date_range('2019-12-28', '2020-01-04', freq='D')
+    assert dates[rules.dates_mask(dates)].strftime('%m-%d').tolist() == [
+        '12-30', '12-31', '01-01', '01-02']
+
+
+def test_keep_across_years():
+    rules = DateRules(months=[1])
+    dates = pd.date_range('2019-12-31', '2020-01-01', freq='D')
+    day_of_year = np.asarray(dates.dayofyear)
+    assert rules.keep(day_of_year, dates.year).tolist() == [False, True]
+    assert not rules.keep([-1], 2020).any()
@@ -0,0 +1,241 @@
+"""
+test_engines.py
+
+Checks that the LOTTR, TTTR and PHED engines agree on a small synthetic data
+set (see conftest.py):
+    lottr   rows, grid, cube and histogram
+    tttr    rows, grid and histogram
+    phed    rows, grid and chunked
+    sweep   phed_sweep.py at the phed_calc.py defaults, against rows
+    blocks  run_measures.py in several TMC blocks, against one block
+Engines reading float32 travel times agree with the others to float32
+precision; sums agree up to summation order.
+
+Usage:
+>>>python -m pytest -q test_engines.py
+"""
+
+import numpy as np
+import pandas as pd
+import lottr_calc
+import lottr_truck
+import phed_calc
+from npmrds_io import read_npmrds
+from npmrds_schema import measure_columns, table_columns
+from npmrds_store import ensure_store, read_cached, store_months
+from periods import LOTTR_PERIODS, TTTR_PERIODS, period_codes
+from phed_chunks import chunked_phed
+from phed_sweep import DelayCurves, scenario_grid, sweep_phed
+from run_measures import GRID_CELL_BYTES, run_measures
+from tmc_dim import TmcDim
+from tt_cube import cached_cube, cube_period_ttr
+from tt_grid import (grid_period_ttr, grid_start, read_grid, truck_fallback,
+                     truck_missing_rows)
+from tt_hist import file_histogram
+
+
+# float32 travel times
+RTOL = 1e-6
+
+
+def sorted_table(df, columns):
+    """Returns the columns of a per-TMC table sorted by tmc_code."""
+    df = df.assign(tmc_code=df['tmc_code'].astype(str))
+    return df.sort_values('tmc_code')[['tmc_code'] + columns].reset_index(
+        drop=True)
+
+
+def assert_tables_close(df, df_expected, columns, rtol=RTOL):
+    """Asserts two per-TMC tables have the same TMCs and close values."""
+    df = sorted_table(df, columns)
+    df_expected = sorted_table(df_expected, columns)
+    assert df['tmc_code'].tolist() == df_expected['tmc_code'].tolist()
+    np.testing.assert_allclose(df[columns].values.astype(np.float64),
+                               df_expected[columns].values.astype(np.float64),
+                               rtol=rtol)
+
+
+def grids(paths, tmcs):
+    """Loads the all vehicle and Truck grids of a set of TMCs."""
+    months = sorted(set(store_months(paths['all_store']))
+                    & set(store_months(paths['truck_store'])))
+    dim = TmcDim(tmcs)
+    all_tt, present = read_grid(paths['all_store'], dim, months)
+    truck, truck_present = read_grid(paths['truck_store'], dim, months)
+    return dim, grid_start(months), all_tt, present, truck, truck_present
+
+
+def lottr_rows(paths, refs):
+    df = read_cached([paths['all']], paths['all_store'],
+                     columns=measure_columns('lottr'), hours=range(6, 20),
+                     tmcs=refs['urban']['Tmc'])
+    df = df.dropna(subset=['travel_time_seconds'])
+    return lottr_calc.agg_travel_times(df)
+
+
+def tttr_rows(truck_path, truck_store, all_path, all_store, refs):
+    df = read_cached([truck_path], truck_store,
+                     columns=measure_columns('tttr'),
+                     tmcs=refs['urban']['Tmc'])
+    df2 = read_cached([all_path], all_store, columns=measure_columns('tttr'),
+                      tmcs=refs['urban']['Tmc'])
+    return lottr_truck.agg_travel_times(lottr_truck.fill_truck_times(df, df2))
+
+
+def tttr_grid(truck_store, all_store, refs):
+    paths = {'all_store': all_store, 'truck_store': truck_store}
+    dim, start, all_tt, present, truck, truck_present = grids(
+        paths, refs['urban']['Tmc'])
+    grid, available = truck_fallback(
+        truck, all_tt, present, truck_missing_rows(truck, truck_present).any())
+    return grid_period_ttr(grid, dim, start, TTTR_PERIODS, 95, available)
+
+
+def test_lottr_engines(data, tmp_path):
+    paths, refs = data
+    codes = period_codes(LOTTR_PERIODS)
+    df_rows = lottr_rows(paths, refs)
+
+    dim, start, all_tt, _, _, _ = grids(paths, refs['urban']['Tmc'])
+    df_grid = grid_period_ttr(all_tt, dim, start, LOTTR_PERIODS, 80)
+    assert_tables_close(df_grid, df_rows, codes)
+
+    cube = cached_cube(str(tmp_path / 'all.cube'), [paths['all']],
+                       paths['all_store'], refs['urban']['Tmc'])
+    assert_tables_close(cube_period_ttr(cube, LOTTR_PERIODS, 80), df_rows,
+                        codes)
+
+    hist = file_histogram(paths['all'], LOTTR_PERIODS, hours=range(6, 20))
+    df_hist = lottr_calc.hist_travel_times([hist], refs['urban']['Tmc'])
+    assert_tables_close(df_hist, df_rows, codes)
+
+
+def tttr_hist(truck_path, all_path, refs):
+    hist = lottr_truck.quarter_histogram(truck_path, all_path)
+    return lottr_truck.hist_travel_times([hist], refs['urban']['Tmc'])
+
+
+def test_tttr_engines(data):
+    paths, refs = data
+    codes = period_codes(TTTR_PERIODS)
+    df_rows = tttr_rows(paths['truck'], paths['truck_store'], paths['all'],
+                        paths['all_store'], refs)
+    df_grid = tttr_grid(paths['truck_store'], paths['all_store'], refs)
+    assert_tables_close(df_grid, df_rows, codes)
+    df_hist = tttr_hist(paths['truck'], paths['all'], refs)
+    assert_tables_close(df_hist, df_rows, codes)
+
+
+def blank_travel_times(path, store_tmp, name, seed):
+    """Copies a csv file and its store with 0.1% of travel times blanked."""
+    df = pd.read_csv(path)
+    rs = np.random.RandomState(seed)
+    df.loc[rs.rand(len(df)) < .001, 'travel_time_seconds'] = np.nan
+    csv_path = str(store_tmp / (name + '.csv'))
+    store_path = str(store_tmp / (name + '.h5'))
+    df.to_csv(csv_path, index=False)
+    ensure_store([csv_path], store_path)
+    return csv_path, store_path
+
+
+def test_tttr_engines_missing_travel_times(data, tmp_path):
+    """All vehicle readings with a missing travel time are kept when no
+    Truck reading has one, by every engine."""
+    paths, refs = data
+    all_path, all_store = blank_travel_times(paths['all'], tmp_path,
+                                             'all_missing', 1)
+
+    df_rows = tttr_rows(paths['truck'], paths['truck_store'], all_path,
+                        all_store, refs)
+    df_grid = tttr_grid(paths['truck_store'], all_store, refs)
+    codes = period_codes(TTTR_PERIODS)
+    assert np.isnan(df_rows[codes].values).any()
+    assert_tables_close(df_grid, df_rows, codes)
+    df_hist = tttr_hist(paths['truck'], all_path, refs)
+    assert_tables_close(df_hist, df_rows, codes)
+
+
+def test_tttr_engines_missing_truck_travel_times(data, tmp_path):
+    """All vehicle readings with a missing travel time are dropped when a
+    Truck reading has one, by every engine."""
+    paths, refs = data
+    all_path, all_store = blank_travel_times(paths['all'], tmp_path,
+                                             'all_missing', 1)
+    truck_path, truck_store = blank_travel_times(paths['truck'], tmp_path,
+                                                 'truck_missing', 2)
+
+    df_rows = tttr_rows(truck_path, truck_store, all_path, all_store, refs)
+    df_grid = tttr_grid(truck_store, all_store, refs)
+    codes = period_codes(TTTR_PERIODS)
+    assert not np.isnan(df_rows[codes].values).any()
+    assert_tables_close(df_grid, df_rows, codes)
+    df_hist = tttr_hist(truck_path, all_path, refs)
+    assert_tables_close(df_hist, df_rows, codes)
+
+
+def phed_readings(paths, refs):
+    """Reads the weekday peak hour readings and PHED dimension."""
+    dim = phed_calc.phed_dim(refs['phed_urban'], refs['phed_meta'],
+                             refs['here'])
+    df = read_npmrds(paths['all'], usecols=table_columns('npmrds', 'phed'),
+                     hours=phed_calc.PEAK_HOURS, dates=phed_calc.PEAK_DAYS,
+                     tmcs=refs['phed_urban']['Tmc'])
+    return df, dim
+
+
+def test_phed_engines(data):
+    paths, refs = data
+    df, dim = phed_readings(paths, refs)
+    df_rows = phed_calc.TED_summation(
+        phed_calc.calc_ted_seg(df, dim, refs['peak']))
+    phed_rows = phed_calc.per_capita_TED(df_rows['TED'].sum())
+
+    grid_dim, start, all_tt, present, _, _ = grids(
+        paths, refs['phed_urban']['Tmc'])
+    df_grid = phed_calc.TED_summation(phed_calc.grid_ted_seg(
+        all_tt, grid_dim, start, dim, refs['peak'], present))
+    assert_tables_close(df_grid, df_rows, ['TED_seg', 'TED'], rtol=1e-12)
+    np.testing.assert_allclose(
+        phed_calc.per_capita_TED(df_grid['TED'].sum()), phed_rows,
+        rtol=1e-12)
+
+    df_chunked, phed_chunked = chunked_phed([paths['all']], dim,
+                                            refs['peak'], workers=1,
+                                            chunksize=20000)
+    assert_tables_close(df_chunked, df_rows, ['TED_seg', 'TED'], rtol=1e-12)
+    np.testing.assert_allclose(phed_chunked, phed_rows, rtol=1e-12)
+
+
+def test_phed_sweep_defaults(data):
+    """The sweep rounds ED as calc_ted_seg() does, so its default scenario
+    reproduces the row engine."""
+    paths, refs = data
+    df, dim = phed_readings(paths, refs)
+    df_rows = phed_calc.TED_summation(
+        phed_calc.calc_ted_seg(df, dim, refs['peak']))
+
+    curves = DelayCurves(df, dim, refs['peak'])
+    assert_tables_close(curves.ted_seg_table(), df_rows, ['TED_seg'],
+                        rtol=1e-12)
+    df_scenarios = sweep_phed(curves, scenario_grid(
+        threshold_factor=[phed_calc.THRESHOLD_FACTOR, .65]))
+    np.testing.assert_allclose(df_scenarios['TED'].iloc[0],
+                               df_rows['TED'].sum(), rtol=1e-12)
+
+
+def test_run_measures_blocks(data):
+    """Splitting the TMCs into blocks gives the same per-TMC tables and
+    summary results."""
+    paths, refs = data
+    args = ([paths['all']], paths['all_store'], [paths['truck']],
+            paths['truck_store'], refs)
+    results = run_measures(*args)
+    # 10 TMCs of January per block
+    blocked = run_measures(*args,
+                           max_grid_bytes=10 * 31 * 96 * GRID_CELL_BYTES)
+    for name in ['lottr', 'tttr', 'phed']:
+        pd.testing.assert_frame_equal(
+            blocked[name][0].reset_index(drop=True),
+            results[name][0].reset_index(drop=True))
+        np.testing.assert_allclose(np.ravel(blocked[name][1]),
+                                   np.ravel(results[name][1]), rtol=1e-12)
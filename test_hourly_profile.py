@@ -0,0 +1,52 @@
+"""
+test_hourly_profile.py
+
+Checks the one-pass hourly profile against per-hour groupby statistics, as
+the INRIX May scripts computed them.
+
+Usage:
+>>>python -m pytest -q test_hourly_profile.py
+"""
+
+import numpy as np
+import pandas as pd
+from calendar_keys import add_calendar_keys
+from hourly_profile import MAY_MIDWEEK, hourly_profile
+
+
+def readings():
+    rs = np.random.RandomState(0)
+    tstamps = pd.date_range('2017-05-01', '2017-05-31 23:45', freq='15min')
+    df = pd.DataFrame({
+        'tmc_code': np.repeat(['114+04100', '114+04101', '114P04102'],
+                              len(tstamps)),
+        'measurement_tstamp': np.tile(tstamps, 3),
+        'travel_time_seconds': rs.lognormal(4, .4, 3 * len(tstamps))})
+    df.loc[rs.rand(len(df)) < .02, 'travel_time_seconds'] = np.nan
+    return add_calendar_keys(df)
+
+
+def test_hourly_profile():
+    df = readings()
+    df_profile = hourly_profile(
+        df, [('min', 'hour_{0}_min'), ('mean', 'hour_{0}_mean'),
+             (95, 'hour_{0}_95th_pct')], tmcs=['114+04100', '114P04102'],
+        dates=MAY_MIDWEEK)
+    assert df_profile['tmc_code'].tolist() == ['114+04100', '114P04102']
+
+    df = df[df['tmc_code'].isin(['114+04100', '114P04102'])
+            & MAY_MIDWEEK.mask(df)]
+    for hour in [0, 8, 17]:
+        df_hour = df[df['hour'] == hour].groupby('tmc_code')
+        np.testing.assert_allclose(
+            df_profile['hour_{0}_min'.format(hour)],
+            df_hour['travel_time_seconds'].min(), rtol=1e-12)
+        np.testing.assert_allclose(
+            df_profile['hour_{0}_mean'.format(hour)],
+            df_hour['travel_time_seconds'].mean(), rtol=1e-12)
+        # np.percentile, as inrix_may_filter_pctile.py took it: NaN for
+        # an hour with a missing reading
+        np.testing.assert_allclose(
+            df_profile['hour_{0}_95th_pct'.format(hour)],
+            df_hour['travel_time_seconds'].agg(
+                lambda x: np.percentile(x, 95)), rtol=1e-12)
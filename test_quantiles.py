@@ -0,0 +1,48 @@
+"""
+test_quantiles.py
+
+Checks the grouped percentiles against np.percentile.
+
+Usage:
+>>>python -m pytest -q test_quantiles.py
+"""
+
+import numpy as np
+import pandas as pd
+from quantiles import counts_percentiles, grouped_percentiles
+
+
+PCTS = [5, 50, 80, 95]
+
+
+def expected_percentiles(df, value_col):
+    """Returns np.percentile of every group, one row per group."""
+    return np.array([np.percentile(group[value_col].values, PCTS)
+                     for _, group in df.groupby('g')])
+
+
+def test_grouped_percentiles():
+    rs = np.random.RandomState(0)
+    df = pd.DataFrame({'g': rs.randint(0, 20, 2000),
+                       'tt': rs.gamma(2, 30, 2000)})
+    # a group holding a missing value gets NaN, as np.percentile does
+    df.loc[df['g'] == 3, 'tt'] = np.nan
+    df_pct = grouped_percentiles(df, 'g', 'tt', PCTS)
+    assert df_pct['g'].tolist() == sorted(df['g'].unique())
+    np.testing.assert_allclose(
+        df_pct[['{0}_pct'.format(pct) for pct in PCTS]].values,
+        expected_percentiles(df, 'tt'), rtol=1e-12)
+    assert df_pct.loc[df_pct['g'] == 3, '50_pct'].isna().all()
+
+
+def test_counts_percentiles():
+    rs = np.random.RandomState(1)
+    df = pd.DataFrame({'g': rs.randint(0, 10, 300),
+                       'tt': rs.randint(20, 40, 300).astype(float)})
+    df = df.drop_duplicates(['g', 'tt'])
+    df['n'] = rs.randint(1, 5, len(df))
+    df_pct = counts_percentiles(df, 'g', 'tt', 'n', PCTS)
+    df_expanded = df.loc[df.index.repeat(df['n'])]
+    np.testing.assert_allclose(
+        df_pct[['{0}_pct'.format(pct) for pct in PCTS]].values,
+        expected_percentiles(df_expanded, 'tt'), rtol=1e-12)
@@ -0,0 +1,54 @@
+"""
+test_reference_cache.py
+
+Checks that cached reference tables follow changes to their csv files.
+
+Usage:
+>>>python -m pytest -q test_reference_cache.py
+"""
+
+import os
+from reference_cache import clear_cache, load_reference
+
+
+def write_network(path, tmcs):
+    with open(path, 'w') as f:
+        f.write('Tmc,interstate\n')
+        for tmc, interstate in tmcs:
+            f.write('{0},{1}\n'.format(tmc, interstate))
+
+
+def test_reference_cache_invalidation(tmp_path):
+    path = str(tmp_path / 'network.csv')
+    cache_dir = str(tmp_path / 'cache')
+    write_network(path, [('114+04100', 1), ('114+04101', 0)])
+    df = load_reference('network', 'lottr', path=path, cache_dir=cache_dir)
+    assert df['Tmc'].tolist() == ['114+04100', '114+04101']
+    assert len(os.listdir(cache_dir)) == 2
+
+    # a cache hit reads the same table back
+    df_cached = load_reference('network', 'lottr', path=path,
+                               cache_dir=cache_dir)
+    assert df_cached.equals(df)
+
+    # new contents are parsed again
+    write_network(path, [('114+04100', 1), ('114+04101', 0),
+                         ('114P04102', 0)])
+    df = load_reference('network', 'lottr', path=path, cache_dir=cache_dir)
+    assert df['Tmc'].tolist() == ['114+04100', '114+04101', '114P04102']
+
+    # a touched file with unchanged contents reuses its parsed table
+    os.utime(path, (0, 0))
+    df_touched = load_reference('network', 'lottr', path=path,
+                                cache_dir=cache_dir)
+    assert df_touched.equals(df)
+    assert len([name for name in os.listdir(cache_dir)
+                if name.endswith('.pkl')]) == 2
+
+    # each column set is cached apart
+    df_tmcs = load_reference('network', 'phed', path=path,
+                             cache_dir=cache_dir)
+    assert df_tmcs.columns.tolist() == ['Tmc']
+
+    clear_cache(cache_dir)
+    assert os.listdir(cache_dir) == []
@@ -0,0 +1,50 @@
+"""
+test_region_batch.py
+
+Checks the TMC x region bitmask and the per-region interstate flags.
+
+Usage:
+>>>python -m pytest -q test_region_batch.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from region_batch import (region_dim, region_interstate, region_mask,
+                          union_network)
+
+
+TMCS = ['114+{0:05d}'.format(tmc) for tmc in range(30)]
+
+
+def networks():
+    return [pd.DataFrame({'Tmc': TMCS[:20], 'interstate': [1, 0] * 10}),
+            pd.DataFrame({'Tmc': TMCS[12:28], 'interstate': [0, 1] * 8}),
+            pd.DataFrame({'Tmc': TMCS[25:]})]
+
+
+def test_region_mask():
+    nets = networks()
+    dim = region_dim(nets)
+    assert len(union_network(nets)) == len(TMCS)
+    # codes outside every network, and repeated codes
+    tmc_codes = pd.Series(TMCS + ['114-99999'] + TMCS[:3])
+    for region, df_net in enumerate(nets):
+        np.testing.assert_array_equal(
+            region_mask(dim, region, tmc_codes),
+            tmc_codes.isin(df_net['Tmc']).values)
+
+
+def test_region_interstate():
+    nets = networks()
+    # each network's own flags, though the first two disagree
+    assert region_interstate(nets, 0).tolist() == [1, 0] * 10
+    assert region_interstate(nets, 1).tolist() == [0, 1] * 8
+
+    # a TMC list takes the other networks' flags, 0 where none flag it
+    nets[2] = pd.DataFrame({'Tmc': TMCS[:3] + TMCS[28:]})
+    assert region_interstate(nets, 2).tolist() == [1, 0, 1, 0, 0]
+
+    nets[2] = pd.DataFrame({'Tmc': TMCS[12:14]})
+    with pytest.raises(ValueError):
+        region_interstate(nets, 2)
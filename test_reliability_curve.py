@@ -0,0 +1,42 @@
+"""
+test_reliability_curve.py
+
+Checks the reliability curve at the LOTTR threshold against
+calc_pct_reliability().
+
+Usage:
+>>>python -m pytest -q test_reliability_curve.py
+"""
+
+import numpy as np
+import pandas as pd
+from lottr_calc import (RELIABLE_THRESHOLD, calc_pct_reliability,
+                        check_reliable, worst_period)
+from periods import LOTTR_PERIODS, period_codes
+from reliability_curve import ReliabilityCurve
+
+
+def lottr_table(n_tmcs=200):
+    rs = np.random.RandomState(0)
+    codes = period_codes(LOTTR_PERIODS)
+    df = pd.DataFrame(np.round(rs.uniform(1, 2, (n_tmcs, len(codes))), 2),
+                      columns=codes)
+    # missing periods are never reliable; ties at the threshold are not
+    # reliable either
+    df.iloc[::17, 1] = np.nan
+    df.iloc[::13, 2] = RELIABLE_THRESHOLD
+    df['tmc_code'] = ['114+{0:05d}'.format(tmc) for tmc in range(n_tmcs)]
+    df['interstate'] = rs.choice([0, 1], n_tmcs)
+    df['ttr'] = rs.uniform(1e3, 1e5, n_tmcs)
+    return worst_period(check_reliable(df))
+
+
+def test_curve_at_threshold():
+    df = lottr_table()
+    expected = calc_pct_reliability(df)
+    for df_lottr in [df, df.drop(columns=['lottr_max'])]:
+        df_curve = ReliabilityCurve(df_lottr).pct_reliable(
+            [1.2, RELIABLE_THRESHOLD])
+        df_curve = df_curve[df_curve['threshold'] == RELIABLE_THRESHOLD]
+        pct = df_curve.set_index('interstate')['pct_reliable']
+        np.testing.assert_allclose([pct[1], pct[0]], expected, rtol=1e-12)
@@ -0,0 +1,39 @@
+"""
+test_tmc_shards.py
+
+Checks that the process-pool LOTTR matches the serial path.
+
+Usage:
+>>>python -m pytest -q test_tmc_shards.py
+"""
+
+import numpy as np
+import pandas as pd
+from periods import LOTTR_PERIODS, assign_period
+from tmc_shards import parallel_period_ttr, split_shards
+
+
+def readings(n_tmcs=40, n_days=14):
+    rs = np.random.RandomState(0)
+    tstamps = pd.date_range('2019-03-01', periods=n_days * 96, freq='15min')
+    df = pd.DataFrame({
+        'tmc_code': np.repeat(['114+{0:05d}'.format(tmc)
+                               for tmc in range(n_tmcs)], len(tstamps)),
+        'measurement_tstamp': np.tile(tstamps, n_tmcs),
+        'travel_time_seconds': rs.lognormal(4, .4, n_tmcs * len(tstamps))})
+    df.loc[rs.rand(len(df)) < .01, 'travel_time_seconds'] = np.nan
+    return assign_period(df, LOTTR_PERIODS)
+
+
+def test_shards_cover_every_reading():
+    df = readings()
+    shards = split_shards(df, 4)
+    assert sum(len(shard) for shard in shards) == len(df)
+    # a TMC's readings stay in one shard
+    assert sum(shard['tmc_code'].nunique() for shard in shards) == 40
+
+
+def test_parallel_matches_serial():
+    df = readings()
+    pd.testing.assert_frame_equal(parallel_period_ttr(df, 80, workers=3),
+                                  parallel_period_ttr(df, 80, workers=1))
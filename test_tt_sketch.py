@@ -0,0 +1,43 @@
+"""
+test_tt_sketch.py
+
+Checks the sketch percentiles against the exact ones, within the sketch's
+relative error bound.
+
+Usage:
+>>>python -m pytest -q test_tt_sketch.py
+"""
+
+import numpy as np
+import pandas as pd
+from tt_sketch import build_sketch, merge_sketches, sketch_percentiles
+
+
+REL_ERROR = 0.01
+
+
+def readings(seed, n=5000):
+    rs = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'tmc_code': rs.choice(['114+04100', '114+04101', '114P04102'], n),
+        'period': rs.choice(['MF_6_9', 'SATSUN_6_19'], n),
+        'travel_time_seconds': rs.lognormal(4, .5, n)})
+
+
+def test_sketch_error_bound():
+    chunks = [readings(seed) for seed in range(3)]
+    df = pd.concat(chunks, ignore_index=True)
+    df_sketch = merge_sketches([build_sketch(chunk, REL_ERROR)
+                                for chunk in chunks])
+    df_pct = sketch_percentiles(df_sketch, REL_ERROR, [50, 80, 95])
+
+    df_exact = df.groupby(['tmc_code', 'period'])['travel_time_seconds']
+    for _, row in df_pct.iterrows():
+        values = df_exact.get_group((row['tmc_code'], row['period']))
+        for pct in [50, 80, 95]:
+            exact = np.percentile(values, pct)
+            approx = row['{0}_pct'.format(pct)]
+            assert abs(approx - exact) <= REL_ERROR * exact
+
+    # the merged sketch counts every reading once
+    assert df_sketch['count'].sum() == len(df)
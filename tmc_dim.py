@@ -0,0 +1,145 @@
+"""
+tmc_dim.py
+
+TMC dimension table.
+
+Maps tmc_code to a dense int32 position once, and holds per-TMC attributes
+from the small reference tables (network files, TMC_Identification, HERE
+speed limits) in arrays aligned to those positions. Travel time rows then
+only need their TMC position: attributes are gathered by array indexing
+when a calculation needs them, and network membership is a boolean mask
+lookup, instead of merging every reference table into the big frame on
+string keys (and dropping the key_0 column each merge leaves behind).
+
+Usage:
+>>>from tmc_dim import TmcDim
+>>>dim = TmcDim(df_meta['tmc'])
+>>>dim.add_table(df_meta, 'tmc', ['miles', 'aadt'])
+>>>dim.add_table(df_urban, 'Tmc', ['interstate'], name='urban')
+>>>df = df[dim.isin('urban', df['tmc_code'])]
+>>>miles = dim.gather('miles', dim.positions(df['tmc_code']))
+"""
+
+import pandas as pd
+import numpy as np
+from profiling import profiled
+
+
+class TmcDim:
+
+    def __init__(self, tmc_codes):
+        """Creates the dimension over a set of TMC codes.
+        Args: tmc_codes, a collection of TMC codes (duplicates allowed).
+        """
+        codes = pd.unique(np.asarray(tmc_codes).astype(str))
+        self.tmcs = pd.Index(np.sort(codes))
+        self.attrs = {}
+
+    def __len__(self):
+        return len(self.tmcs)
+
+    def positions(self, tmc_codes):
+        """Returns the int32 position of each TMC code (-1 if unknown).
+        Args: tmc_codes, a pandas series of TMC codes, possibly categorical.
+        """
+        tmc_codes = pd.Series(tmc_codes)
+        if isinstance(tmc_codes.dtype, pd.CategoricalDtype):
+            # look up each category once
+            lookup = self.tmcs.get_indexer(
+                tmc_codes.cat.categories.astype(str))
+            codes = tmc_codes.cat.codes.values
+            positions = np.where(codes >= 0, lookup[codes], -1)
+        else:
+            positions = self.tmcs.get_indexer(tmc_codes.astype(str))
+        return positions.astype(np.int32)
+
+    def add_table(self, df_ref, key_col, columns=(), name=None):
+        """Aligns reference table columns to the TMC positions.
+        TMCs missing from the table get NaN; table rows for TMCs outside the
+        dimension are ignored.
+        Args: df_ref, a pandas dataframe with one row per TMC.
+              key_col, the table's TMC code column.
+              columns, the attribute columns to keep.
+              name, optional name of a membership mask to record: True
+                    for the TMCs listed in the table, see isin().
+        """
+        columns = list(columns)
+        df_ref = df_ref.drop_duplicates(subset=[key_col] + columns)
+        if df_ref[key_col].duplicated().any():
+            raise ValueError(
+                "Conflicting rows for the same TMC in '{0}'".format(key_col))
+
+        positions = self.positions(df_ref[key_col])
+        known = positions >= 0
+        positions = positions[known]
+        for col in columns:
+            values = df_ref[col].values[known]
+            if values.dtype.kind in 'biuf':
+                values = values.astype(np.float64)
+                column = np.full(len(self), np.nan)
+            else:
+                column = np.full(len(self), np.nan, dtype=object)
+            column[positions] = values
+            self.attrs[col] = column
+
+        if name is not None:
+            mask = np.zeros(len(self), dtype=bool)
+            mask[positions] = True
+            self.attrs[name] = mask
+
+    def gather(self, column, positions):
+        """Gathers an attribute for TMC positions (NaN/False for -1).
+        Args: column, an attribute or membership mask name.
+              positions, an array of TMC positions.
+        Returns: a numpy array aligned to positions.
+        """
+        values = self.attrs[column]
+        fill = False if values.dtype == bool else np.nan
+        return np.where(positions >= 0, values[positions], fill)
+
+    def isin(self, name, tmc_codes):
+        """Returns a boolean mask of the TMC codes in a membership mask."""
+        return self.gather(name, self.positions(tmc_codes)).astype(bool)
+
+    def frame(self, columns, mask=None):
+        """Returns a one row per TMC dataframe of tmc_code and attributes.
+        Args: columns, a list of attribute names.
+              mask, optional membership mask name to keep TMCs by.
+        """
+        df = pd.DataFrame({'tmc_code': self.tmcs.values})
+        for col in columns:
+            df[col] = self.attrs[col]
+        if mask is not None:
+            df = df[self.attrs[mask]].reset_index(drop=True)
+        return df
+
+    @profiled
+    def attach(self, df, columns):
+        """Adds attribute columns to a dataframe by its tmc_code column.
+        Args: df, a pandas dataframe with a tmc_code column.
+              columns, a list of attribute names.
+        Returns: df, a copy of df with the new columns.
+        """
+        positions = self.positions(df['tmc_code'])
+        df = df.copy()
+        for col in columns:
+            df[col] = self.gather(col, positions)
+        return df
+
+
+@profiled
+def network_dim(df_urban, df_meta):
+    """Builds the dimension of a Metro network file and TMC metadata table.
+    Args: df_urban, the network table ('Tmc', optional 'interstate').
+          df_meta, the TMC metadata table ('tmc', ...).
+    Returns: dim, a TmcDim over both tables' TMCs with the metadata and
+             interstate columns as attributes, and membership masks 'urban'
+             (in the network) and 'meta' (in the metadata).
+    """
+    dim = TmcDim(pd.concat([df_urban['Tmc'].astype(str),
+                            df_meta['tmc'].astype(str)]))
+    dim.add_table(df_urban, 'Tmc', [col for col in df_urban.columns
+                                    if col != 'Tmc'], name='urban')
+    dim.add_table(df_meta, 'tmc', [col for col in df_meta.columns
+                                   if col != 'tmc'], name='meta')
+    return dim
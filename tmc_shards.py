@@ -0,0 +1,77 @@
+"""
+tmc_shards.py
+
+Process-pool LOTTR/TTTR, sharded by TMC.
+
+Each TMC's percentiles are independent, so readings are split into shards
+by a hash of tmc_code, every shard is aggregated in its own worker process
+with periods.calc_period_ttr(), and the per-TMC tables are concatenated.
+Results are identical to the serial path, row order included.
+
+Usage:
+>>>from tmc_shards import parallel_period_ttr
+>>>df = assign_period(df, LOTTR_PERIODS)
+>>>df_lottr = parallel_period_ttr(df, 80, workers=8)
+"""
+
+import os
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from periods import calc_period_ttr
+from profiling import profiled
+
+
+def default_workers():
+    """Returns the number of CPUs available."""
+    return os.cpu_count() or 1
+
+
+def shard_ids(tmc_codes, n_shards):
+    """Assigns TMCs to shards by hashing their codes.
+    Args: tmc_codes, a pandas series of TMC codes.
+          n_shards, the number of shards.
+    Returns: an int64 array of shard numbers, 0 to n_shards - 1.
+    """
+    codes = tmc_codes.astype(str).values
+    hashes = pd.util.hash_array(codes.astype(object), categorize=True)
+    return (hashes % np.uint64(n_shards)).astype(np.int64)
+
+
+def split_shards(df, n_shards):
+    """Splits readings into per-shard dataframes, dropping empty shards."""
+    shards = shard_ids(df['tmc_code'], n_shards)
+    order = np.argsort(shards, kind='mergesort')
+    bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+    return [df.iloc[order[start:stop]]
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+@profiled
+def parallel_period_ttr(df, upper_pct, workers=None,
+                        value_col='travel_time_seconds'):
+    """Calculates travel time reliability for every TMC and time period in
+    a pool of worker processes.
+    Args: df, a pandas dataframe with 'tmc_code' and 'period' columns.
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+          workers, the number of worker processes (default: all CPUs);
+                   1 runs serially in this process.
+          value_col, the travel time column.
+    Returns: df_ttr, see periods.calc_period_ttr().
+    """
+    if workers is None:
+        workers = default_workers()
+    if workers <= 1:
+        return calc_period_ttr(df, upper_pct, value_col)
+
+    df = df[['tmc_code', 'period', value_col]]
+    shards = split_shards(df, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tables = list(pool.map(calc_period_ttr, shards,
+                               [upper_pct] * len(shards),
+                               [value_col] * len(shards)))
+
+    # put TMCs back in the serial path's (sorted) order
+    df_ttr = pd.concat(tables, ignore_index=True, sort=False)
+    df_ttr = df_ttr.sort_values('tmc_code', kind='mergesort')
+    return df_ttr.reset_index(drop=True)
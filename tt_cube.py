@@ -0,0 +1,196 @@
+"""
+tt_cube.py
+
+Memory-mapped TMC x day x 15-minute epoch travel time cube.
+
+Every measure here is a function of travel time by TMC, date and time of
+day, so the cube holds one float32 per (TMC, day, epoch of day), NaN where
+there is no reading, in a raw file opened with np.memmap. A JSON sidecar
+(<cube>.json) records the TMC codes (cube rows, sorted) and the first date.
+The cube is built once from the NPMRDS store, opens instantly, and several
+processes reading it share the same pages through the OS page cache.
+
+Time periods become slices: days are picked by weekday and epochs by hour,
+e.g. weekday days x epochs 24-39 for 6am - 10am, and only the selected cells
+are read from the file. A year of 1,000 TMCs is 1,000 x 365 x 96 x 4 bytes,
+about 140 MB.
+
+Only LOTTR reads the cube (lottr_calc.py, engine = 'cube'); TTTR, PHED and
+the INRIX scripts read rows or the tt_grid.py grids.
+
+Usage:
+>>>from tt_cube import cached_cube, cube_period_ttr
+>>>cube = cached_cube('lottr.cube', paths, store_path, df_urban['Tmc'])
+>>>df_lottr = cube_period_ttr(cube, LOTTR_PERIODS, 80)
+>>>values = cube.select(weekdays=[0, 1, 2, 3, 4], hours=range(6, 10))
+"""
+
+import os
+import json
+import pandas as pd
+import numpy as np
+from npmrds_store import ensure_store, iter_store, store_months
+from periods import period_codes
+from profiling import profiled
+from tmc_dim import TmcDim
+from tt_grid import grid_epochs, grid_start, row_percentiles
+
+
+EPOCHS_PER_DAY = 96
+MINUTES_PER_EPOCH = 15
+
+
+def index_path(cube_path):
+    """Returns the path of a cube's sidecar index."""
+    return cube_path + '.json'
+
+
+class TtCube:
+
+    def __init__(self, cube_path):
+        """Opens a cube read-only.
+        Args: cube_path, the cube file, see build_cube().
+        """
+        with open(index_path(cube_path)) as f:
+            index = json.load(f)
+        self.dim = TmcDim(index['tmcs'])
+        self.dates = pd.date_range(index['start'], periods=index['n_days'],
+                                   freq='D')
+        self.data = np.memmap(cube_path, dtype=np.float32, mode='r',
+                              shape=(len(self.dim), len(self.dates),
+                                     EPOCHS_PER_DAY))
+
+    def days(self, weekdays=None):
+        """Returns the day positions of the given weekdays (0 = Monday)."""
+        if weekdays is None:
+            return np.arange(len(self.dates))
+        return np.flatnonzero(np.isin(self.dates.weekday, list(weekdays)))
+
+    def slices(self, weekdays=None, hours=None, tmcs=None):
+        """Returns the TMC, day and epoch positions of a slice.
+        Args: weekdays, optional list of weekdays to keep (0 = Monday).
+              hours, optional list of hours of day to keep.
+              tmcs, optional collection of TMC codes to keep.
+        """
+        rows = np.arange(len(self.dim))
+        if tmcs is not None:
+            rows = self.dim.positions(pd.Series(tmcs))
+            rows = np.unique(rows[rows >= 0])
+        epochs = np.arange(EPOCHS_PER_DAY)
+        if hours is not None:
+            epochs = epochs[np.isin(epochs // 4, list(hours))]
+        return rows, self.days(weekdays), epochs
+
+    def select(self, weekdays=None, hours=None, tmcs=None):
+        """Slices travel times by weekday, hour of day and TMC.
+        Args: see slices().
+        Returns: a float32 array (n_tmc x n_days x n_epochs), NaN where
+                 there is no reading.
+        """
+        rows, days, epochs = self.slices(weekdays, hours, tmcs)
+        return self.data[np.ix_(rows, days, epochs)]
+
+    def to_frame(self, weekdays=None, hours=None, tmcs=None):
+        """Returns the readings of a slice as NPMRDS-style rows.
+        Args: see slices().
+        Returns: df, a pandas dataframe with tmc_code, measurement_tstamp and
+                 travel_time_seconds columns, one row per reading.
+        """
+        rows, days, epochs = self.slices(weekdays, hours, tmcs)
+        values = self.data[np.ix_(rows, days, epochs)]
+        tmc, day, epoch = np.nonzero(~np.isnan(values))
+        minutes = epochs[epoch] * MINUTES_PER_EPOCH
+        tstamp = (self.dates.values[days[day]]
+                  + minutes.astype('timedelta64[m]'))
+        return pd.DataFrame({
+            'tmc_code': pd.Categorical.from_codes(
+                rows[tmc], categories=self.dim.tmcs),
+            'measurement_tstamp': tstamp,
+            'travel_time_seconds': values[tmc, day, epoch]})
+
+
+@profiled
+def build_cube(cube_path, store_path, tmcs, months=None,
+               value_col='travel_time_seconds'):
+    """Builds a cube from an NPMRDS store, one month at a time.
+    Args: cube_path, the cube file to write (overwritten).
+          store_path, the HDF5 store, see npmrds_store.py.
+          tmcs, the TMC codes to keep.
+          months, optional sorted list of (year, month) partitions (default:
+                  all of the store's).
+          value_col, the travel time column.
+    """
+    if months is None:
+        months = store_months(store_path)
+    dim = TmcDim(tmcs)
+    start = grid_start(months)
+    n_days = grid_epochs(months) // EPOCHS_PER_DAY
+
+    data = np.memmap(cube_path, dtype=np.float32, mode='w+',
+                     shape=(len(dim), n_days, EPOCHS_PER_DAY))
+    data[:] = np.nan
+    start_minute = np.datetime64(start, 'm').astype(np.int64)
+    for chunk in iter_store(store_path, columns=[value_col], months=months,
+                            tmcs=dim.tmcs):
+        rows = dim.positions(chunk['tmc_code'])
+        minutes = (chunk['measurement_tstamp'].values.astype('datetime64[m]')
+                   .astype(np.int64) - start_minute)
+        day, minute = np.divmod(minutes, 24 * 60)
+        keep = (rows >= 0) & (day >= 0) & (day < n_days)
+        data[rows[keep], day[keep], minute[keep] // MINUTES_PER_EPOCH] = (
+            chunk[value_col].values[keep])
+    data.flush()
+    del data
+
+    with open(index_path(cube_path), 'w') as f:
+        json.dump({'tmcs': list(dim.tmcs), 'start': str(start.date()),
+                   'n_days': int(n_days)}, f)
+
+
+def cube_is_current(cube_path, store_path, tmcs):
+    """Checks that a cube exists, is newer than its store and holds the
+    given TMCs."""
+    if not os.path.exists(cube_path) or not os.path.exists(
+            index_path(cube_path)):
+        return False
+    if os.path.getmtime(cube_path) < os.path.getmtime(store_path):
+        return False
+    with open(index_path(cube_path)) as f:
+        index = json.load(f)
+    return index['tmcs'] == list(TmcDim(tmcs).tmcs)
+
+
+def cached_cube(cube_path, paths, store_path, tmcs):
+    """Opens a cube, (re)building it and its store first when needed.
+    Args: cube_path, the cube file.
+          paths, the csv source files of the store.
+          store_path, the HDF5 store, see npmrds_store.ensure_store().
+          tmcs, the TMC codes to keep.
+    Returns: cube, a TtCube.
+    """
+    ensure_store(paths, store_path)
+    if not cube_is_current(cube_path, store_path, tmcs):
+        print("Building travel time cube {0}...".format(cube_path))
+        build_cube(cube_path, store_path, tmcs)
+    return TtCube(cube_path)
+
+
+@profiled
+def cube_period_ttr(cube, periods, upper_pct):
+    """Calculates travel time reliability for every TMC and time period from
+    cube slices.
+    Args: cube, a TtCube.
+          periods, a list of (code, weekdays, hours) tuples.
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+    Returns: df_ttr, see periods.calc_period_ttr().
+    """
+    df_ttr = pd.DataFrame({'tmc_code': cube.dim.tmcs.values})
+    has_readings = np.zeros(len(cube.dim), dtype=bool)
+    for code, weekdays, hours in periods:
+        values = cube.select(weekdays, hours).reshape(len(cube.dim), -1)
+        upper, median = row_percentiles(values, [upper_pct, 50])
+        df_ttr[code] = upper / median
+        has_readings |= ~np.isnan(median)
+
+    df_ttr = df_ttr[has_readings].reset_index(drop=True)
+    return df_ttr[['tmc_code'] + period_codes(periods)]
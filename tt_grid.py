@@ -0,0 +1,217 @@
+"""
+tt_grid.py
+
+Dense TMC x 15-minute travel time grids.
+
+NPMRDS feeds share a fixed 15-minute grid, so a feed can be held as a
+(n_tmc x n_epochs) float32 array, rows aligned to a TMC dimension
+(tmc_dim.py) and columns to consecutive 15-minute epochs, with NaN for
+missing readings. Two feeds on the same grid line up without a join: the
+truck/all vehicle fallback is one np.where, and each time period is a set
+of columns, so per-TMC percentiles are a row-wise sort of those columns.
+
+Usage:
+>>>from tt_grid import grid_period_ttr, read_grid, truck_fallback
+>>>truck, truck_present = read_grid(truck_store, dim, months)
+>>>all_tt, present = read_grid(all_store, dim, months)
+>>>drop_missing = truck_missing_rows(truck, truck_present).any()
+>>>grid, present = truck_fallback(truck, all_tt, present, drop_missing)
+>>>df_tttr = grid_period_ttr(grid, dim, grid_start(months), TTTR_PERIODS, 95,
+                             present)
+"""
+
+import pandas as pd
+import numpy as np
+from calendar_keys import calendar_keys
+from npmrds_store import iter_store
+from periods import period_codes, period_lookup
+from profiling import profiled
+from quantiles import sorted_percentile
+
+
+EPOCH_MINUTES = 15
+
+
+def grid_start(months):
+    """Returns the first timestamp of a sorted list of (year, month)."""
+    year, month = months[0]
+    return pd.Timestamp(year=year, month=month, day=1)
+
+
+def grid_epochs(months):
+    """Returns the number of 15-minute epochs spanned by a sorted list of
+    (year, month), first to last month inclusive."""
+    year, month = months[-1]
+    end = pd.Timestamp(year=year, month=month, day=1)
+    end += pd.offsets.MonthBegin()
+    epoch = pd.Timedelta(minutes=EPOCH_MINUTES)
+    return int((end - grid_start(months)) / epoch)
+
+
+def epoch_positions(tstamp, start):
+    """Returns the grid column of each timestamp.
+    Args: tstamp, a datetime64 pandas series.
+          start, the grid's first timestamp.
+    """
+    minutes = (tstamp.values.astype('datetime64[m]').astype(np.int64)
+               - np.datetime64(start, 'm').astype(np.int64))
+    return minutes // EPOCH_MINUTES
+
+
+def fill_grid(grid, present, df, dim, start, value_col='travel_time_seconds'):
+    """Places a chunk of readings into a grid, in place.
+    Args: grid, a (n_tmc x n_epochs) float32 array.
+          present, a boolean array of the same shape, set where a reading
+                   exists (even with a missing travel time).
+          df, a pandas dataframe of readings.
+          dim, the TMC dimension the grid rows follow.
+          start, the grid's first timestamp.
+          value_col, the travel time column.
+    """
+    rows = dim.positions(df['tmc_code'])
+    cols = epoch_positions(df['measurement_tstamp'], start)
+    keep = (rows >= 0) & (cols >= 0) & (cols < grid.shape[1])
+    rows = rows[keep]
+    cols = cols[keep]
+    grid[rows, cols] = df[value_col].values[keep]
+    present[rows, cols] = True
+
+
+@profiled
+def read_grid(store_path, dim, months, value_col='travel_time_seconds'):
+    """Loads a feed from an NPMRDS store into a dense grid, month by month.
+    Args: store_path, the HDF5 store, see npmrds_store.py.
+          dim, the TMC dimension the grid rows follow; other TMCs are not
+               read.
+          months, the sorted list of (year, month) partitions to read.
+          value_col, the travel time column.
+    Returns: grid, a (len(dim) x n_epochs) float32 array, NaN where missing.
+             present, a boolean array marking the readings in the store.
+    """
+    start = grid_start(months)
+    shape = (len(dim), grid_epochs(months))
+    grid = np.full(shape, np.nan, dtype=np.float32)
+    present = np.zeros(shape, dtype=bool)
+    for chunk in iter_store(store_path, columns=[value_col], months=months,
+                            tmcs=dim.tmcs):
+        fill_grid(grid, present, chunk, dim, start, value_col)
+    return grid, present
+
+
+def truck_missing_rows(truck, truck_present):
+    """Finds the grid rows holding a Truck reading with a missing travel
+    time (an empty cell is no reading, not a missing travel time).
+    Args: truck, the Truck travel time grid.
+          truck_present, where Truck readings exist.
+    Returns: a boolean array, one value per row.
+    """
+    return (truck_present & np.isnan(truck)).any(axis=1)
+
+
+@profiled
+def truck_fallback(truck, all_tt, all_present, drop_missing):
+    """Substitutes all vehicle times where Truck times are missing or zero.
+    As with the row-level merge (lottr_truck.fill_truck_times()), all
+    vehicle readings define availability, and all vehicle readings with a
+    missing travel time are dropped only when some Truck reading has one.
+    Args: truck, the Truck travel time grid.
+          all_tt, the all vehicle travel time grid.
+          all_present, where all vehicle readings exist.
+          drop_missing, True if any Truck reading of the TMCs read has a
+                        missing travel time, see truck_missing_rows().
+    Returns: grid, a float32 grid, NaN where no reading is available.
+             available, where readings are available (their travel time
+                        may still be missing).
+    """
+    available = all_present
+    if drop_missing:
+        available = all_present & ~np.isnan(all_tt)
+    fallback = np.isnan(truck) | (truck == 0)
+    grid = np.where(fallback, all_tt, truck)
+    grid[~available] = np.nan
+    return grid, available
+
+
+def grid_tstamps(start, n_epochs):
+    """Returns the timestamp of each grid column (a DatetimeIndex).
+    Args: start, the grid's first timestamp.
+          n_epochs, the number of columns.
+    """
+    return pd.date_range(start, periods=n_epochs,
+                         freq='{0}min'.format(EPOCH_MINUTES))
+
+
+def grid_epoch_keys(start, n_epochs):
+    """Returns the calendar keys of each grid column, see
+    calendar_keys.calendar_keys().
+    Args: start, the grid's first timestamp.
+          n_epochs, the number of columns.
+    """
+    return calendar_keys(pd.Series(grid_tstamps(start, n_epochs)))
+
+
+def grid_periods(start, n_epochs, periods):
+    """Returns the period id of each grid column (-1 outside every period).
+    Args: start, the grid's first timestamp.
+          n_epochs, the number of columns.
+          periods, a list of (code, weekdays, hours) tuples.
+    """
+    keys = grid_epoch_keys(start, n_epochs)
+    index = (keys['weekday'].astype(np.int64) * 24
+             + keys['hour'].astype(np.int64))
+    return period_lookup(periods)[index]
+
+
+def row_percentiles(values, pcts, present=None):
+    """Calculates percentiles of each row's readings.
+    Matches np.percentile on each row's readings bit for bit.
+    Args: values, a 2-D array, NaN where there is no reading.
+          pcts, a list of percentiles, 0-100.
+          present, optional boolean array marking readings; a reading
+                   with a NaN travel time makes its row's result NaN, as
+                   np.percentile does.
+    Returns: a list of float64 arrays, one value per row (NaN for rows
+             without readings), one array per percentile.
+    """
+    is_nan = np.isnan(values)
+    if present is None:
+        nan_counts = np.zeros(len(values), dtype=np.int64)
+    else:
+        nan_counts = (is_nan & present).sum(axis=1)
+    counts = values.shape[1] - is_nan.sum(axis=1)
+
+    # NaN sort last, after each row's readings
+    values = np.sort(values.astype(np.float64), axis=1)
+    starts = np.arange(len(values), dtype=np.int64) * values.shape[1]
+    return [sorted_percentile(values.ravel(), starts, counts, nan_counts,
+                              pct)
+            for pct in pcts]
+
+
+@profiled
+def grid_period_ttr(grid, dim, start, periods, upper_pct, present=None):
+    """Calculates travel time reliability for every TMC and time period from
+    a grid.
+    Args: grid, a (n_tmc x n_epochs) travel time grid.
+          dim, the TMC dimension the grid rows follow.
+          start, the grid's first timestamp.
+          periods, a list of (code, weekdays, hours) tuples.
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+          present, optional boolean grid of readings, see row_percentiles().
+    Returns: df_ttr, see periods.calc_period_ttr().
+    """
+    if present is None:
+        present = ~np.isnan(grid)
+    codes = period_codes(periods)
+    col_periods = grid_periods(start, grid.shape[1], periods)
+
+    df_ttr = pd.DataFrame({'tmc_code': dim.tmcs.values})
+    for i, code in enumerate(codes):
+        cols = col_periods == i
+        upper, median = row_percentiles(grid[:, cols], [upper_pct, 50],
+                                        present[:, cols])
+        df_ttr[code] = upper / median
+
+    # TMCs without any reading in a period
+    in_periods = present[:, col_periods >= 0].any(axis=1)
+    return df_ttr[in_periods].reset_index(drop=True)
@@ -0,0 +1,183 @@
+"""
+tt_hist.py
+
+Exact LOTTR/TTTR from per-(TMC, period) travel time histograms that add up
+across quarter files.
+
+NPMRDS travel times are reported to the hundredth of a second, so counting
+readings in 0.01 s bins loses nothing: a histogram is a table of
+(tmc_code, period, bin, count) rows, where bin is the travel time in
+integer hundredths. Percentiles read from it (quantiles.counts_percentiles)
+are those of the readings on the 0.01 s grid. The schema readers and the
+store keep travel times as float32, within about 1e-7 of their grid value,
+so results agree with np.percentile on the raw readings to float32
+precision. Travel times with more decimals are rounded to the nearest bin,
+and reported.
+
+Readings with a missing travel time can be counted in their own bin
+(MISSING_BIN); as with np.percentile, they make their group's percentiles
+NaN. Histograms may carry extra key columns (see
+lottr_truck.quarter_histogram()), which merging keeps.
+
+Each quarter file's histogram is saved next to it and rebuilt only when the
+file changes, so an annual rerun just sums the saved histograms.
+
+Usage:
+>>>from tt_hist import (annual_period_ttr, cached_histogram, file_histogram,
+                       histogram_path)
+>>>hists = [cached_histogram(histogram_path(path, 'lottr'), [path],
+                             lambda: file_histogram(path, LOTTR_PERIODS))
+            for path in paths]
+>>>df_lottr = annual_period_ttr(hists, 80, period_codes(LOTTR_PERIODS))
+"""
+
+import os
+import pandas as pd
+import numpy as np
+from npmrds_io import iter_npmrds
+from periods import assign_period, ttr_table
+from profiling import profiled
+from quantiles import counts_percentiles
+
+
+# Bins per second
+RESOLUTION = 100
+
+# Bin of readings with a missing travel time
+MISSING_BIN = -1
+
+KEYS = ['tmc_code', 'period']
+
+
+def to_bins(values):
+    """Maps travel times to integer hundredths of a second.
+    Returns: bins, an int32 array.
+             n_off_grid, the number of values not on a 0.01 s step.
+    """
+    scaled = np.asarray(values, dtype=np.float64) * RESOLUTION
+    bins = np.rint(scaled)
+    # float32 sources (the NPMRDS store and schema) are off by about 1e-7
+    # of the value at most
+    tolerance = np.maximum(1e-3, np.abs(scaled) * 1e-6)
+    n_off_grid = int(np.sum(np.abs(scaled - bins) > tolerance))
+    return bins.astype(np.int32), n_off_grid
+
+
+def build_histogram(df, by=KEYS, value_col='travel_time_seconds',
+                    keep_missing=False):
+    """Builds a histogram from a dataframe of readings.
+    Args: df, a pandas dataframe with the by columns.
+          by, the group key columns.
+          value_col, the travel time column.
+          keep_missing, True to count readings with a missing travel time
+                        in MISSING_BIN instead of dropping them.
+    Returns: df_hist, a pandas dataframe of (by..., bin, count) rows, with
+             string tmc_code and period columns.
+    """
+    valid = df[by].notna().all(axis=1).values
+    if not keep_missing:
+        valid = valid & df[value_col].notna().values
+    values = df.loc[valid, value_col].values
+    missing = np.isnan(values.astype(np.float64))
+    bins, n_off_grid = to_bins(np.where(missing, 0, values))
+    if n_off_grid:
+        print("{0} travel times rounded to 0.01 s bins".format(n_off_grid))
+
+    df_hist = pd.DataFrame({col: df.loc[valid, col].astype(str).values
+                            for col in by})
+    df_hist['bin'] = np.where(missing, MISSING_BIN, bins)
+    df_hist = df_hist.groupby(by + ['bin']).size()
+    return df_hist.reset_index(name='count')
+
+
+def merge_histograms(hists):
+    """Adds histograms together, on every column but the count.
+    Args: hists, a list of histogram dataframes with the same columns.
+    Returns: df_hist, the summed histogram.
+    """
+    df_hist = pd.concat(hists, ignore_index=True, sort=False)
+    keys = [col for col in df_hist.columns if col != 'count']
+    df_hist = df_hist.groupby(keys)['count'].sum()
+    return df_hist.reset_index()
+
+
+@profiled
+def hist_period_ttr(df_hist, upper_pct, codes):
+    """Calculates the wide per-TMC reliability table from a histogram.
+    Args: df_hist, a (tmc_code, period) histogram dataframe; readings in
+                   MISSING_BIN make their (TMC, period) ratio NaN.
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+          codes, the period codes, in output column order.
+    Returns: df_ttr, see periods.calc_period_ttr().
+    """
+    bins = df_hist['bin'].values
+    df_hist = df_hist.assign(value=np.where(bins == MISSING_BIN, np.nan,
+                                            bins / RESOLUTION))
+    df_pct = counts_percentiles(df_hist, KEYS, 'value', 'count',
+                                [upper_pct, 50], names=['upper', 'median'])
+    return ttr_table(df_pct, codes)
+
+
+def histogram_path(path, name):
+    """Returns where the histogram of a quarter file is saved, e.g.
+    'data/2019Q1.csv' -> 'data/2019Q1.lottr_hist.h5'."""
+    return os.path.splitext(path)[0] + '.' + name + '_hist.h5'
+
+
+def cached_histogram(hist_path, sources, build):
+    """Loads a saved histogram, or builds and saves it if it is missing or
+    older than any of its source files.
+    Args: hist_path, the HDF5 file the histogram is saved to.
+          sources, the list of files the histogram is built from.
+          build, a function of no arguments returning the histogram.
+    Returns: df_hist, a histogram dataframe.
+    """
+    if os.path.exists(hist_path):
+        hist_mtime = os.path.getmtime(hist_path)
+        if all(not os.path.exists(path)
+               or os.path.getmtime(path) <= hist_mtime for path in sources):
+            return pd.read_hdf(hist_path, 'histogram')
+
+    df_hist = build()
+    df_hist.to_hdf(hist_path, key='histogram', mode='w')
+    return df_hist
+
+
+@profiled
+def file_histogram(path, periods, hours=None, weekdays=None,
+                   value_col='travel_time_seconds'):
+    """Builds the histogram of one NPMRDS csv file, chunk by chunk.
+    Args: path, the csv file.
+          periods, a list of (code, weekdays, hours) tuples.
+          hours, weekdays, optional row filters, see npmrds_io.filter_rows().
+          value_col, the travel time column.
+    Returns: df_hist, a (tmc_code, period) histogram dataframe.
+    """
+    hists = []
+    for chunk in iter_npmrds(path, usecols=['tmc_code', 'measurement_tstamp',
+                                            value_col],
+                             hours=hours, weekdays=weekdays):
+        chunk = assign_period(chunk, periods)
+        hists.append(build_histogram(chunk, value_col=value_col))
+    return merge_histograms(hists)
+
+
+def keep_tmcs(df_hist, tmcs):
+    """Returns the rows of a histogram of a collection of TMC codes."""
+    return df_hist[df_hist['tmc_code'].isin(
+        [str(tmc) for tmc in pd.unique(np.asarray(tmcs))])]
+
+
+@profiled
+def annual_period_ttr(hists, upper_pct, codes, tmcs=None):
+    """Calculates per-TMC reliability from quarter histograms.
+    Args: hists, a list of histogram dataframes (e.g. one per quarter).
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+          codes, the period codes, in output column order.
+          tmcs, optional collection of TMC codes to keep.
+    Returns: df_ttr, see periods.calc_period_ttr().
+    """
+    df_hist = merge_histograms(hists)
+    if tmcs is not None:
+        df_hist = keep_tmcs(df_hist, tmcs)
+    return hist_period_ttr(df_hist, upper_pct, codes)
@@ -0,0 +1,173 @@
+"""
+tt_sketch.py
+
+Bounded-memory LOTTR/TTTR through mergeable per-(TMC, period) quantile
+sketches.
+
+Each travel time is counted in a logarithmic bucket (the DDSketch mapping):
+bucket i covers (gamma^(i-1), gamma^i] with gamma = (1 + e) / (1 - e), and
+is represented by 2 * gamma^i / (gamma + 1), which is within relative error
+e of every value in the bucket. A sketch is a table of
+(tmc_code, period, bucket, count) rows, so:
+    - memory grows with the number of TMCs and periods, not readings;
+    - sketches from different chunks, quarters or files merge by adding
+      counts (merge_sketches), and can be saved with any pandas writer;
+    - every percentile read from a sketch is within relative error e of the
+      exact np.percentile value, so an upper/median ratio is within
+      2e / (1 - e).
+
+Usage:
+>>>from tt_sketch import stream_period_ttr
+>>>chunks = iter_cached(paths, store_path, columns=['travel_time_seconds'])
+>>>df_lottr, df_error = stream_period_ttr(chunks, LOTTR_PERIODS, 80, 0.005)
+"""
+
+import pandas as pd
+import numpy as np
+from periods import assign_period, calc_period_ttr, period_codes, ttr_table
+from profiling import profiled
+from quantiles import counts_percentiles
+
+
+DEFAULT_REL_ERROR = 0.005
+
+# Travel times are clipped to this before taking logs
+MIN_TT = 0.01
+
+KEYS = ['tmc_code', 'period']
+
+
+def log_gamma(rel_error):
+    """Returns log(gamma) for a relative error bound."""
+    return np.log((1 + rel_error) / (1 - rel_error))
+
+
+def to_bucket(values, rel_error):
+    """Maps travel times to their sketch buckets."""
+    values = np.maximum(np.asarray(values, dtype=np.float64), MIN_TT)
+    return np.ceil(np.log(values) / log_gamma(rel_error)).astype(np.int32)
+
+
+def bucket_value(buckets, rel_error):
+    """Returns the representative travel time of sketch buckets."""
+    gamma = (1 + rel_error) / (1 - rel_error)
+    return 2 * np.exp(buckets * log_gamma(rel_error)) / (gamma + 1)
+
+
+def build_sketch(df, rel_error, by=KEYS, value_col='travel_time_seconds'):
+    """Builds a sketch from a chunk of readings.
+    Args: df, a pandas dataframe.
+          rel_error, the relative error bound of the sketch.
+          by, the group key columns.
+          value_col, the travel time column.
+    Returns: df_sketch, a pandas dataframe of (by..., bucket, count) rows.
+    """
+    valid = df[value_col].notna().values
+    df_sketch = df.loc[valid, by].copy()
+    df_sketch['bucket'] = to_bucket(df.loc[valid, value_col], rel_error)
+    df_sketch = df_sketch.groupby(by + ['bucket'], observed=True).size()
+    return df_sketch.reset_index(name='count')
+
+
+def merge_sketches(sketches, by=KEYS):
+    """Merges sketches by adding their bucket counts.
+    Args: sketches, a list of sketch dataframes built with the same
+                    relative error.
+          by, the group key columns.
+    Returns: df_sketch, the merged sketch.
+    """
+    df_sketch = pd.concat(sketches, ignore_index=True, sort=False)
+    df_sketch = df_sketch.groupby(by + ['bucket'], observed=True)['count']
+    return df_sketch.sum().reset_index()
+
+
+def sketch_percentiles(df_sketch, rel_error, pcts, names=None, by=KEYS):
+    """Reads percentiles per group from a sketch.
+    Args: df_sketch, a sketch dataframe.
+          rel_error, the relative error the sketch was built with.
+          pcts, a list of percentiles, 0-100.
+          names, optional list of output column names.
+          by, the group key columns.
+    Returns: df_pct, a pandas dataframe laid out as in
+             quantiles.grouped_percentiles().
+    """
+    df_sketch = df_sketch.assign(
+        value=bucket_value(df_sketch['bucket'].values, rel_error))
+    return counts_percentiles(df_sketch, by, 'value', 'count', pcts, names)
+
+
+def sketch_period_ttr(df_sketch, upper_pct, rel_error, codes):
+    """Calculates the wide per-TMC reliability table from a sketch.
+    Args: df_sketch, a (tmc_code, period) sketch dataframe.
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+          rel_error, the relative error the sketch was built with.
+          codes, the period codes, in output column order.
+    Returns: df_ttr, see periods.calc_period_ttr().
+    """
+    df_pct = sketch_percentiles(df_sketch, rel_error, [upper_pct, 50],
+                                names=['upper', 'median'])
+    return ttr_table(df_pct, codes)
+
+
+def ttr_error(df_approx, df_exact, codes):
+    """Compares approximate reliability ratios with exact ones.
+    Args: df_approx, df_exact, wide reliability tables.
+          codes, the period code columns to compare.
+    Returns: df_error, a one-row pandas dataframe with the number of TMCs
+             compared and the max absolute and relative ratio errors.
+    """
+    df = pd.merge(df_exact, df_approx, on='tmc_code', suffixes=('', '_est'))
+    exact = df[codes].values
+    approx = df[[code + '_est' for code in codes]].values
+    abs_error = np.abs(approx - exact)
+    return pd.DataFrame({'n_tmcs': [len(df)],
+                         'max_abs_error': [np.nanmax(abs_error)],
+                         'max_rel_error': [np.nanmax(abs_error / exact)]})
+
+
+@profiled
+def stream_period_ttr(chunks, periods, upper_pct,
+                      rel_error=DEFAULT_REL_ERROR, n_check=50,
+                      value_col='travel_time_seconds'):
+    """Calculates per-TMC reliability from streamed chunks of readings.
+    Only the running sketch is held in memory, plus the raw readings of
+    n_check TMCs (sampled from the first chunk), which are used to measure
+    the achieved error against the exact np.percentile path. Missing travel
+    times are skipped.
+    Args: chunks, an iterable of pandas dataframes (e.g. from
+                  npmrds_io.iter_npmrds or npmrds_store.iter_store).
+          periods, a list of (code, weekdays, hours) tuples.
+          upper_pct, the upper percentile (80 for LOTTR, 95 for TTTR).
+          rel_error, the sketch's relative error bound.
+          n_check, the number of TMCs to check against the exact path.
+          value_col, the travel time column.
+    Returns: df_ttr, see periods.calc_period_ttr().
+             df_error, see ttr_error().
+    """
+    codes = period_codes(periods)
+    df_sketch = None
+    check_tmcs = None
+    check_frames = []
+    for chunk in chunks:
+        chunk = assign_period(chunk, periods)
+        if check_tmcs is None:
+            tmcs = np.sort(pd.unique(chunk['tmc_code'].dropna().astype(str)))
+            check_tmcs = np.random.RandomState(0).choice(
+                tmcs, min(n_check, len(tmcs)), replace=False)
+        is_check = (chunk['tmc_code'].astype(str).isin(check_tmcs).values
+                    & chunk[value_col].notna().values)
+        check_frames.append(chunk.loc[is_check, KEYS + [value_col]])
+
+        df_chunk = build_sketch(chunk, rel_error, value_col=value_col)
+        if df_sketch is None:
+            df_sketch = df_chunk
+        else:
+            df_sketch = merge_sketches([df_sketch, df_chunk])
+
+    df_ttr = sketch_period_ttr(df_sketch, upper_pct, rel_error, codes)
+
+    df_check = pd.concat(check_frames, ignore_index=True, sort=False)
+    df_exact = calc_period_ttr(df_check, upper_pct, value_col)
+    df_error = ttr_error(df_ttr, df_exact, codes)
+    df_error['ratio_error_bound'] = 2 * rel_error / (1 - rel_error)
+    return df_ttr, df_error